@@ -0,0 +1,195 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that runs the calculations of my Final Project without plotting
+anything. Every research question is split into compute functions that
+return tidy DataFrames (or dictionaries) and plot functions that only draw
+them, and this module lists every compute function by name so its results
+can be used on their own (ex: as JSON in another program). Importing it does
+not import Matplotlib or Seaborn.
+
+Example: python analysis.py rq2_genre_counts_yearly --year 2019
+"""
+
+import json
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import data_loading
+import rq_four
+import rq_one
+import rq_three
+import rq_two
+
+# datasets are loaded and passed to func first
+Analysis = namedtuple("Analysis", ["name", "func", "datasets", "args",
+                                   "kwargs"])
+
+
+def analysis(name, func, datasets=(), *args, **kwargs):
+    """Declares an analysis
+
+    Parameters
+    ----------
+    name : String
+        Unique name of the analysis. The part before the first "_" is its
+        group (ex: "rq2_genre_counts" is in "rq2")
+    func : Function
+        The compute function of the analysis
+    datasets : List
+        Names of the cleaned datasets (see data_loading) passed to func first
+    *args, **kwargs
+        Passed to func after the datasets
+
+    Returns
+    -------
+    Analysis
+        Returns the declared analysis
+    """
+
+    return Analysis(name, func, tuple(datasets), args, kwargs)
+
+
+def get_analyses(year=2019):
+    """Returns every analysis of the project
+
+    Parameters
+    ----------
+    year : Integer
+        The retrieved year that is compared with the anime from before 2018
+
+    Returns
+    -------
+    List
+        Returns the analyses in the order of the research questions
+    """
+
+    season = f"anime_{year}"
+    return [
+        analysis("rq1_average_user", rq_one.average_user, ["users"]),
+        analysis("rq1_average_by_gender", rq_one.average_by_gender,
+                 ["users"]),
+        analysis("rq1_time_spent_by_age", rq_one.time_spent_by_age,
+                 ["users"]),
+        analysis("rq1_genre_gender_counts", rq_one.genre_gender_counts,
+                 ["anime", "users"]),
+        analysis("rq1_genre_gender_ratios", rq_one.genre_gender_ratios,
+                 ["anime", "users"]),
+
+        analysis("rq2_genre_counts", rq_two.genre_counts, ["anime"]),
+        analysis("rq2_main_genre_counts", rq_two.main_genre_counts,
+                 ["anime"]),
+        analysis(f"rq2_genre_counts{year}", rq_two.genre_counts, [season]),
+        analysis(f"rq2_main_genre_counts{year}", rq_two.main_genre_counts,
+                 [season]),
+        analysis("rq2_genre_counts_yearly", rq_two.genre_counts_yearly,
+                 ["anime"]),
+        analysis("rq2_genre_scores_yearly", rq_two.genre_scores_yearly,
+                 ["anime"]),
+        analysis("rq2_average_genre_scores", rq_two.average_genre_scores,
+                 ["anime"]),
+
+        analysis("rq3_studio_scores_yearly", rq_three.studio_scores_yearly,
+                 ["anime"]),
+        analysis("rq3_studio_averages", rq_three.studio_averages, ["anime"]),
+        analysis("rq3_top_genres", rq_three.top_genres, ["anime"]),
+        analysis("rq3_genre_studio_scores", rq_three.genre_studio_scores,
+                 ["anime"]),
+        analysis("rq3_studio_counts", rq_three.studio_counts, ["anime"]),
+        analysis("rq3_studio_counts_yearly", rq_three.studio_counts_yearly,
+                 ["anime"]),
+
+        analysis("rq4_depth_errors", rq_four.depth_errors,
+                 ["anime", season]),
+        analysis("rq4_feature_importance", rq_four.feature_importance,
+                 ["anime", season]),
+        analysis("rq4_compare_engines", rq_four.compare_engines,
+                 ["anime", season])
+    ]
+
+
+def to_records(result):
+    """Converts the result of a compute function to plain Python values
+
+    Parameters
+    ----------
+    result : Object
+        A DataFrame, Series, Index, list, dictionary or number
+
+    Returns
+    -------
+    Object
+        Returns DataFrames and Series as lists of row dictionaries (a named
+        index becomes a column), Indexes as lists and NumPy numbers as Python
+        numbers, so the result can be saved with json.dumps
+    """
+
+    if isinstance(result, pd.Series):
+        result = result.to_frame()
+    if isinstance(result, pd.DataFrame):
+        if not isinstance(result.index, pd.RangeIndex):
+            result = result.reset_index()
+        return json.loads(result.to_json(orient="records"))
+    if isinstance(result, pd.Index):
+        return to_records(result.to_list())
+    if isinstance(result, dict):
+        return {key: to_records(value) for key, value in result.items()}
+    if isinstance(result, (list, tuple)):
+        return [to_records(value) for value in result]
+    if isinstance(result, np.generic):
+        return result.item()
+    return result
+
+
+def run(name, datasets=None, year=2019):
+    """Runs an analysis
+
+    Parameters
+    ----------
+    name : String
+        The name of the analysis (see get_analyses)
+    datasets : Dictionary
+        Already loaded datasets by name. Missing ones are loaded
+    year : Integer
+        The retrieved year that is compared with the anime from before 2018
+
+    Returns
+    -------
+    Object
+        Returns the result of the analysis as plain Python values (see
+        to_records)
+    """
+
+    analyses = {current.name: current for current in get_analyses(year)}
+    if name not in analyses:
+        raise ValueError(f"Unknown analysis {name}")
+    current = analyses[name]
+    datasets = datasets or {}
+    loaded = [datasets[dataset] if dataset in datasets
+              else data_loading.load(dataset)
+              for dataset in current.datasets]
+    return to_records(current.func(*loaded, *current.args,
+                                   **current.kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("name", nargs="?",
+                        help="analysis to print as JSON")
+    parser.add_argument("--year", type=int, default=2019,
+                        help="retrieved year to compare against")
+    parser.add_argument("--list", action="store_true",
+                        help="list the analyses and their datasets")
+    args = parser.parse_args()
+    if args.list or args.name is None:
+        for current in get_analyses(args.year):
+            print(f"{current.name}: {', '.join(current.datasets)}")
+    else:
+        try:
+            print(json.dumps(run(args.name, year=args.year), indent=2))
+        except ValueError as error:
+            parser.error(str(error))
@@ -0,0 +1,595 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that pre-aggregates the anime data into a cube over aired year,
+type, source, genre and studio. Every cell keeps the amount of anime, the sum
+and sum of squares of their scores and the sums of their favorites and
+members, so counts, averages and variances by any of the dimensions are sums
+over a few cells instead of scans (and string splits) of the whole anime
+table. Genres and studios are multi-label, so they are expanded when the cube
+is built: an anime is in one cell per genre and studio pairing it has.
+
+The cells are sums, so a cube can also take in a new batch of anime (ex: a
+newly retrieved season) or take back a batch that was corrected, in time
+that depends on the batch and not on the anime already in it.
+"""
+
+import weakref
+from itertools import combinations
+import numpy as np
+import pandas as pd
+import label_index
+import tracing
+
+DIMENSIONS = ["aired_from_year", "type", "source", "genre", "studio"]
+# Dimensions where an anime can have more than one value
+LABELS = ["genre", "studio"]
+COLUMNS = ["count", "score_sum", "score_sumsq", "favorites", "members"]
+# Roll-ups count straight into an array of every possible cell when it has
+# at most this many cells per summed row (or very few cells), and sort the
+# cells otherwise
+DENSE_RATIO = 4
+DENSE_CELLS = 2 ** 16
+# New cells are merged into the sorted cells once there are this many times
+# fewer of them
+MERGE_RATIO = 8
+
+_cubes = {}
+
+
+class Cells:
+    """Sums of the cells of a view that batches of cells can be added to
+
+    Parameters
+    ----------
+    dimensions : List
+        The dimensions of the cells
+
+    Attributes
+    ----------
+    keys : Array
+        The sorted key of every cell (see AnimeCube.encode)
+    sums : Dictionary
+        The sums of every cell by column (see COLUMNS)
+
+    Notes
+    -----
+    New cells are kept apart (and sorted) until there are enough of them to
+        be worth merging, so adding a batch mostly searches the cells that
+        are already there instead of copying them
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = list(dimensions)
+        self.keys = np.zeros(0, dtype="int64")
+        self.sums = {column: np.zeros(0) for column in COLUMNS}
+        self._new_keys = self.keys
+        self._new_sums = self.sums
+
+    def add(self, keys, sums):
+        """Adds sums to cells, making the cells that don't exist yet
+
+        Parameters
+        ----------
+        keys : Array
+            The unique keys of the cells
+        sums : Dictionary
+            The sums to add by column (negative to take them back)
+        """
+
+        missing = np.ones(len(keys), dtype=bool)
+        for found_keys, found_sums in [(self.keys, self.sums),
+                                       (self._new_keys, self._new_sums)]:
+            if not len(found_keys) or not missing.any():
+                continue
+            position = np.searchsorted(found_keys, keys[missing]) \
+                .clip(max=len(found_keys) - 1)
+            found = found_keys[position] == keys[missing]
+            rows = np.flatnonzero(missing)[found]
+            for column in COLUMNS:
+                found_sums[column][position[found]] += sums[column][rows]
+            missing[rows] = False
+
+        if missing.any():
+            self._new_keys, self._new_sums = _merge(
+                self._new_keys, self._new_sums, keys[missing],
+                {column: sums[column][missing] for column in COLUMNS})
+            if len(self._new_keys) * MERGE_RATIO > len(self.keys):
+                self.compact()
+
+    def compact(self):
+        """Merges the new cells into the sorted cells"""
+
+        if len(self._new_keys):
+            self.keys, self.sums = _merge(self.keys, self.sums,
+                                          self._new_keys, self._new_sums)
+            self._new_keys = np.zeros(0, dtype="int64")
+            self._new_sums = {column: np.zeros(0) for column in COLUMNS}
+
+    def rekey(self, change):
+        """Changes the key of every cell without changing their order
+
+        Parameters
+        ----------
+        change : Function
+            Takes an array of keys and returns their new keys
+        """
+
+        self.keys = change(self.keys)
+        self._new_keys = change(self._new_keys)
+
+
+def _merge(keys, sums, other_keys, other_sums):
+    """Returns the sorted keys and sums of two sets of cells without any
+    shared keys
+    """
+
+    keys = np.concatenate([keys, other_keys])
+    order = np.argsort(keys, kind="stable")
+    return keys[order], \
+        {column: np.concatenate([sums[column], other_sums[column]])[order]
+         for column in COLUMNS}
+
+
+class AnimeCube:
+    """Pre-aggregated anime data
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data. Dimensions it
+        doesn't have (ex: the aired year of a retrieved season) are left out
+
+    Attributes
+    ----------
+    dimensions : List
+        The dimensions of the cube (see DIMENSIONS)
+    labels : List
+        The multi-label dimensions of the cube (see LABELS)
+    members : Dictionary
+        Every dimension's values (Index). They are sorted, except for values
+        first seen in a later batch which are added to the end. Cells keep
+        the position of their value in it
+    views : Dictionary
+        The Cells of every combination of expanded labels, keyed by the
+        labels (ex: ("genre",)). Every view has all the other dimensions, so
+        rolling one up is a sum, and anime are only in as many cells of a
+        view as they have labels in its combination
+
+    Notes
+    -----
+    Cells without anime are not stored. The views are built together from
+        one split of the genre and studio columns (see label_index), and
+        every roll-up of a view to a set of dimensions is kept (and kept up
+        to date by append and retract), so asking again (ex: with other
+        filters) only sums a few cells
+    """
+
+    def __init__(self, data):
+        self.dimensions = [dimension for dimension in DIMENSIONS
+                           if dimension in data]
+        self.labels = [label for label in LABELS if label in data]
+        self.members = {dimension: pd.Index([])
+                        for dimension in self.dimensions}
+        self._capacity = {dimension: 1 for dimension in self.dimensions}
+        self.views = {}
+        for size in range(len(self.labels) + 1):
+            for labels in combinations(self.labels, size):
+                self.views[labels] = Cells(
+                    [dimension for dimension in self.dimensions
+                     if dimension not in self.labels or dimension in labels])
+        self._rolled = {}
+        self.append(data)
+
+    def encode(self, codes, dimensions, rows):
+        """Returns the keys of cells from the codes of their dimensions
+
+        Parameters
+        ----------
+        codes : List
+            An array of codes per dimension
+        dimensions : List
+            The dimensions of the codes
+        rows : Integer
+            The amount of cells
+
+        Returns
+        -------
+        Array
+            Returns the keys. Every dimension takes up a power of two that
+            fits its members, so keys keep their order when a dimension gets
+            more members
+        """
+
+        keys = np.zeros(rows, dtype="int64")
+        for dimension_codes, dimension in zip(codes, dimensions):
+            keys = keys * self._capacity[dimension] + dimension_codes
+        return keys
+
+    def decode(self, keys, dimensions, capacity=None):
+        """Returns the codes of every dimension of keys (see encode)"""
+
+        capacity = capacity or self._capacity
+        codes = []
+        for dimension in reversed(dimensions):
+            keys, dimension_codes = np.divmod(keys, capacity[dimension])
+            codes.append(dimension_codes)
+        return codes[::-1]
+
+    def _add_members(self, dimension, values):
+        """Adds the values of a batch that aren't members yet and returns
+        the members' positions of the values
+        """
+
+        members = self.members[dimension]
+        positions = members.get_indexer(values) if len(members) \
+            else np.full(len(values), -1)
+        new = positions == -1
+        if new.any():
+            positions[new] = np.arange(len(members), len(members) + new.sum())
+            members = members.append(values[new]) if len(members) \
+                else values
+            self.members[dimension] = members
+
+        capacity = dict(self._capacity)
+        while self._capacity[dimension] < len(members):
+            self._capacity[dimension] *= 2
+        if capacity != self._capacity:
+            if sum(np.log2(list(self._capacity.values()))) > 62:
+                raise ValueError("Too many members to key the cells")
+            for table in [*self.views.values(), *self._rolled.values()]:
+                table.rekey(lambda keys, table=table: self.encode(
+                    self.decode(keys, table.dimensions, capacity),
+                    table.dimensions, len(keys)))
+        return positions
+
+    def _batch_views(self, data, sign):
+        """Returns the keys and sums of the cells of a batch in every view"""
+
+        missing = [dimension for dimension in self.dimensions
+                   if dimension not in data]
+        if missing:
+            raise ValueError(f"The batch has no {', '.join(missing)} column")
+        codes = {}
+        matrices = {}
+        for dimension in self.dimensions:
+            if dimension in self.labels:
+                index = label_index.get(data, dimension)
+                positions = self._add_members(dimension, index.vocabulary)
+                matrices[dimension] = (index.matrix.indptr,
+                                       positions[index.matrix.indices],
+                                       index.matrix.data)
+            else:
+                batch_codes, values = pd.factorize(
+                    data[dimension].to_numpy(), sort=True,
+                    use_na_sentinel=False)
+                codes[dimension] = \
+                    self._add_members(dimension, pd.Index(values))[batch_codes]
+
+        score = data["score"].to_numpy(dtype="float64")
+        values = {
+            "count": np.ones(len(data)),
+            "score_sum": score,
+            "score_sumsq": score ** 2,
+            "favorites": data["favorites"].to_numpy(dtype="float64"),
+            "members": data["members"].to_numpy(dtype="float64")
+        }
+        batches = {}
+        for labels, view in self.views.items():
+            rows, weights, label_codes = _expand(
+                len(data), [matrices[label] for label in labels])
+            view_codes = {**{dimension: dimension_codes[rows]
+                             for dimension, dimension_codes in codes.items()},
+                          **dict(zip(labels, label_codes))}
+            batches[labels] = _sum(
+                self.encode([view_codes[dimension]
+                             for dimension in view.dimensions],
+                            view.dimensions, len(rows)),
+                {column: sign * weights * value[rows]
+                 for column, value in values.items()})
+        return batches
+
+    def _roll(self, keys, sums, dimensions, rolled_dimensions):
+        """Sums cells of some dimensions to fewer of them"""
+
+        codes = dict(zip(dimensions, self.decode(keys, dimensions)))
+        return _sum(self.encode([codes[dimension]
+                                 for dimension in rolled_dimensions],
+                                rolled_dimensions, len(keys)), sums)
+
+    def _update(self, data, sign):
+        """Adds (sign 1) or takes back (sign -1) a batch of anime"""
+
+        batches = self._batch_views(data, sign)
+        for labels, view in self.views.items():
+            keys, sums = batches[labels]
+            view.add(keys, sums)
+            for (rolled_labels, dimensions), table in self._rolled.items():
+                if rolled_labels == labels:
+                    table.add(*self._roll(keys, sums, view.dimensions,
+                                          dimensions))
+
+    @tracing.traced("compute")
+    def append(self, data):
+        """Adds a batch of anime to the cube
+
+        Parameters
+        ----------
+        data : DataFrame
+            Pandas DataFrame that contains anime show data with every
+            dimension of the cube (ex: a retrieved season with its year,
+            season.assign(aired_from_year=2019))
+        """
+
+        self._update(data, 1)
+
+    @tracing.traced("compute")
+    def retract(self, data):
+        """Takes a batch of anime that was appended before out of the cube
+        (ex: before appending a corrected version of it)
+
+        Parameters
+        ----------
+        data : DataFrame
+            Pandas DataFrame that contains the anime exactly as they were
+            appended
+        """
+
+        self._update(data, -1)
+
+    def rollup(self, by=(), where=None, expand=None):
+        """Sums the cells of the cube by some of its dimensions
+
+        Parameters
+        ----------
+        by : List
+            The dimensions to keep (or one dimension). Every other dimension
+            is rolled up
+        where : Dictionary
+            The values to keep of any dimension. Either a list of values or a
+            function that is given the dimension's members and returns which
+            ones to keep (ex: {"aired_from_year": lambda years: years < 2018})
+        expand : List
+            Labels to expand even though they are rolled up, so an anime
+            counts once per label it has (ex: the genre averages of rq_three
+            weigh anime by how many studios made them)
+
+        Returns
+        -------
+        DataFrame
+            Returns a Pandas DataFrame of the COLUMNS indexed by the kept
+            dimensions (in sorted order). Combinations without anime are left
+            out
+
+        Notes
+        -----
+        An anime with more than one of the kept labels (or of the labels
+            it is filtered by) is counted once for each of them
+        """
+
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        unknown = set(by + list(where) + list(expand or ())) - \
+            set(self.dimensions)
+        if unknown:
+            raise ValueError(f"Unknown dimensions {sorted(unknown)}")
+        labels = tuple(label for label in self.labels
+                       if label in by or label in where or
+                       label in (expand or ()))
+        table = self._cells([dimension for dimension in self.dimensions
+                             if dimension in by or dimension in where],
+                            labels)
+        codes = dict(zip(table.dimensions,
+                         self.decode(table.keys, table.dimensions)))
+        keep = np.ones(len(table.keys), dtype=bool)
+        for dimension, values in where.items():
+            members = self.members[dimension]
+            found = values(members) if callable(values) \
+                else members.isin(values)
+            keep &= np.asarray(found)[codes[dimension]]
+
+        sizes = [len(self.members[dimension]) for dimension in by]
+        keys = np.zeros(keep.sum(), dtype="int64")
+        for dimension, size in zip(by, sizes):
+            keys = keys * size + codes[dimension][keep]
+        keys, sums = _sum(keys, {column: table.sums[column][keep]
+                                 for column in COLUMNS}, int(np.prod(sizes)))
+        result = pd.DataFrame(sums)
+        result["count"] = np.rint(result["count"]).astype("int64")
+        if not by:
+            return result
+
+        positions = []
+        for size in reversed(sizes):
+            keys, dimension_codes = np.divmod(keys, size)
+            positions.append(dimension_codes)
+        values = [self.members[dimension][dimension_codes] for dimension,
+                  dimension_codes in zip(by, reversed(positions))]
+        result.index = pd.MultiIndex.from_arrays(values, names=by) \
+            if len(by) > 1 else values[0].rename(by[0])
+        if not all(self.members[dimension].is_monotonic_increasing
+                   for dimension in by):
+            result = result.sort_index()
+        return result
+
+    def _cells(self, dimensions, labels):
+        """Returns the cells of a view rolled up to some of its dimensions,
+        keeping them for later roll-ups to the same dimensions
+        """
+
+        key = (labels, tuple(dimensions))
+        if key not in self._rolled:
+            view = self.views[labels]
+            view.compact()
+            table = Cells(dimensions)
+            table.add(*self._roll(view.keys, view.sums, view.dimensions,
+                                  dimensions))
+            self._rolled[key] = table
+        table = self._rolled[key]
+        table.compact()
+        return table
+
+    def counts(self, by=(), where=None, expand=None):
+        """Returns the amount of anime by some dimensions (see rollup)"""
+
+        return self.rollup(by, where, expand)["count"]
+
+    def means(self, by=(), where=None, expand=None, measure="score"):
+        """Returns the average of a measure by some dimensions (see rollup)
+
+        Parameters
+        ----------
+        measure : String
+            "score", "favorites" or "members"
+        """
+
+        cells = self.rollup(by, where, expand)
+        column = "score_sum" if measure == "score" else measure
+        return (cells[column] / cells["count"]).rename(measure)
+
+    def variances(self, by=(), where=None, expand=None):
+        """Returns the (population) variance of the scores by some dimensions
+        (see rollup)
+        """
+
+        cells = self.rollup(by, where, expand)
+        mean = cells["score_sum"] / cells["count"]
+        return (cells["score_sumsq"] / cells["count"] - mean ** 2) \
+            .clip(lower=0).rename("score")
+
+
+def _expand(rows, matrices):
+    """Pairs every row with each combination of its labels
+
+    Parameters
+    ----------
+    rows : Integer
+        The amount of rows
+    matrices : List
+        The indptr, indices and data arrays of sparse row by label matrices
+        (see label_index.LabelIndex)
+
+    Returns
+    -------
+    Tuple
+        Returns the row, the weight (how many times the labels are tagged)
+        and the label of every matrix of each pairing
+    """
+
+    pairs = np.arange(rows)
+    weights = np.ones(rows)
+    codes = []
+    for indptr, indices, data in matrices:
+        lengths = np.diff(indptr)[pairs]
+        starts = np.cumsum(lengths) - lengths
+        entries = indptr[np.repeat(pairs, lengths)] + \
+            np.arange(lengths.sum()) - np.repeat(starts, lengths)
+        codes = [np.repeat(label_codes, lengths) for label_codes in codes]
+        codes.append(indices[entries])
+        weights = np.repeat(weights, lengths) * data[entries]
+        pairs = np.repeat(pairs, lengths)
+    return pairs, weights, codes
+
+
+def _sum(keys, values, cells=None):
+    """Sums values by key
+
+    Parameters
+    ----------
+    keys : Array
+        The key of every value
+    values : Dictionary
+        Arrays of the values to sum by column
+    cells : Integer
+        The amount of possible keys (0 to cells - 1), or None if unknown
+
+    Returns
+    -------
+    Tuple
+        Returns the sorted keys whose count isn't 0 and their sums
+    """
+
+    if cells is not None and \
+            cells <= max(DENSE_RATIO * len(keys), DENSE_CELLS):
+        sums = {column: np.bincount(keys, value, minlength=cells)
+                for column, value in values.items()}
+        found = np.flatnonzero(sums["count"])
+        return found, {column: value[found] for column, value in sums.items()}
+    keys, inverse = np.unique(keys, return_inverse=True)
+    sums = {column: np.bincount(inverse, value, minlength=len(keys))
+            for column, value in values.items()}
+    found = np.flatnonzero(sums["count"])
+    return keys[found], \
+        {column: value[found] for column, value in sums.items()}
+
+
+def differences(cube, data, tolerance=1e-6):
+    """Compares a cube that was appended to (or retracted from) with a cube
+    built from scratch
+
+    Parameters
+    ----------
+    cube : AnimeCube
+        The maintained cube
+    data : DataFrame
+        Pandas DataFrame of every anime the cube should have
+    tolerance : Float
+        The largest relative (and absolute) difference of a sum that is
+        still the same
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per view, cell and column whose sums differ with the
+        view, cell (its values), column and both sums. It is empty if the
+        cube is consistent
+    """
+
+    fresh = AnimeCube(data)
+    rows = []
+    for labels, view in fresh.views.items():
+        kept = cube.rollup(view.dimensions)
+        rebuilt = fresh.rollup(view.dimensions)
+        kept, rebuilt = kept.align(rebuilt, fill_value=0)
+        for column in COLUMNS:
+            same = np.isclose(kept[column], rebuilt[column],
+                              rtol=tolerance, atol=tolerance)
+            for cell in kept.index[~same]:
+                rows.append({"view": "+".join(labels) or "-", "cell": cell,
+                             "column": column,
+                             "maintained": kept.at[cell, column],
+                             "recomputed": rebuilt.at[cell, column]})
+    return pd.DataFrame(rows, columns=["view", "cell", "column",
+                                       "maintained", "recomputed"])
+
+
+@tracing.traced("compute")
+def get(data):
+    """Returns the AnimeCube of a DataFrame, building it once
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Returns
+    -------
+    AnimeCube
+        Returns the cube of the data
+
+    Notes
+    -----
+    Cubes are remembered for as long as the DataFrame exists (like
+        label_index.get), so every research question reuses the same cube
+    """
+
+    key = id(data)
+    if key in _cubes:
+        reference, cube = _cubes[key]
+        if reference() is data:
+            return cube
+    cube = AnimeCube(data)
+    _cubes[key] = (weakref.ref(data, lambda _: _cubes.pop(key, None)), cube)
+    return cube
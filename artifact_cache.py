@@ -0,0 +1,308 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that caches expensive intermediate results (genre by gender counts,
+feature matrices, fitted trees, ...) for my Final Project. Every result is
+saved under a key made from hashes of its input data, its parameters and the
+code that builds it, so anything stale is rebuilt automatically and reruns on
+unchanged data skip the heavy work.
+"""
+
+import os
+import ast
+import sys
+import json
+import pickle
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = "data/cache"
+MAX_BYTES = 2 * 1024 ** 3
+# The source hash and imports of every read module by path
+_sources = {}
+
+
+def file_hash(path):
+    """Returns the hash of the contents of a file
+
+    Parameters
+    ----------
+    path : String
+        Path of the file
+
+    Returns
+    -------
+    String
+        Returns the SHA-256 hex digest of the file
+
+    Notes
+    -----
+    Hashes are remembered in {CACHE_DIR}/file_hashes.json by file size and
+        modification time, so a big file is only read again when it changes
+    """
+
+    stat = os.stat(path)
+    memo_path = os.path.join(CACHE_DIR, "file_hashes.json")
+    try:
+        with open(memo_path) as file:
+            memo = json.load(file)
+    except (OSError, ValueError):
+        memo = {}
+    key = os.path.abspath(path)
+    if key in memo and memo[key][:2] == [stat.st_size, stat.st_mtime_ns]:
+        return memo[key][2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    memo[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(memo_path, json.dumps(memo).encode())
+    return memo[key][2]
+
+
+def frame_hash(data):
+    """Returns the hash of the contents of a DataFrame or Series
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame (or Series) to hash
+
+    Returns
+    -------
+    String
+        Returns the SHA-256 hex digest of the values, index and columns
+
+    Notes
+    -----
+    The values are hashed on every call (it is fast next to the results that
+        are cached), so a DataFrame that was changed in place gets a new hash
+    """
+
+    digest = hashlib.sha256(
+        pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    if isinstance(data, pd.DataFrame):
+        digest.update(repr(list(zip(data.columns, data.dtypes))).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """Returns a hash that changes whenever an input of a result changes
+
+    Parameters
+    ----------
+    value : Object
+        A file path, DataFrame, Series, NumPy array or anything with a stable
+        repr (numbers, strings, lists, ...)
+
+    Returns
+    -------
+    String
+        Returns the hex digest of the input
+    """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return frame_hash(value)
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).tobytes() +
+                              str(value.dtype).encode()).hexdigest()
+    if isinstance(value, str) and os.path.isfile(value):
+        return file_hash(value)
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def code_dependencies(path):
+    """Returns the modules that the code of a module depends on
+
+    Parameters
+    ----------
+    path : String
+        Path of the module's source file
+
+    Returns
+    -------
+    List
+        Returns the sorted paths of the module and of every module in the
+        same folder that it imports, directly or through those modules
+
+    Notes
+    -----
+    Imports inside functions count too, and modules from outside the folder
+        (ex: pandas) are left out
+    """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    found = {os.path.abspath(path)}
+    pending = list(found)
+    while pending:
+        for name in _read_source(pending.pop())[1]:
+            dependency = os.path.join(directory, name.split(".")[0] + ".py")
+            if dependency not in found and os.path.isfile(dependency):
+                found.add(dependency)
+                pending.append(dependency)
+    return sorted(found)
+
+
+def code_version(build, modules=None):
+    """Returns a hash of the source code a function depends on
+
+    Parameters
+    ----------
+    build : Function
+        The function that builds a result
+    modules : List
+        Names of the modules whose code build runs. Defaults to the module
+        build is in. If given, the source of build itself is hashed instead
+        of its whole module (ex: a small wrapper in a module that imports
+        everything)
+
+    Returns
+    -------
+    String
+        Returns the hex digest of the sources of the modules and of every
+        module they import from the same folder (see code_dependencies), or
+        of the function's name if build has no source
+    """
+
+    paths = set()
+    for module in modules or [build.__module__]:
+        try:
+            paths.update(code_dependencies(
+                inspect.getsourcefile(sys.modules[module])))
+        except (TypeError, KeyError):
+            pass
+    try:
+        own_source = inspect.getsource(build) if modules else ""
+    except (OSError, TypeError):
+        own_source = build.__qualname__
+    if not paths and not own_source:
+        return hashlib.sha256(build.__qualname__.encode()).hexdigest()
+    digest = hashlib.sha256(own_source.encode())
+    for path in sorted(paths):
+        digest.update(_read_source(path)[0].encode())
+    return digest.hexdigest()
+
+
+def _read_source(path):
+    """Returns the source hash of a module and the names it imports,
+    reading the file again only when it changes
+    """
+
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    if path not in _sources or _sources[path][0] != key:
+        with open(path, "rb") as file:
+            source = file.read()
+        names = []
+        for node in ast.walk(ast.parse(source)):
+            if isinstance(node, ast.Import):
+                names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and \
+                    not node.level:
+                names.append(node.module)
+        _sources[path] = (key, hashlib.sha256(source).hexdigest(), names)
+    return _sources[path][1:]
+
+
+def cached(name, build, inputs=(), params=None, version=None,
+           max_bytes=MAX_BYTES):
+    """Returns the cached result of build(), building and saving it if needed
+
+    Parameters
+    ----------
+    name : String
+        Name of the kind of result (ex: "genre_gender")
+    build : Function
+        Function without arguments that computes the result
+    inputs : List
+        The data the result depends on (file paths, DataFrames, arrays)
+    params : Dictionary
+        The parameters the result depends on
+    version : String
+        Version of the code that builds the result. Defaults to a hash of the
+        source of the module that build is defined in and of the modules it
+        imports (see code_version)
+    max_bytes : Integer
+        The most bytes the cache may hold before old results are evicted
+
+    Returns
+    -------
+    Object
+        Returns the (possibly cached) result
+
+    Notes
+    -----
+    File Path: data/cache/{name}-{key}.pkl
+    """
+
+    key = hashlib.sha256(json.dumps({
+        "name": name,
+        "inputs": [fingerprint(value) for value in inputs],
+        "params": repr(sorted((params or {}).items())),
+        "version": version if version else code_version(build)
+    }).encode()).hexdigest()[:24]
+    path = os.path.join(CACHE_DIR, f"{name}-{key}.pkl")
+    try:
+        with open(path, "rb") as file:
+            result = pickle.load(file)
+        # Marks the result as recently used for eviction
+        os.utime(path)
+        return result
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    result = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(path, pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+    evict(max_bytes)
+    return result
+
+
+def evict(max_bytes=MAX_BYTES):
+    """Removes the least recently used results until the cache fits
+
+    Parameters
+    ----------
+    max_bytes : Integer
+        The most bytes the cached results may take up
+    """
+
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".pkl"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def clear():
+    """Removes every cached result"""
+
+    if os.path.isdir(CACHE_DIR):
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
+
+
+def _write_atomic(path, content):
+    """Writes a file through a temporary file so readers never see half of
+    it
+    """
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    os.replace(temp_path, path)
@@ -0,0 +1,478 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that benchmarks the research question functions on synthetic data
+(see synthetic_data) of a few sizes and keeps a history of the results by
+commit. Compute cases time the calculations on their own and figure cases
+time a whole pipeline stage (calculations, drawing and saving). Every case
+records its wall time, CPU time and peak traced memory, and the run fails
+when a case got slower or bigger than the last commit measured on the same
+machine by more than a threshold. Import cases time how long the modules
+take to import in a fresh interpreter.
+
+Example: python benchmarks.py rq2 rq4 --scales 0.1 1 --threshold 0.25
+"""
+
+import os
+import sys
+import socket
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from time import perf_counter, process_time
+from datetime import datetime
+from statistics import median
+from collections import namedtuple
+import pandas as pd
+import analysis
+import anime_cube
+import artifact_cache
+import data_loading
+import label_index
+import pipeline
+import plot_executor
+import row_journal
+import rq_four
+import synthetic_data
+
+BENCHMARK_DIR = "data/benchmarks"
+HISTORY_PATH = "data/benchmarks/history.jsonl"
+SCALES = [0.1, 1]
+THRESHOLD = 0.25
+# Changes smaller than these are noise whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MB = 1
+
+# datasets are loaded (outside of the timing) and passed to func first
+Case = namedtuple("Case", ["name", "kind", "func", "datasets", "args",
+                           "kwargs"])
+
+
+def case(name, kind, func, datasets=(), *args, **kwargs):
+    """Declares a benchmark case
+
+    Parameters
+    ----------
+    name : String
+        Unique name of the case. The part before the first "_" is its group
+        (ex: "rq2" has every research question two case)
+    kind : String
+        "import" (importing a module), "compute" (calculations only) or
+        "figure" (a whole pipeline stage)
+    func : Function
+        The function that is timed
+    datasets : List
+        Names of the cleaned datasets (see data_loading) passed to func first
+    *args, **kwargs
+        Passed to func after the datasets
+
+    Returns
+    -------
+    Case
+        Returns the declared case
+    """
+
+    return Case(name, kind, func, tuple(datasets), args, kwargs)
+
+
+def import_module(module):
+    """Imports a module in a fresh interpreter
+
+    Parameters
+    ----------
+    module : String
+        The name of the module (ex: "rq_one")
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per module it imported with its own and cumulative
+        import microseconds (from python -X importtime), slowest first
+    """
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    rows = [line.split(":", 1)[1].split("|") for line in output.splitlines()
+            if line.startswith("import time:") and "self [us]" not in line]
+    return pd.DataFrame(
+        [(name.strip(), int(own), int(cumulative))
+         for own, cumulative, name in rows],
+        columns=["module", "self_us", "cumulative_us"]) \
+        .sort_values("cumulative_us", ascending=False)
+
+
+def get_cases(year=2019):
+    """Returns every benchmark case
+
+    Parameters
+    ----------
+    year : Integer
+        The retrieved year the figures compare against
+
+    Returns
+    -------
+    List
+        Returns the import and compute cases followed by a figure case for
+        every pipeline stage that isn't a data stage
+    """
+
+    cases = [
+        case(f"import_{module}", "import", import_module, (), module)
+        for module in ["rq_one", "rq_four", "pipeline", "data_analyzing"]
+    ] + [
+        case(current.name, "compute", current.func, current.datasets,
+             *current.args, **current.kwargs)
+        for current in analysis.get_analyses(year)
+    ] + [
+        case("cube_build", "compute", anime_cube.AnimeCube, ["anime"]),
+        case("rq4_features", "compute", rq_four.get_features, ["anime"]),
+        case("rq4_train_model", "compute", rq_four.train_model, ["anime"],
+             7)
+    ]
+    return cases + [
+        case(current.name, "figure", current.func, current.datasets,
+             *current.args, **current.kwargs)
+        for current in pipeline.get_stages(year)
+        if not current.name.startswith("data_")]
+
+
+def select(cases, targets):
+    """Returns the cases matching the targets
+
+    Parameters
+    ----------
+    cases : List
+        The declared cases (see get_cases)
+    targets : List
+        Case names, groups (ex: "rq2") or kinds ("import", "compute" or
+        "figure"). Every case if empty
+
+    Returns
+    -------
+    List
+        Returns the matching cases in declaration order
+    """
+
+    names = {current.name for current in cases}
+    groups = {current.name.split("_")[0] for current in cases}
+    kinds = {current.kind for current in cases}
+    unknown = set(targets) - names - groups - kinds
+    if unknown:
+        raise ValueError(f"Unknown cases {sorted(unknown)}")
+    return [current for current in cases
+            if not targets or current.name in targets or current.kind in
+            targets or current.name.split("_")[0] in targets]
+
+
+def prepare(scale, seed=0):
+    """Makes the folder that the cases of one scale run in
+
+    Parameters
+    ----------
+    scale : Float
+        Size of the synthetic data compared to the real data
+    seed : Integer
+        Seed of the synthetic data
+
+    Returns
+    -------
+    String
+        Returns the path of the folder. It has the synthetic datasets in
+        data (written once and reused) and the plots/lists folders the
+        figures are saved in
+
+    Notes
+    -----
+    File Path: data/benchmarks/scale_{scale}_seed_{seed}/
+    """
+
+    workspace = os.path.abspath(os.path.join(
+        BENCHMARK_DIR, f"scale_{scale:g}_seed_{seed}"))
+    for folder in ("plots/rq3_genres", "lists"):
+        os.makedirs(os.path.join(workspace, folder), exist_ok=True)
+    directory = os.path.join(workspace, "data")
+    file_format = "csv" if data_loading.pq is None else "parquet"
+    path = data_loading.csv_path if file_format == "csv" \
+        else data_loading.columnar_path
+    missing = [name for name in synthetic_data.DATASET_NAMES
+               if not os.path.exists(os.path.join(workspace, path(name)))]
+    if missing:
+        synthetic_data.generate(scale, seed, directory, file_format, missing,
+                                overwrite=True)
+    return workspace
+
+
+def _reset():
+    """Forgets every cached result so each run starts cold"""
+
+    label_index._indexes.clear()
+    anime_cube._cubes.clear()
+    plot_executor.close_all()
+
+
+def measure(func, args=(), kwargs=None, repeats=3):
+    """Runs a function several times and measures it
+
+    Parameters
+    ----------
+    func : Function
+        The function to measure
+    args, kwargs
+        Its arguments
+    repeats : Integer
+        The amount of timed runs
+
+    Returns
+    -------
+    Dictionary
+        Returns the median wall and CPU seconds of the timed runs and the
+        peak traced memory (in MB) of one more run
+
+    Notes
+    -----
+    Every run gets an empty artifact cache and no remembered label indexes,
+        so nothing is reused between runs
+    Memory is traced in its own run since tracing slows everything down
+    CPU time is only of this process (the cases run with one worker)
+    """
+
+    kwargs = kwargs or {}
+    original_dir = artifact_cache.CACHE_DIR
+    walls, cpus = [], []
+    try:
+        for run in range(repeats + 1):
+            with tempfile.TemporaryDirectory() as directory:
+                artifact_cache.CACHE_DIR = directory
+                _reset()
+                if run == repeats:
+                    tracemalloc.start()
+                    func(*args, **kwargs)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    continue
+                wall, cpu = perf_counter(), process_time()
+                func(*args, **kwargs)
+                walls.append(perf_counter() - wall)
+                cpus.append(process_time() - cpu)
+    finally:
+        artifact_cache.CACHE_DIR = original_dir
+        _reset()
+    return {"wall_s": median(walls), "cpu_s": median(cpus),
+            "peak_mb": peak / 1024 ** 2}
+
+
+def git_commit():
+    """Returns the commit of this code ("+dirty" if there are uncommitted
+    changes), or "unknown" outside of a git repository
+    """
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True,
+                                cwd=directory).stdout.strip()
+        changes = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True,
+            cwd=directory).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+dirty" if changes else "")
+
+
+def run_cases(cases, scale, seed=0, repeats=3):
+    """Measures cases on synthetic data of one scale
+
+    Parameters
+    ----------
+    cases : List
+        The cases to run (see get_cases)
+    scale : Float
+        Size of the synthetic data compared to the real data
+    seed : Integer
+        Seed of the synthetic data
+    repeats : Integer
+        The amount of timed runs of every case (see measure)
+
+    Returns
+    -------
+    List
+        Returns a dictionary per case with its name, kind, scale, the rows of
+        the datasets it was given and its measurements
+    """
+
+    original_dir = os.getcwd()
+    os.chdir(prepare(scale, seed))
+    try:
+        datasets = {name: data_loading.load(name) for name in
+                    dict.fromkeys(name for current in cases
+                                  for name in current.datasets)}
+        results = []
+        for current in cases:
+            frames = [datasets[name] for name in current.datasets]
+            result = measure(current.func, (*frames, *current.args),
+                             current.kwargs, repeats)
+            results.append({"case": current.name, "kind": current.kind,
+                            "scale": scale,
+                            "rows": sum(len(frame) for frame in frames),
+                            **result})
+            print(f"{current.name} at {scale:g}x: {result['wall_s']:.2f} s")
+    finally:
+        os.chdir(original_dir)
+    return results
+
+
+def compare(results, history, commit, machine, baseline=None,
+            threshold=THRESHOLD):
+    """Compares results against earlier results of the same machine
+
+    Parameters
+    ----------
+    results : List
+        The results of this run (see run_cases)
+    history : List
+        Every saved result (with their commit and machine)
+    commit : String
+        The commit of this run
+    machine : String
+        The machine of this run
+    baseline : String
+        The commit to compare against. Defaults to the last commit other than
+        this one that measured the same case and scale
+    threshold : Float
+        How much slower (wall time) or bigger (peak memory) a case may get,
+        as a fraction of the baseline (0.25 is 25%)
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per result with its baseline commit, wall time and
+        peak memory, their changes and whether it regressed
+    """
+
+    rows = []
+    for result in results:
+        earlier = [row for row in history
+                   if row["machine"] == machine and
+                   row["case"] == result["case"] and
+                   row["scale"] == result["scale"] and
+                   (row["commit"] == baseline if baseline
+                    else row["commit"] != commit)]
+        row = {"case": result["case"], "scale": result["scale"],
+               "wall_s": result["wall_s"], "cpu_s": result["cpu_s"],
+               "peak_mb": result["peak_mb"], "baseline": None,
+               "wall_change": None, "peak_change": None, "regressed": False}
+        if earlier:
+            before = earlier[-1]
+            wall_change = result["wall_s"] / max(before["wall_s"], 1e-9) - 1
+            peak_change = result["peak_mb"] / max(before["peak_mb"], 1e-9) - 1
+            row.update({
+                "baseline": before["commit"],
+                "wall_change": wall_change,
+                "peak_change": peak_change,
+                "regressed": bool(
+                    (wall_change > threshold and
+                     result["wall_s"] - before["wall_s"] > MIN_SECONDS) or
+                    (peak_change > threshold and
+                     result["peak_mb"] - before["peak_mb"] > MIN_MB))
+            })
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main(targets=(), scales=SCALES, repeats=3, threshold=THRESHOLD,
+         baseline=None, save=True, seed=0, year=2019):
+    """Runs the benchmarks, prints the comparison and saves the results
+
+    Parameters
+    ----------
+    targets : List
+        Case names, groups or kinds to run (see select)
+    scales : List
+        The synthetic data sizes to run every case at
+    repeats : Integer
+        The amount of timed runs of every case
+    threshold : Float
+        The allowed slowdown or growth (see compare)
+    baseline : String
+        The commit to compare against (see compare)
+    save : Boolean
+        Whether to add the results to the history
+    seed : Integer
+        Seed of the synthetic data
+    year : Integer
+        The retrieved year the figures compare against
+
+    Returns
+    -------
+    DataFrame
+        Returns the comparison (see compare)
+
+    Notes
+    -----
+    File Path: data/benchmarks/history.jsonl
+    """
+
+    cases = select(get_cases(year), targets)
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    journal = row_journal.Journal(os.path.abspath(HISTORY_PATH))
+    commit, machine = git_commit(), socket.gethostname()
+    results = [result for scale in scales
+               for result in run_cases(cases, scale, seed, repeats)]
+
+    comparison = compare(results, journal.read(), commit, machine, baseline,
+                         threshold)
+    print(comparison.to_string(index=False, float_format="{:.3f}".format))
+    if save:
+        date = datetime.now().isoformat(timespec="seconds")
+        for result in results:
+            journal.append({"commit": commit, "machine": machine,
+                            "date": date, "seed": seed, **result})
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("targets", nargs="*",
+                        help="cases, groups (import, cube, rq1-rq4) or " +
+                        "kinds (import, compute, figure) to run, " +
+                        "everything by default")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES,
+                        help="synthetic data sizes compared to the real data")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="timed runs of every case")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown/growth (0.25 is 25%%)")
+    parser.add_argument("--baseline",
+                        help="commit to compare against (the last other " +
+                        "commit measured by default)")
+    parser.add_argument("--no-save", action="store_true",
+                        help="don't add the results to the history")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic data")
+    parser.add_argument("--year", type=int, default=2019,
+                        help="retrieved year the figures compare against")
+    parser.add_argument("--list", action="store_true",
+                        help="list the cases")
+    args = parser.parse_args()
+    if args.list:
+        for current in get_cases(args.year):
+            print(f"{current.name}: {current.kind}")
+        sys.exit()
+    try:
+        comparison = main(args.targets, args.scales, args.repeats,
+                          args.threshold, args.baseline, not args.no_save,
+                          args.seed, args.year)
+    except ValueError as error:
+        parser.error(str(error))
+    if comparison["regressed"].any():
+        print("Regressed: " + ", ".join(
+            f"{row.case} at {row.scale:g}x"
+            for row in comparison[comparison["regressed"]].itertuples()))
+        sys.exit(1)
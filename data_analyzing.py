@@ -7,24 +7,54 @@ A script that runs all modules that contain data manipulation/visualization for
 my Final Project about Anime and MyAnimeList Users.
 """
 
+import argparse
 import rq_one
 import rq_two
 import rq_three
 import rq_four
-import pandas as pd
+import data_loading
+import plot_executor
+import tracing
 
 
-def main():
-    """Runs all functions to analyze/visualize information for my project"""
+def main(year=2019, workers=1, trace=None):
+    """Runs all functions to analyze/visualize information for my project
 
-    anime_data = pd.read_csv("data/animelist_cleaned.csv")
-    data_2019 = pd.read_csv("data/animelist_2019.csv")
-    user_data = pd.read_csv("data/userlist_cleaned.csv")
-    rq_one.main(anime_data, user_data)
-    rq_two.main(anime_data, data_2019)
-    rq_three.main(anime_data)
-    rq_four.main(anime_data, data_2019)
+    Parameters
+    ----------
+    year : Integer
+        The retrieved year (data/animelist_{year}.csv) that is compared with
+        the anime from before 2018
+    workers : Integer
+        The amount of processes that render figures at the same time
+    trace : String
+        Where to save a trace of the run (see tracing). Nothing is traced if
+        not given
+    """
+
+    if trace:
+        tracing.enable()
+    anime_data = data_loading.load("anime")
+    data_2019 = data_loading.load(f"anime_{year}")
+    user_data = data_loading.load("users")
+    tasks = rq_one.get_tasks(anime_data, user_data) + \
+        rq_two.get_tasks(anime_data, data_2019, year) + \
+        rq_three.get_tasks(anime_data) + \
+        rq_four.get_tasks(anime_data, data_2019)
+    for name, seconds in plot_executor.run_tasks(tasks, workers):
+        print(f"{name} took {seconds:.1f} seconds")
+    if trace:
+        print(tracing.save(trace))
+        tracing.disable()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--year", type=int, default=2019,
+                        help="retrieved year to compare against")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes that render figures in parallel")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="save a Chrome trace of the run (and a summary)")
+    args = parser.parse_args()
+    main(args.year, args.workers, args.trace)
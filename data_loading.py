@@ -0,0 +1,322 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that loads the cleaned datasets for my Final Project about Anime and
+MyAnimeList Users. Every cleaned CSV also gets a typed columnar (Parquet) copy
+that is much faster to load and much smaller in memory than the text version.
+"""
+
+import os
+import pandas as pd
+import tracing
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DATASETS = {
+    "anime": "data/animelist_cleaned",
+    "anime_2019": "data/animelist_2019",
+    "users": "data/userlist_cleaned",
+    "user_animelists": "data/user_animelists_cleaned"
+}
+# Every "anime_{year}" dataset retrieved from JikanAPI shares the same layout
+SEASON_DATASET = "data/animelist_{year}"
+
+DTYPES = {
+    "anime": {
+        "anime_id": "int32", "type": "category", "episodes": "int16",
+        "scored_by": "int32", "rank": "int32", "popularity": "int32",
+        "members": "int32", "favorites": "int32",
+        "aired_from_year": "int16", "source": "category"
+    },
+    "anime_2019": {
+        "anime_id": "int32", "type": "category", "episodes": "int16",
+        "duration_min": "int16", "source": "category", "members": "int32",
+        "favorites": "int32"
+    },
+    "users": {
+        "user_id": "int32", "user_watching": "int32",
+        "user_completed": "int32", "user_onhold": "int32",
+        "user_dropped": "int32", "user_plantowatch": "int32",
+        "gender": "category", "stats_episodes": "int32", "age": "int16"
+    },
+    "user_animelists": {
+        "username": "category", "anime_id": "int32", "my_score": "int8",
+        "my_status": "int8", "my_watched_episodes": "int32"
+    }
+}
+
+DATES = {
+    "users": ["birth_date"]
+}
+
+
+def dataset_info(name):
+    """Returns the file path (without extension) and dtypes of a dataset
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    Tuple
+        The file path without an extension and the compact dtypes
+    """
+
+    if name in DATASETS:
+        return DATASETS[name], DTYPES[name]
+    year = name[len("anime_"):]
+    if not name.startswith("anime_") or not year.isdigit():
+        raise ValueError(f"Unknown dataset {name}")
+    return SEASON_DATASET.format(year=year), DTYPES["anime_2019"]
+
+
+def csv_path(name):
+    """Returns the path of the cleaned CSV of the given dataset
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    String
+        The file path of the CSV
+    """
+
+    return dataset_info(name)[0] + ".csv"
+
+
+def columnar_path(name):
+    """Returns the path of the typed columnar copy of the given dataset
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    String
+        The file path of the Parquet file
+    """
+
+    return dataset_info(name)[0] + ".parquet"
+
+
+def apply_types(data, name):
+    """Converts the columns of a dataset to their compact types
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains (some of) the columns of the dataset
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    DataFrame
+        Returns the DataFrame with categoricals, small integers and parsed
+        dates. Columns that are not in the DataFrame are skipped
+    """
+
+    dtypes = {column: dtype for column, dtype in dataset_info(name)[1].items()
+              if column in data.columns}
+    data = data.astype(dtypes)
+    for column in DATES.get(name, []):
+        if column in data.columns and \
+                not pd.api.types.is_datetime64_any_dtype(data[column]):
+            # Only the date is kept since some dates also have a time of day
+            data[column] = pd.to_datetime(data[column].str.slice(0, 10),
+                                          format="%Y-%m-%d", errors="coerce")
+    return data
+
+
+@tracing.traced("save")
+def save_columnar(data, name):
+    """Saves the typed columnar copy of a cleaned dataset
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains the cleaned dataset
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Notes
+    -----
+    File Path: data/{dataset}.parquet
+    Does nothing if pyarrow isn't installed, loading then uses the CSV
+    """
+
+    if pq is None:
+        return
+    apply_types(data, name).to_parquet(columnar_path(name), index=False)
+
+
+class ColumnarWriter:
+    """Writes the typed columnar copy of a dataset one chunk at a time
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+    path : String
+        Where to write the Parquet file. Defaults to the dataset's
+        columnar_path
+
+    Notes
+    -----
+    File Path: data/{dataset}.parquet
+    Every chunk becomes its own row group so memory stays flat while writing
+    The categorical columns (see DTYPES) are always written with 32 bit
+        codes, since a later chunk can have many more categories than the
+        first one
+    Does nothing if pyarrow isn't installed, loading then uses the CSV
+    """
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = columnar_path(name) if path is None else path
+        self.writer = None
+
+    def write(self, chunk):
+        """Converts and appends a chunk of the dataset"""
+
+        if pq is None:
+            return
+        chunk = apply_types(chunk, self.name)
+        if self.writer is None:
+            schema = pa.Table.from_pandas(chunk, preserve_index=False).schema
+            categories = [column for column, dtype
+                          in dataset_info(self.name)[1].items()
+                          if dtype == "category" and column in chunk.columns]
+            for column in categories:
+                index = schema.get_field_index(column)
+                schema = schema.set(index, pa.field(column, pa.dictionary(
+                    pa.int32(), schema.field(index).type.value_type)))
+            self.writer = pq.ParquetWriter(self.path, schema)
+        table = pa.Table.from_pandas(chunk, preserve_index=False,
+                                     schema=self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        """Finishes the Parquet file"""
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def has_columnar(name):
+    """Checks if an up to date typed columnar copy of a dataset exists
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    Boolean
+        True if the Parquet file can be used instead of the CSV
+    """
+
+    path = columnar_path(name)
+    if pq is None or not os.path.exists(path):
+        return False
+    csv = csv_path(name)
+    return not os.path.exists(csv) or \
+        os.path.getmtime(path) >= os.path.getmtime(csv)
+
+
+def source_path(name):
+    """Returns the path of the file that a dataset is loaded from
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+
+    Returns
+    -------
+    String
+        The Parquet path if it is up to date, otherwise the CSV path
+    """
+
+    return columnar_path(name) if has_columnar(name) else csv_path(name)
+
+
+@tracing.traced("load")
+def load(name, columns=None):
+    """Loads a cleaned dataset with compact types
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+    columns : List
+        The only columns to read. Reads every column if not given
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame of the dataset
+
+    Notes
+    -----
+    Reads the typed columnar copy if it is up to date, and falls back to
+        parsing (and converting) the CSV otherwise
+    """
+
+    if has_columnar(name):
+        return pd.read_parquet(columnar_path(name), columns=columns)
+    return apply_types(pd.read_csv(csv_path(name), usecols=columns), name)
+
+
+def iter_chunks(name, columns=None, chunksize=1000000):
+    """Loads a cleaned dataset a chunk at a time with compact types
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of DATASETS or "anime_{year}")
+    columns : List
+        The only columns to read. Reads every column if not given
+    chunksize : Integer
+        The most rows in each chunk
+
+    Returns
+    -------
+    Generator
+        Yields Pandas DataFrames of consecutive rows of the dataset
+
+    Notes
+    -----
+    Only one chunk is in memory at a time, so even the user animelists can
+        be processed without loading the whole table
+    """
+
+    if has_columnar(name):
+        batches = pq.ParquetFile(columnar_path(name)) \
+            .iter_batches(batch_size=chunksize, columns=columns)
+        for batch in batches:
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(csv_path(name), usecols=columns,
+                                 chunksize=chunksize):
+            yield apply_types(chunk, name)
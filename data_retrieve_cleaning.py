@@ -8,147 +8,334 @@ MyAnimeList Users
 """
 
 import pandas as pd
-from jikanpy import Jikan
-from time import sleep
+import data_loading
+import jikan_caching
+import jikan_fetching
+import row_journal
+import tracing
+from time import perf_counter
 
 
-def clean_user_animelists():
+ANIMELISTS_DTYPES = {
+    "username": "string",
+    "anime_id": "Int32",
+    "my_score": "Int8",
+    "my_status": "Int8",
+    "my_watched_episodes": "Int32"
+}
+
+
+@tracing.traced("clean")
+def clean_user_animelists(chunksize=1000000):
     """Cleans original user animelists for information relavent to the project
 
+    Parameters
+    ----------
+    chunksize : Integer
+        The amount of rows that are read, cleaned, and written at a time
+
     Notes
     -----
-    File Path: data/user_animelists_cleaned.csv
+    File Path: data/user_animelists_cleaned.csv and
+        data/user_animelists_cleaned.parquet
+    The original file is tens of millions of rows so it is streamed in chunks
+        with compact dtypes to keep memory usage flat no matter the file size
+    Rows with a missing value are dropped. The CSV is the same as reading the
+        whole file at once: a numeric column with a missing value anywhere in
+        the original file is written as floats (ex: 8.0), so the file is
+        first scanned for those columns
     """
 
-    new_animelists = \
-        pd.read_csv('data/original_data/users_animelists_azathoth.csv',
-                    usecols=["username", "anime_id", "my_score",
-                             "my_status", "my_watched_episodes"]).dropna()
-    new_animelists.to_csv("data/user_animelists_cleaned.csv", index=False)
+    start = perf_counter()
+    rows_read = 0
+    rows_written = 0
+    path = "data/original_data/users_animelists_azathoth.csv"
+    numeric = [column for column, dtype in ANIMELISTS_DTYPES.items()
+               if dtype != "string"]
+    with tracing.span("find_missing", "load"):
+        missing = set()
+        for chunk in pd.read_csv(path, usecols=numeric,
+                                 dtype=ANIMELISTS_DTYPES,
+                                 chunksize=chunksize):
+            missing.update(chunk.columns[chunk.isna().any()])
+    chunks = pd.read_csv(path, usecols=list(ANIMELISTS_DTYPES),
+                         dtype=ANIMELISTS_DTYPES, chunksize=chunksize)
+    with open("data/user_animelists_cleaned.csv", "w", newline="") as file, \
+            data_loading.ColumnarWriter("user_animelists") as columnar:
+        for chunk_number, chunk in enumerate(chunks):
+            rows_read += len(chunk)
+            tracing.count(len(chunk))
+            chunk = chunk.dropna()
+            rows_written += len(chunk)
+            chunk.astype({column: "float64" for column in missing}) \
+                .to_csv(file, index=False, header=chunk_number == 0)
+            columnar.write(chunk)
+            elapsed = perf_counter() - start
+            print(f"Cleaned {rows_read} user animelist rows " +
+                  f"({rows_read / elapsed:.0f} rows/sec)")
+    print(f"Kept {rows_written} of {rows_read} user animelist rows in " +
+          f"{perf_counter() - start:.1f} seconds")
 
 
+@tracing.traced("clean")
 def clean_animelist():
     """Cleans original anime info for information relavent to the project
 
     Notes
     -----
-    File Path: data/animelist_cleaned.csv
+    File Path: data/animelist_cleaned.csv and data/animelist_cleaned.parquet
     """
 
-    new_animelist = \
-        pd.read_csv('data/original_data/anime_azathoth.csv',
-                    usecols=["anime_id", "title", "image_url", "type",
-                             "episodes", "duration_min", "score", "scored_by",
-                             "rank", "popularity", "members", "favorites",
-                             "related", "studio", "genre", "aired_from_year",
-                             "source"]).dropna()
-    new_animelist.to_csv("data/animelist_cleaned.csv", index=False)
+    with tracing.span("read_csv", "load") as current:
+        new_animelist = \
+            pd.read_csv('data/original_data/anime_azathoth.csv',
+                        usecols=["anime_id", "title", "image_url", "type",
+                                 "episodes", "duration_min", "score",
+                                 "scored_by", "rank", "popularity", "members",
+                                 "favorites", "related", "studio", "genre",
+                                 "aired_from_year", "source"])
+        current.rows = len(new_animelist)
+    new_animelist = new_animelist.dropna()
+    with tracing.span("to_csv", "save", len(new_animelist)):
+        new_animelist.to_csv("data/animelist_cleaned.csv", index=False)
+    data_loading.save_columnar(new_animelist, "anime")
 
 
+@tracing.traced("clean")
 def clean_userlist():
     """Cleans original MAL user info for information relavent to the project
 
     Notes
     -----
-    File Path: data/userlist_cleaned.csv
+    File Path: data/userlist_cleaned.csv and data/userlist_cleaned.parquet
     """
 
-    new_userlist = \
-        pd.read_csv('data/original_data/users_azathoth.csv',
-                    usecols=["username", "user_id", "user_watching",
-                             "user_completed", "user_onhold", "user_dropped",
-                             "user_plantowatch", "user_days_spent_watching",
-                             "gender", "location", "birth_date",
-                             "stats_mean_score", "stats_episodes"]).dropna()
+    with tracing.span("read_csv", "load") as current:
+        new_userlist = \
+            pd.read_csv('data/original_data/users_azathoth.csv',
+                        usecols=["username", "user_id", "user_watching",
+                                 "user_completed", "user_onhold",
+                                 "user_dropped", "user_plantowatch",
+                                 "user_days_spent_watching", "gender",
+                                 "location", "birth_date", "stats_mean_score",
+                                 "stats_episodes"])
+        current.rows = len(new_userlist)
+    new_userlist = new_userlist.dropna()
     new_userlist["age"] = 2020 - \
         pd.to_numeric(new_userlist["birth_date"]
                       .str.split("-", expand=True, n=1)[0])
     # Not to be offensive but working with non-Binary genders will be too hard
     new_userlist = new_userlist[new_userlist["gender"]
                                 .isin(["Male", "Female"])]
-    new_userlist.to_csv("data/userlist_cleaned.csv", index=False)
+    with tracing.span("to_csv", "save", len(new_userlist)):
+        new_userlist.to_csv("data/userlist_cleaned.csv", index=False)
+    data_loading.save_columnar(new_userlist, "users")
+
+
+def start_year(anime_info):
+    """Returns the year an anime started airing
+
+    Parameters
+    ----------
+    anime_info : Dictionary
+        The JikanAPI details of the anime
+
+    Returns
+    -------
+    Integer
+        Returns the year of the season it premiered in (ex: "Fall 2019"), or
+        of the date it first aired if it has no premiere season. None if it
+        has neither
+    """
+
+    premiered = (anime_info.get("premiered") or "").split()
+    if premiered and premiered[-1].isdigit():
+        return int(premiered[-1])
+    aired_from = (anime_info.get("aired") or {}).get("from") or ""
+    if aired_from[:4].isdigit():
+        return int(aired_from[:4])
+    return None
+
+
+def parse_anime(anime, anime_info):
+    """Combines the season listing and details of an anime into one row
+
+    Parameters
+    ----------
+    anime : Dictionary
+        The anime's entry in a JikanAPI season listing
+    anime_info : Dictionary
+        The JikanAPI details of the anime
+
+    Returns
+    -------
+    Dictionary
+        Returns the row of the anime for data/animelist_{year}.csv, and the
+        year it started airing (see start_year)
+    """
+
+    duration = anime_info["duration"].split()
+    duration_hr = duration[duration.index("hr") - 1] \
+        if "hr" in duration else 0
+    duration_min = duration[duration.index("min") - 1] \
+        if "min" in duration else 0
+
+    return {
+        "anime_id": anime["mal_id"],
+        "title": anime["title"],
+        "type": anime["type"],
+        "episodes": anime["episodes"],
+        "duration_min": int(duration_hr) * 60 + int(duration_min),
+        "source": anime["source"],
+        "genre": ", ".join(genre_info["name"]
+                           for genre_info in anime["genres"]),
+        "studio": ", ".join(studio_info["name"]
+                            for studio_info in anime_info["studios"]),
+        "score": anime["score"],
+        "favorites": anime_info["favorites"],
+        "members": anime["members"],
+        "aired_from_year": start_year(anime_info)
+    }
+
 
+@tracing.traced("clean")
+def get_season_data(years, rate=0.5, workers=4, max_attempts=5,
+                    ttl=7 * 24 * 60 * 60, resume=True, jikan=None):
+    """Uses JikanAPI to retrieve anime info from every season of the years
 
-def get_2019_mal_data():
+    Parameters
+    ----------
+    years : List
+        The years to retrieve (ex: range(2019, 2021))
+    rate : Float
+        The amount of JikanAPI requests allowed per second
+    workers : Integer
+        The amount of anime details that are requested at the same time
+    max_attempts : Integer
+        The most times a request is attempted before it is given up on
+    ttl : Float
+        Seconds a cached JikanAPI response stays valid
+    resume : Boolean
+        Whether to keep the anime already parsed by an earlier run that
+        didn't finish. If False the journal is cleared (the response cache is
+        still used)
+    jikan : Jikan
+        The JikanAPI client to request with. Defaults to a new Jikan()
+
+    Returns
+    -------
+    List
+        Returns the dead letter list of anime ids that couldn't be retrieved
+
+    Notes
+    -----
+    File Path: data/animelist_{year}.csv and data/animelist_{year}.parquet
+        for every year
+    Anime that run for multiple seasons show up in multiple season listings.
+        The listings are de-duplicated by mal_id before any details are
+        requested
+    Every anime listed in a year is in exactly one file. It goes into the
+        file of the year it started airing (see start_year) if that year is
+        retrieved too, so a show airing across 2019 and 2020 is in the 2019
+        file whenever both years are retrieved. Otherwise (ex: a Fall 2018
+        show still airing in Winter 2019, or an anime without a start date)
+        it goes into the earliest year it is listed in, like a single year
+        retrieval always did
+    The rate limit is shared by every request so we don't get blocked from
+        JikanAPI. Anime that fail every attempt are left out of the files
+    Every response is cached in data/jikan_cache for ttl seconds, so a
+        repeat run within ttl is served from disk without any requests
+    Every parsed anime is journaled to data/animelist_seasons.journal.jsonl
+        as soon as it arrives, so a crashed run resumes where it stopped. The
+        journal is cleared once the files are written, so a later run parses
+        the anime again from responses that are no older than ttl
+    """
+
+    if jikan is None:
+        # Only retrieving needs the JikanAPI client (and its slow imports)
+        from jikanpy import Jikan
+        jikan = Jikan()
+    bucket = jikan_fetching.TokenBucket(rate)
+    season_cache = \
+        jikan_caching.ResponseCache("data/jikan_cache/season", ttl)
+    anime_cache = jikan_caching.ResponseCache("data/jikan_cache/anime", ttl)
+    journal = row_journal.Journal("data/animelist_seasons.journal.jsonl")
+    if not resume:
+        journal.clear()
+
+    listed = {}
+    first_listed = {}
+    appearances = 0
+    for year in sorted(years):
+        for season in ["winter", "spring", "summer", "fall"]:
+            print(f"Retrieving all {season} {year} Anime")
+            listing = jikan_fetching.fetch_with_retries(
+                lambda key: jikan.season(*key), [year, season], bucket,
+                max_attempts, cache=season_cache)["anime"]
+            appearances += len(listing)
+            for anime in listing:
+                if anime["mal_id"] not in listed:
+                    listed[anime["mal_id"]] = anime
+                    first_listed[anime["mal_id"]] = year
+    print(f"{len(listed)} unique anime in {appearances} season listings")
+
+    rows = {row["anime_id"]: row for row in journal.read()
+            if row["anime_id"] in listed}
+    if rows:
+        print(f"Resuming with {len(rows)} anime already retrieved")
+
+    def save_row(anime_id, anime_info):
+        row = parse_anime(listed[anime_id], anime_info)
+        journal.append(row)
+        rows[anime_id] = row
+
+    _, dead_letters = jikan_fetching.fetch_all(
+        [anime_id for anime_id in listed if anime_id not in rows],
+        jikan.anime, workers=workers, max_attempts=max_attempts,
+        bucket=bucket, cache=anime_cache, on_result=save_row)
+    if dead_letters:
+        print(f"Couldn't retrieve anime with ids {dead_letters}")
+
+    years_rows = {year: [] for year in sorted(years)}
+    for anime_id in listed:
+        if anime_id in rows:
+            year = rows[anime_id].get("aired_from_year")
+            if year not in years_rows:
+                year = first_listed[anime_id]
+            years_rows[year].append(rows[anime_id])
+
+    for year, year_rows in years_rows.items():
+        result = pd.DataFrame(year_rows,
+                              columns=["anime_id", "title", "type",
+                                       "episodes", "duration_min", "source",
+                                       "genre", "studio", "score",
+                                       "favorites", "members"]).dropna()
+        result = result[result["studio"].astype(bool)]
+        result.to_csv(data_loading.csv_path(f"anime_{year}"), index=False)
+        data_loading.save_columnar(result, f"anime_{year}")
+    journal.clear()
+    return dead_letters
+
+
+def get_2019_mal_data(**kwargs):
     """Uses JikanAPI to retrieve anime info from 2019
 
+    Parameters
+    ----------
+    **kwargs
+        Retrieval options passed on to get_season_data
+
+    Returns
+    -------
+    List
+        Returns the dead letter list of anime ids that couldn't be retrieved
+
     Notes
     -----
-    File Path: data/animelist_2019.csv
+    File Path: data/animelist_2019.csv and data/animelist_2019.parquet
     """
 
-    jikan = Jikan()
-    anime_2019 = {
-        "anime_2019_spr": jikan.season(2019, "spring"),
-        "anime_2019_sum": jikan.season(2019, "summer"),
-        "anime_2019_fall": jikan.season(2019, "fall"),
-        "anime_2019_win": jikan.season(2019, "winter")
-    }
-    attributes = ["type", "episodes", "score", "source",
-                  "members", "genres", "title", "mal_id"]
-    animes = {
-        "anime_id": [],
-        "title": [],
-        "type": [],
-        "episodes": [],
-        "duration_min": [],
-        "source": [],
-        "genre": [],
-        "studio": [],
-        "score": [],
-        "favorites": [],
-        "members": []
-    }
-    for season in anime_2019:
-        print(f"Retrieving all {season} Anime")
-        for anime in anime_2019[season]["anime"]:
-            for attribute in attributes:
-                if attribute == "mal_id":
-                    anime_id = anime[attribute]
-                    animes["anime_id"].append(anime_id)
-
-                    trying = True
-                    while trying:
-                        try:
-                            anime_info = \
-                                jikan.anime(anime_id)
-                            trying = False
-                        except Exception:
-                            print(f"Error in getting {anime['title']}. " +
-                                  "Retrying")
-                            sleep(2)
-
-                    studios = []
-                    for studio_info in anime_info["studios"]:
-                        studios.append(studio_info["name"])
-
-                    duration = anime_info["duration"]
-                    duration = duration.split()
-                    duration_hr = duration[duration.index("hr") - 1] \
-                        if "hr" in duration else 0
-                    duration_min = duration[duration.index("min") - 1] \
-                        if "min" in duration else 0
-                    duration = int(duration_hr) * 60 + int(duration_min)
-
-                    favorites = anime_info["favorites"]
-
-                    animes["studio"].append(", ".join(studios))
-                    animes["duration_min"].append(duration)
-                    animes["favorites"].append(favorites)
-
-                    # Sleep is to ensure that we don't make to many requests
-                    # and get blocked from JikanAPI
-                    sleep(4)
-                elif attribute == "genres":
-                    genres = []
-                    for genre_info in anime[attribute]:
-                        genres.append(genre_info["name"])
-                    animes["genre"].append(", ".join(genres))
-                else:
-                    animes[attribute].append(anime[attribute])
-    result = pd.DataFrame.from_dict(animes).dropna()
-    result = result[result["studio"].astype(bool)]
-    result.to_csv("data/animelist_2019.csv", index=False)
+    return get_season_data([2019], **kwargs)
 
 
 def main():
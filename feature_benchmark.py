@@ -0,0 +1,103 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that compares the memory and time of training the rq4 models on
+sparse features against dense features, on synthetic anime data (see
+synthetic_data) of growing size (1x, 10x and 100x the real anime by
+default).
+
+Example: python feature_benchmark.py --scales 1 10 100
+"""
+
+import argparse
+import tracemalloc
+from time import perf_counter
+import pandas as pd
+from sklearn.tree import DecisionTreeRegressor
+from feature_encoding import FeatureEncoder
+import synthetic_data
+
+
+def measure(build):
+    """Runs build and returns its result, seconds and peak memory in MB"""
+
+    tracemalloc.start()
+    start = perf_counter()
+    result = build()
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(scale, max_depth=7, max_dense_gb=2):
+    """Times encoding, fitting and predicting on sparse and dense features
+
+    Parameters
+    ----------
+    scale : Float
+        Size of the synthetic data compared to the real anime (see
+        synthetic_data.make_anime)
+    max_depth : Integer
+        Depth of the trained tree
+    max_dense_gb : Float
+        The largest dense feature matrix (in GB) that is tried
+
+    Returns
+    -------
+    List
+        Returns a dictionary per path (sparse/dense) with the feature size,
+        seconds and peak memory of every step
+    """
+
+    data = synthetic_data.make_anime(scale)
+    encoder = FeatureEncoder().fit(data)
+    columns = len(encoder.feature_names)
+    dense_gb = len(data) * columns * 4 / 1024 ** 3
+    results = []
+    for path in ("sparse", "dense"):
+        row = {"scale": scale, "rows": len(data), "columns": columns,
+               "path": path}
+        if path == "dense" and dense_gb > max_dense_gb:
+            row["skipped"] = f"needs {dense_gb:.1f} GB"
+            results.append(row)
+            continue
+
+        def encode():
+            features = encoder.transform(data)
+            return features if path == "sparse" else features.toarray()
+
+        features, row["encode_s"], row["encode_mb"] = measure(encode)
+        row["features_mb"] = (features.data.nbytes + features.indices.nbytes
+                              + features.indptr.nbytes
+                              if path == "sparse" else features.nbytes) \
+            / 1024 ** 2
+        model, row["fit_s"], row["fit_mb"] = measure(
+            lambda: DecisionTreeRegressor(max_depth=max_depth, random_state=0)
+            .fit(features, data["score"]))
+        _, row["predict_s"], _ = measure(lambda: model.predict(features))
+        results.append(row)
+    return results
+
+
+def main(scales, max_depth=7, max_dense_gb=2):
+    """Prints the comparison for every scale"""
+
+    rows = [row for scale in scales
+            for row in run(scale, max_depth, max_dense_gb)]
+    print(pd.DataFrame(rows).round(2).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--scales", type=float, nargs="+",
+                        default=[1, 10, 100], help="data sizes to compare")
+    parser.add_argument("--depth", type=int, default=7,
+                        help="max_depth of the trees")
+    parser.add_argument("--max-dense-gb", type=float, default=2,
+                        help="skip dense matrices bigger than this")
+    args = parser.parse_args()
+    main(args.scales, args.depth, args.max_dense_gb)
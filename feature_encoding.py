@@ -0,0 +1,220 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that turns anime show data into the features of the score and
+favorites models of my fourth research question. The encoder learns the
+type/source/genre/studio vocabularies once from the training anime, can be
+saved, and encodes any new anime (in batches if needed) straight into a
+sparse matrix with the same columns, so scoring a new season never needs the
+training data again.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import label_index
+
+FEATURES = ["type", "episodes", "duration_min", "source", "genre", "studio"]
+NUMERIC = ["episodes", "duration_min"]
+MULTI_LABEL = ["studio", "genre"]
+ONE_HOT = ["type", "source"]
+VERSION = 1
+
+
+class FeatureEncoder:
+    """Encodes anime show data into the features of the rq4 models
+
+    Parameters
+    ----------
+    features : List
+        The features to encode (a subset of FEATURES)
+    unseen : String
+        What to do with a label (type, source, genre or studio) that wasn't
+        seen when fitting: "ignore" encodes it as all zeros (like the old
+        reindex(fill_value=0)) and "error" raises a ValueError
+
+    Attributes
+    ----------
+    vocabularies : Dictionary
+        Feature to the labels it was fit on (in column order)
+    feature_names : List
+        The names of the encoded columns: episodes, duration_min, studio_*,
+        genre_*, type_*, source_* (the same order get_dummies gave)
+    unseen_labels : Dictionary
+        Feature to the unseen labels of the last transform
+    """
+
+    def __init__(self, features=FEATURES, unseen="ignore"):
+        if unseen not in ("ignore", "error"):
+            raise ValueError(f"Unknown unseen label handling {unseen}")
+        self.features = [feature for feature in FEATURES
+                         if feature in features]
+        self.unseen = unseen
+        self.vocabularies = None
+        self.unseen_labels = {}
+
+    def fit(self, data):
+        """Learns the vocabulary of every label feature
+
+        Parameters
+        ----------
+        data : DataFrame
+            Pandas DataFrame that contains the training anime show data
+
+        Returns
+        -------
+        FeatureEncoder
+            Returns itself
+        """
+
+        self.vocabularies = {}
+        for feature in self._label_features():
+            if feature in MULTI_LABEL:
+                labels = label_index.get(data, feature).vocabulary
+            else:
+                labels = pd.Index(data[feature].dropna().unique()) \
+                    .sort_values()
+            self.vocabularies[feature] = [str(label) for label in labels]
+        return self
+
+    @property
+    def feature_names(self):
+        """Returns the names of the encoded columns"""
+
+        return [feature for feature in NUMERIC if feature in self.features] \
+            + [f"{feature}_{label}" for feature in self._label_features()
+               for label in self.vocabularies[feature]]
+
+    def transform(self, data):
+        """Encodes anime into a sparse matrix of the fitted columns
+
+        Parameters
+        ----------
+        data : DataFrame
+            Pandas DataFrame that contains anime show data
+
+        Returns
+        -------
+        csr_matrix
+            Returns a float32 sparse matrix with a row per anime and a column
+            per feature name
+        """
+
+        if self.vocabularies is None:
+            raise ValueError("The encoder has to be fit first")
+        self.unseen_labels = {}
+        numeric = [feature for feature in NUMERIC if feature in self.features]
+        blocks = [sparse.csr_matrix(data[numeric].to_numpy("float32"))]
+        for feature in self._label_features():
+            blocks.append(self._encode_labels(data, feature))
+        return sparse.hstack(blocks, format="csr", dtype="float32")
+
+    def transform_frame(self, data):
+        """Encodes anime into a dense Pandas DataFrame of the fitted columns
+
+        Parameters
+        ----------
+        data : DataFrame
+            Pandas DataFrame that contains anime show data
+
+        Returns
+        -------
+        DataFrame
+            Returns the transform as a DataFrame with the feature names as
+            columns and the index of data
+        """
+
+        return pd.DataFrame(self.transform(data).toarray(),
+                            columns=self.feature_names, index=data.index)
+
+    def transform_batches(self, batches):
+        """Encodes anime batch by batch
+
+        Parameters
+        ----------
+        batches : Iterable
+            Pandas DataFrames of anime show data (ex: from
+            data_loading.iter_chunks)
+
+        Returns
+        -------
+        Generator
+            Yields the sparse matrix of every batch
+        """
+
+        for batch in batches:
+            yield self.transform(batch)
+
+    def save(self, path):
+        """Saves the fitted encoder as JSON
+
+        Parameters
+        ----------
+        path : String
+            Path of the JSON file
+        """
+
+        with open(path, "w") as file:
+            json.dump({"version": VERSION, "features": self.features,
+                       "unseen": self.unseen,
+                       "vocabularies": self.vocabularies}, file)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an encoder saved with save
+
+        Parameters
+        ----------
+        path : String
+            Path of the JSON file
+
+        Returns
+        -------
+        FeatureEncoder
+            Returns the fitted encoder
+        """
+
+        with open(path) as file:
+            saved = json.load(file)
+        if saved["version"] != VERSION:
+            raise ValueError(f"Can't load encoder version {saved['version']}")
+        encoder = cls(saved["features"], saved["unseen"])
+        encoder.vocabularies = saved["vocabularies"]
+        return encoder
+
+    def _label_features(self):
+        """Returns the label features in column order"""
+
+        return [feature for feature in MULTI_LABEL + ONE_HOT
+                if feature in self.features]
+
+    def _encode_labels(self, data, feature):
+        """Returns the sparse (multi-)hot block of one label feature"""
+
+        labels = data[feature]
+        vocabulary = pd.Index(self.vocabularies[feature])
+        if feature in MULTI_LABEL:
+            index = label_index.get(data, feature)
+            matrix, found = index.matrix.tocoo(), index.vocabulary
+            rows, codes = matrix.row, matrix.col
+        else:
+            codes, found = pd.factorize(labels.astype("object"))
+            rows = np.flatnonzero(codes >= 0)
+            codes = codes[rows]
+            found = pd.Index(found.astype(str))
+
+        columns = vocabulary.get_indexer(found)
+        unseen = sorted(found[columns == -1])
+        if unseen:
+            self.unseen_labels[feature] = unseen
+            if self.unseen == "error":
+                raise ValueError(f"Unseen {feature} labels: {unseen}")
+        columns = columns[codes]
+        keep = columns >= 0
+        return sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype="float32"),
+             (rows[keep], columns[keep])),
+            shape=(len(labels), len(vocabulary)))
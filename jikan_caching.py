@@ -0,0 +1,68 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that keeps JikanAPI responses on disk for my Final Project, so a
+repeat retrieval barely touches the API. Parsed anime rows are journaled with
+row_journal.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from time import time
+
+
+class ResponseCache:
+    """On disk cache of API responses that expire after a time to live
+
+    Parameters
+    ----------
+    directory : String
+        Folder the responses are saved in. Use one folder per endpoint
+    ttl : Float
+        Seconds a response stays valid. Never expires if None
+
+    Notes
+    -----
+    File Path: {directory}/{hash of the request}.json
+    Each response is written to a temporary file and then renamed so a crash
+        never leaves a half written response behind
+    """
+
+    def __init__(self, directory, ttl=7 * 24 * 60 * 60):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """Returns the file path a request is cached at"""
+
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key):
+        """Returns the cached response of a request, or None if there is no
+        valid one
+        """
+
+        try:
+            with open(self.path(key)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if self.ttl is not None and time() - entry["time"] > self.ttl:
+            return None
+        return entry["response"]
+
+    def put(self, key, response):
+        """Saves the response of a request"""
+
+        path = self.path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"time": time(), "request": key,
+                       "response": response}, file)
+        os.replace(temp_path, path)
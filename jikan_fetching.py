@@ -0,0 +1,165 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that has the fetch engine used to retrieve anime info from JikanAPI
+for my Final Project. Requests are spread over a few worker threads while a
+shared token bucket keeps the overall request rate under the API's limits.
+"""
+
+import random
+import threading
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class TokenBucket:
+    """Rate limiter that hands out at most `rate` tokens per second
+
+    Parameters
+    ----------
+    rate : Float
+        The amount of requests allowed per second
+    capacity : Integer
+        The most tokens that can be saved up for a burst of requests
+
+    Notes
+    -----
+    Safe to share between threads. Starts full so the first `capacity`
+        requests go out right away
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it"""
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+def fetch_with_retries(fetch, key, bucket, max_attempts=5, base_delay=2,
+                       max_delay=60, cache=None):
+    """Calls fetch(key) while respecting the rate limit and retrying failures
+
+    Parameters
+    ----------
+    fetch : Function
+        Function that makes one request given a key (ex: jikan.anime)
+    key : Object
+        The key to request (ex: an anime id)
+    bucket : TokenBucket
+        Rate limiter that every attempt has to take a token from
+    max_attempts : Integer
+        The most times the request is attempted before giving up
+    base_delay : Float
+        Seconds to back off after the first failure. Doubles every failure
+    max_delay : Float
+        The longest back off in seconds
+    cache : ResponseCache
+        Cache that is checked before (and filled after) the request
+
+    Returns
+    -------
+    Object
+        Returns the response of the request
+
+    Notes
+    -----
+    Raises the last error if every attempt fails
+    Back offs use "full jitter" (a random wait up to the exponential delay)
+        so workers that fail together don't all retry at the same moment
+    Cached responses are returned without taking a token
+    """
+
+    if cache is not None:
+        response = cache.get(key)
+        if response is not None:
+            return response
+    for attempt in range(1, max_attempts + 1):
+        bucket.acquire()
+        try:
+            response = fetch(key)
+            if cache is not None:
+                cache.put(key, response)
+            return response
+        except Exception:
+            if attempt == max_attempts:
+                raise
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            sleep(random.uniform(0, delay))
+
+
+def fetch_all(keys, fetch, rate=0.5, workers=4, max_attempts=5,
+              base_delay=2, max_delay=60, bucket=None, cache=None,
+              on_result=None):
+    """Fetches every key concurrently under a shared rate limit
+
+    Parameters
+    ----------
+    keys : List
+        The keys to request. Duplicates are only requested once
+    fetch : Function
+        Function that makes one request given a key (ex: jikan.anime)
+    rate : Float
+        The amount of requests allowed per second over all workers
+    workers : Integer
+        The amount of threads making requests
+    max_attempts : Integer
+        The most times a key is attempted before it is given up on
+    base_delay : Float
+        Seconds to back off after the first failure of a key
+    max_delay : Float
+        The longest back off in seconds
+    bucket : TokenBucket
+        Rate limiter to use instead of making a new one from `rate`
+    cache : ResponseCache
+        Cache that is checked before (and filled after) every request
+    on_result : Function
+        Called with the key and response as soon as each key succeeds
+
+    Returns
+    -------
+    Tuple
+        Returns a dictionary of key to response and a dead letter list of the
+        keys that failed every attempt (in the order given)
+    """
+
+    bucket = bucket if bucket else TokenBucket(rate)
+    keys = list(dict.fromkeys(keys))
+    results = {}
+    dead_letters = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_with_retries, fetch, key, bucket,
+                                   max_attempts, base_delay, max_delay,
+                                   cache): key
+                   for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as error:
+                print(f"Giving up on {key} after {max_attempts} attempts: " +
+                      f"{error!r}")
+                dead_letters.append(key)
+                continue
+            if on_result:
+                on_result(key, results[key])
+    results = {key: results[key] for key in keys if key in results}
+    dead_letters = [key for key in keys if key in dead_letters]
+    return results, dead_letters
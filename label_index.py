@@ -0,0 +1,249 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that splits the comma separated genre/studio columns of the anime
+data once into a sparse anime by label matrix. Counts, average scores and
+yearly breakdowns of the labels are then sparse matrix products instead of
+string splitting, exploding and one-hot encoding every time.
+"""
+
+import weakref
+from itertools import chain
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import tracing
+
+_indexes = {}
+
+
+class LabelIndex:
+    """Sparse incidence matrix (anime by label) of a multi-label column
+
+    Parameters
+    ----------
+    labels : Series
+        Pandas Series of comma separated labels (ex: anime_data["genre"]).
+        Missing values and empty strings are rows without any labels
+    separator : String
+        The string that separates labels
+
+    Attributes
+    ----------
+    matrix : csr_matrix
+        matrix[i, j] is how many times row i is tagged with label j
+    vocabulary : Index
+        The labels of the matrix columns in alphabetical order
+    index : Index
+        The index of the labels Series (the matrix rows)
+    """
+
+    def __init__(self, labels, separator=", "):
+        split = labels.fillna("").str.split(separator)
+        lengths = np.fromiter(map(len, split), dtype="int64",
+                              count=len(split))
+        flat = np.fromiter(chain.from_iterable(split), dtype=object,
+                           count=lengths.sum())
+        labeled = flat != ""
+        if not labeled.all():
+            rows = np.repeat(np.arange(len(split)), lengths)
+            lengths = np.bincount(rows[labeled], minlength=len(split))
+            flat = flat[labeled]
+        codes, vocabulary = pd.factorize(flat, sort=True)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(codes)), codes, indptr),
+            shape=(len(labels), len(vocabulary)))
+        self.matrix.sum_duplicates()
+        self.vocabulary = pd.Index(vocabulary)
+        self.index = labels.index
+
+    def counts(self, mask=None):
+        """Returns how many rows are tagged with each label
+
+        Parameters
+        ----------
+        mask : Array
+            Boolean array of the rows to count. Counts every row if None
+
+        Returns
+        -------
+        Series
+            Pandas Series of label to count (in alphabetical order)
+        """
+
+        matrix = self.matrix if mask is None else self.matrix[mask]
+        return pd.Series(np.asarray(matrix.sum(axis=0)).ravel()
+                         .astype("int64"), index=self.vocabulary)
+
+    def means(self, values, weights=None):
+        """Returns the average of the values of the rows tagged with a label
+
+        Parameters
+        ----------
+        values : Series
+            The value of every row (ex: anime_data["score"])
+        weights : Array
+            How many times each row counts. Every row counts once if None
+
+        Returns
+        -------
+        Series
+            Pandas Series of label to average (in alphabetical order). Labels
+            without any rows are left out
+        """
+
+        weights = np.ones(self.matrix.shape[0]) if weights is None \
+            else np.asarray(weights, dtype="float64")
+        counts = self.matrix.T @ weights
+        sums = self.matrix.T @ (weights * np.asarray(values, dtype="float64"))
+        found = counts > 0
+        return pd.Series(sums[found] / counts[found],
+                         index=self.vocabulary[found])
+
+    def group_counts(self, groups, mask=None):
+        """Returns how many rows of each group are tagged with each label
+
+        Parameters
+        ----------
+        groups : Series
+            The group of every row (ex: anime_data["aired_from_year"])
+        mask : Array
+            Boolean array of the rows to count. Counts every row if None
+
+        Returns
+        -------
+        DataFrame
+            Pandas DataFrame with a row per group (sorted) and a column per
+            label (alphabetical). Labels that never show up are left out
+        """
+
+        matrix, groups = self.matrix, np.asarray(groups)
+        if mask is not None:
+            matrix, groups = matrix[mask], groups[mask]
+        one_hot, uniques = _one_hot(groups)
+        counts = (one_hot.T @ matrix).toarray().astype("int64")
+        found = counts.sum(axis=0) > 0
+        return pd.DataFrame(counts[:, found], columns=self.vocabulary[found],
+                            index=pd.Index(uniques))
+
+    def group_means(self, groups, values):
+        """Returns the average value of every label and group pairing
+
+        Parameters
+        ----------
+        groups : Series
+            The group of every row (ex: anime_data["aired_from_year"])
+        values : Series
+            The value of every row (ex: anime_data["score"])
+
+        Returns
+        -------
+        DataFrame
+            Long Pandas DataFrame with label, group and mean columns sorted
+            by label then group. Pairings without any rows are left out
+        """
+
+        one_hot, uniques = _one_hot(np.asarray(groups))
+        counts = (self.matrix.T @ one_hot).tocoo()
+        sums = (self.matrix.T @ one_hot.multiply(
+            np.asarray(values, dtype="float64")[:, None])).tocsr()
+        order = np.lexsort((counts.col, counts.row))
+        rows, cols = counts.row[order], counts.col[order]
+        return pd.DataFrame({
+            "label": self.vocabulary[rows],
+            "group": uniques[cols],
+            "mean": np.asarray(sums[rows, cols]).ravel() /
+            counts.data[order]
+        })
+
+    def cross_means(self, other, values, weights=None):
+        """Returns the average value of every pairing of labels from two
+        indexes (ex: genre and studio)
+
+        Parameters
+        ----------
+        other : LabelIndex
+            Index of another multi-label column of the same rows
+        values : Series
+            The value of every row (ex: anime_data["score"])
+        weights : Array
+            How many times each row counts. Every row counts once if None
+
+        Returns
+        -------
+        Tuple
+            Returns sparse matrices of the weighted counts and sums of every
+            pairing (labels of this index by labels of the other index)
+        """
+
+        weights = np.ones(self.matrix.shape[0]) if weights is None \
+            else np.asarray(weights, dtype="float64")
+        weighted = self.matrix.T.multiply(weights).tocsr()
+        counts = weighted @ other.matrix
+        sums = weighted.multiply(np.asarray(values, dtype="float64")) \
+            .tocsr() @ other.matrix
+        return counts.tocsr(), sums.tocsr()
+
+    def dummies(self, prefix=""):
+        """Returns the one-hot (0/1) DataFrame of the labels
+
+        Parameters
+        ----------
+        prefix : String
+            Added to the start of every column name
+
+        Returns
+        -------
+        DataFrame
+            The same result as Series.str.get_dummies on the labels
+        """
+
+        return pd.DataFrame((self.matrix > 0).toarray().astype("int64"),
+                            columns=prefix + self.vocabulary,
+                            index=self.index)
+
+
+def _one_hot(groups):
+    """Returns a sparse one-hot matrix (rows by group) and the sorted groups"""
+
+    codes, uniques = pd.factorize(groups, sort=True)
+    one_hot = sparse.csr_matrix(
+        (np.ones(len(codes)), (np.arange(len(codes)), codes)),
+        shape=(len(codes), len(uniques)))
+    return one_hot, np.asarray(uniques)
+
+
+@tracing.traced("compute")
+def get(data, column):
+    """Returns the LabelIndex of a column of a DataFrame, building it once
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    column : String
+        The multi-label column (ex: "genre" or "studio")
+
+    Returns
+    -------
+    LabelIndex
+        Returns the index of the column
+
+    Notes
+    -----
+    Indexes are remembered for as long as the DataFrame exists, so every
+        research question reuses the same split of the loaded data
+    """
+
+    key = (id(data), column)
+    if key in _indexes:
+        reference, index = _indexes[key]
+        if reference() is data:
+            return index
+    index = LabelIndex(data[column])
+    _indexes[key] = (weakref.ref(data, lambda _: _indexes.pop(key, None)),
+                     index)
+    return index
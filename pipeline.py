@@ -0,0 +1,538 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that runs my whole Final Project as a pipeline of stages (cleaning,
+retrieving, and every figure/list of the research questions). Each stage
+declares the files it reads and writes, so only stages whose inputs, outputs
+or code changed since their last run are rebuilt, and stages that don't
+depend on each other run at the same time.
+
+Example: python pipeline.py rq4 --workers 4
+"""
+
+import os
+import glob
+import json
+import argparse
+from time import perf_counter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import data_loading
+import artifact_cache
+import plot_executor
+import tracing
+import data_retrieve_cleaning as cleaning
+import rq_one
+import rq_two
+import rq_three
+import rq_four
+import scoring
+
+STATE_PATH = "data/pipeline_state.json"
+ORIGINAL_DATA = {
+    "user_animelists": "data/original_data/users_animelists_azathoth.csv",
+    "anime": "data/original_data/anime_azathoth.csv",
+    "users": "data/original_data/users_azathoth.csv"
+}
+
+# func is called with the loaded datasets first, then args and kwargs.
+# inputs/outputs are file paths (outputs may be glob patterns) and code is
+# the names of the modules whose code func runs
+Stage = namedtuple("Stage", ["name", "func", "datasets", "inputs", "outputs",
+                             "code", "args", "kwargs"])
+_loaded = {}
+
+
+def runs(*modules):
+    """Marks a stage function of this module with the modules it runs
+
+    Parameters
+    ----------
+    *modules
+        Names of the modules whose code the function runs (ex: "rq_one")
+
+    Returns
+    -------
+    Function
+        Returns a decorator that records the modules on the function
+
+    Notes
+    -----
+    This module imports every research question, so without it a wrapper
+        here would depend on the code of all of them
+    """
+
+    def mark(func):
+        func.modules = modules
+        return func
+    return mark
+
+
+def stage(name, func, datasets=(), inputs=(), outputs=(), *args, **kwargs):
+    """Declares a pipeline stage
+
+    Parameters
+    ----------
+    name : String
+        Unique name of the stage. The part before the first "_" is its group
+        (ex: "rq4_optimal_depth" is in "rq4")
+    func : Function
+        Module level function that the stage runs. Its code is the module it
+        is in, or the modules it was marked with (see runs), and every module
+        they import
+    datasets : List
+        Names of the cleaned datasets (see data_loading) that are loaded and
+        passed to func first. Their CSVs are inputs of the stage
+    inputs : List
+        Other files the stage reads
+    outputs : List
+        Files (or glob patterns) the stage writes
+    *args, **kwargs
+        Passed to func after the datasets
+
+    Returns
+    -------
+    Stage
+        Returns the declared stage
+    """
+
+    inputs = list(inputs) + [data_loading.csv_path(name)
+                             for name in datasets]
+    return Stage(name, func, tuple(datasets), tuple(inputs), tuple(outputs),
+                 getattr(func, "modules", (func.__module__,)), args, kwargs)
+
+
+@runs("rq_one")
+def save_averages(user_data):
+    """Plots and saves the overall and gendered user averages (rq1)"""
+
+    averages = rq_one.average_user(user_data)
+    gender_averages = rq_one.average_by_gender(user_data)
+    rq_one.plot_averages(averages, gender_averages)
+    rq_one.save_lists([("overall_avg", averages),
+                       ("gendered_avg", gender_averages)])
+
+
+@runs("rq_three")
+def plot_genre_averages(anime_data):
+    """Plots the studio scores of the top and picked genres (rq3)"""
+
+    for genre in dict.fromkeys(list(rq_three.top_genres(anime_data, 5)) +
+                               ["Comedy", "Romance", "Action"]):
+        rq_three.plot_genre_average(anime_data, genres=[genre])
+
+
+def get_stages(year=2019):
+    """Returns every stage of the project
+
+    Parameters
+    ----------
+    year : Integer
+        The retrieved year that is compared with the anime from before 2018
+
+    Returns
+    -------
+    List
+        Returns the stages in the order they are declared
+    """
+
+    # The Parquet copies are optional, so only the CSVs are tracked
+    def cleaned(name):
+        return [data_loading.csv_path(name)]
+
+    season = f"anime_{year}"
+    return [
+        stage("data_user_animelists", cleaning.clean_user_animelists, (),
+              [ORIGINAL_DATA["user_animelists"]], cleaned("user_animelists")),
+        stage("data_anime", cleaning.clean_animelist, (),
+              [ORIGINAL_DATA["anime"]], cleaned("anime")),
+        stage("data_users", cleaning.clean_userlist, (),
+              [ORIGINAL_DATA["users"]], cleaned("users")),
+        stage(f"data_{year}", cleaning.get_season_data, (), (),
+              cleaned(season), [year]),
+
+        stage("rq1_averages", save_averages, ["users"], (),
+              ["plots/rq1_averages.png", "lists/rq1_overall_avg.txt",
+               "lists/rq1_gendered_avg.txt"]),
+        stage("rq1_time_spent", rq_one.plot_time_spent, ["users"], (),
+              ["plots/rq1_time_spent.png"]),
+        stage("rq1_gender_genres", rq_one.plot_gender_genres,
+              ["anime", "users"], [data_loading.csv_path("user_animelists")],
+              ["plots/rq1_gender_genres.png",
+               "plots/rq1_gender_genres2.png"]),
+
+        stage("rq2_multi_genre", rq_two.plot_genres_multi, ["anime"], (),
+              ["plots/rq2_multi_genre.png"]),
+        stage("rq2_main_genre", rq_two.plot_genres_first, ["anime"], (),
+              ["plots/rq2_main_genre.png"]),
+        stage(f"rq2_multi_genre{year}", rq_two.plot_genres_multi, [season],
+              (), [f"plots/rq2_multi_genre{year}.png"],
+              f"multi_genre{year}", f"in {year}"),
+        stage(f"rq2_main_genre{year}", rq_two.plot_genres_first, [season],
+              (), [f"plots/rq2_main_genre{year}.png"],
+              f"main_genre{year}", f"in {year}"),
+        stage("rq2_genres_yearly", rq_two.plot_genre_count_yearly, ["anime"],
+              (), ["plots/rq2_genres_yearly.png"]),
+        stage("rq2_genre_score_yearly", rq_two.plot_genre_score_yearly,
+              ["anime"], (), ["plots/rq2_genre_score_yearly.png"]),
+        stage("rq2_average_genre_score", rq_two.plot_average_scores,
+              ["anime"], (), ["plots/rq2_average_genre_score.png"]),
+
+        stage("rq3_20studios_yearly_score", rq_three.plot_yearly_studio_score,
+              ["anime"], (), ["plots/rq3_20studios_yearly_score.png"]),
+        stage("rq3_50studios_yearly_score", rq_three.plot_yearly_studio_score,
+              ["anime"], (), ["plots/rq3_50studios_yearly_score.png"], 50),
+        stage("rq3_studio_scores", rq_three.plot_studio_averages, ["anime"],
+              (), ["plots/rq3_best_studio_scores.png",
+                   "plots/rq3_worst_studio_scores.png"]),
+        stage("rq3_genre_scores", plot_genre_averages, ["anime"], (),
+              ["plots/rq3_genre_*_scores.png"]),
+        stage("rq3_studio_amounts", rq_three.plot_studio_amounts, ["anime"],
+              (), ["plots/rq3_studio_amounts.png"]),
+        stage("rq3_studios_yearly", rq_three.plot_studio_count_yearly,
+              ["anime"], (), ["plots/rq3_studios_yearly.png"]),
+
+        stage("rq4_optimal_features", rq_four.plot_optimal_features,
+              ["anime", season], (), ["plots/rq4_optimal_features.png"]),
+        stage("rq4_optimal_depth", rq_four.plot_optimal_depth,
+              ["anime", season], (), ["plots/rq4_optimal_depth.png"]),
+        stage("rq4_decision_tree", rq_four.plot_model_tree, ["anime"], (),
+              ["plots/rq4_decision_tree.png", "lists/rq4_decision_tree.txt"]),
+        stage("rq4_engines", rq_four.save_engine_report, ["anime", season],
+              (), ["lists/rq4_engines.txt"]),
+        stage("rq4_export_models", rq_four.export_models, ["anime"], (),
+              [f"{scoring.MODEL_DIR}/manifest.json"])
+    ]
+
+
+def get_dependencies(stages):
+    """Returns the stages that each stage depends on
+
+    Parameters
+    ----------
+    stages : List
+        The stages of the pipeline
+
+    Returns
+    -------
+    Dictionary
+        Returns stage name to the set of names of stages that write one of
+        its inputs
+    """
+
+    writers = {output: other.name for other in stages
+               for output in other.outputs}
+    return {current.name: {writers[path] for path in current.inputs
+                           if path in writers and
+                           writers[path] != current.name}
+            for current in stages}
+
+
+def select(stages, targets):
+    """Returns the names of the target stages and everything upstream of them
+
+    Parameters
+    ----------
+    stages : List
+        The stages of the pipeline
+    targets : List
+        Stage names or groups (ex: "rq4", "data", "rq2_multi_genre")
+
+    Returns
+    -------
+    Set
+        Returns the names of the selected stages
+    """
+
+    dependencies = get_dependencies(stages)
+    selected = {current.name for current in stages
+                if not targets or current.name in targets or
+                current.name.split("_")[0] in targets}
+    pending = list(selected)
+    while pending:
+        for upstream in dependencies[pending.pop()]:
+            if upstream not in selected:
+                selected.add(upstream)
+                pending.append(upstream)
+    return selected
+
+
+def forced_stages(stages, targets):
+    """Returns the names of the stages that --force rebuilds
+
+    Parameters
+    ----------
+    stages : List
+        The stages of the pipeline
+    targets : List
+        Stage names or groups (ex: "rq4", "data", "rq2_multi_genre")
+
+    Returns
+    -------
+    Set
+        Returns the target stages, or every stage outside the "data" group if
+        there are no targets. Retrieving and cleaning the data is slow (and
+        rate limited), so it is only forced when it is asked for by name
+    """
+
+    if not targets:
+        return {current.name for current in stages
+                if current.name.split("_")[0] != "data"}
+    return {current.name for current in stages if current.name in targets or
+            current.name.split("_")[0] in targets}
+
+
+def _expand(patterns):
+    """Returns the existing files matching the given paths/glob patterns"""
+
+    return sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+
+def fingerprint(current):
+    """Returns what a stage's inputs, outputs and code currently look like
+
+    Parameters
+    ----------
+    current : Stage
+        The stage to fingerprint
+
+    Returns
+    -------
+    Dictionary
+        Returns the hashes of the input files, output files and code, plus
+        the arguments of the stage
+    """
+
+    return {
+        "inputs": {path: artifact_cache.file_hash(path)
+                   for path in current.inputs if os.path.exists(path)},
+        "outputs": {path: artifact_cache.file_hash(path)
+                    for path in _expand(current.outputs)},
+        "code": artifact_cache.code_version(current.func, current.code),
+        "args": repr((current.args, sorted(current.kwargs.items())))
+    }
+
+
+def is_stale(current, state):
+    """Checks if a stage has to be rebuilt
+
+    Parameters
+    ----------
+    current : Stage
+        The stage to check
+    state : Dictionary
+        The fingerprints recorded when stages last finished
+
+    Returns
+    -------
+    Boolean
+        True if the stage never ran, an input, output, argument or the code
+        changed, or an output is missing
+
+    Notes
+    -----
+    A stage without inputs (retrieving from JikanAPI) or whose inputs aren't
+        there (ex: only the cleaned data was downloaded) is only rebuilt when
+        an output is missing
+    """
+
+    missing = any(not glob.glob(pattern) for pattern in current.outputs)
+    if not current.inputs or \
+            not all(os.path.exists(path) for path in current.inputs):
+        return missing
+    return missing or current.name not in state or \
+        fingerprint(current) != state[current.name]
+
+
+def run_stage(current):
+    """Runs one stage and returns how long it took
+
+    Parameters
+    ----------
+    current : Stage
+        The stage to run
+
+    Returns
+    -------
+    Float
+        Returns the seconds the stage took
+
+    Notes
+    -----
+    Datasets are loaded once per process and reused by later stages
+    """
+
+    start = perf_counter()
+    with tracing.span(current.name, "stage"):
+        for name in current.datasets:
+            path = data_loading.source_path(name)
+            if _loaded.get(name, (None,))[0] != \
+                    artifact_cache.file_hash(path):
+                _loaded[name] = (artifact_cache.file_hash(path),
+                                 data_loading.load(name))
+        current.func(*[_loaded[name][1] for name in current.datasets],
+                     *current.args, **current.kwargs)
+        plot_executor.close_all()
+    return perf_counter() - start
+
+
+def _load_state():
+    """Returns the recorded stage fingerprints"""
+
+    try:
+        with open(STATE_PATH) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    """Saves the recorded stage fingerprints"""
+
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    with open(STATE_PATH, "w") as file:
+        json.dump(state, file, indent=4)
+
+
+def run(targets=(), force=False, workers=1, year=2019, dry_run=False,
+        trace=None):
+    """Rebuilds the stale selected stages, running independent ones together
+
+    Parameters
+    ----------
+    targets : List
+        Stage names or groups to build (with everything upstream of them).
+        Builds every stage if empty
+    force : Boolean
+        Whether to rebuild the targets even if they are up to date (see
+        forced_stages). Stages upstream of them are still only rebuilt if
+        stale
+    workers : Integer
+        The amount of stages that run at the same time (in processes)
+    year : Integer
+        The retrieved year that is compared with the anime from before 2018
+    dry_run : Boolean
+        Whether to only print which stages would run
+    trace : String
+        Where to save a trace of the stages that ran (see tracing). Nothing
+        is traced if not given
+
+    Returns
+    -------
+    Dictionary
+        Returns stage name to "ran", "up to date", "would run" (dry run),
+        "failed" or "skipped" (because something upstream failed)
+    """
+
+    stages = get_stages(year)
+    by_name = {current.name: current for current in stages}
+    dependencies = get_dependencies(stages)
+    selected = select(stages, targets)
+    forced = forced_stages(stages, targets)
+    unknown = set(targets) - selected - \
+        {current.name.split("_")[0] for current in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}")
+
+    if trace:
+        tracing.enable()
+    state = _load_state()
+    status = {}
+    timings = {}
+    pending = [current.name for current in stages
+               if current.name in selected]
+    running = {}
+    executor = ProcessPoolExecutor(
+        workers, initializer=tracing.init_worker,
+        initargs=(tracing.settings(),)) if workers > 1 else None
+    start = perf_counter()
+    try:
+        while pending or running:
+            for name in list(pending):
+                upstream = [status.get(other) for other in dependencies[name]
+                            if other in selected]
+                if any(result in ("failed", "skipped")
+                       for result in upstream):
+                    status[name] = "skipped"
+                    pending.remove(name)
+                elif all(result is not None for result in upstream) and \
+                        len(running) < max(workers, 1):
+                    pending.remove(name)
+                    current = by_name[name]
+                    if dry_run and "would run" in upstream:
+                        status[name] = "would run"
+                    elif not (force and name in forced) and \
+                            not is_stale(current, state):
+                        status[name] = "up to date"
+                    elif dry_run:
+                        status[name] = "would run"
+                    elif executor:
+                        running[executor.submit(
+                            tracing.call, run_stage, current)] = name
+                    else:
+                        running[name] = name
+            if not running:
+                continue
+            if executor:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            else:
+                done = list(running)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = tracing.merge(future.result()) \
+                        if executor else run_stage(by_name[name])
+                except Exception as error:
+                    print(f"{name} failed: {error!r}")
+                    status[name] = "failed"
+                    continue
+                status[name] = "ran"
+                state[name] = fingerprint(by_name[name])
+                _save_state(state)
+    finally:
+        if executor:
+            executor.shutdown()
+        if trace:
+            print(tracing.save(trace))
+            tracing.disable()
+
+    print(f"{'Stage':<32}{'Status':<12}Seconds")
+    for name in [current.name for current in stages if current.name in status]:
+        seconds = f"{timings[name]:.1f}" if name in timings else "-"
+        print(f"{name:<32}{status[name]:<12}{seconds}")
+    print(f"Total: {perf_counter() - start:.1f} seconds")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("targets", nargs="*",
+                        help="stages or groups (data, rq1, rq2, rq3, rq4) " +
+                        "to build, everything by default")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild the targets even if up to date (every " +
+                        "stage but data by default)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="stages that run at the same time")
+    parser.add_argument("--year", type=int, default=2019,
+                        help="retrieved year to compare against")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print which stages would run")
+    parser.add_argument("--list", action="store_true",
+                        help="list the stages and what they depend on")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="save a Chrome trace of the run (and a summary)")
+    args = parser.parse_args()
+    if args.list:
+        dependencies = get_dependencies(get_stages(args.year))
+        for name, upstream in dependencies.items():
+            print(f"{name}: {', '.join(sorted(upstream)) or '-'}")
+    else:
+        try:
+            run(args.targets, args.force, args.workers, args.year,
+                args.dry_run, args.trace)
+        except ValueError as error:
+            parser.error(str(error))
@@ -0,0 +1,204 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that renders the figures of my Final Project in parallel. Every
+figure (or text list) is a task that runs on a pool of processes drawing with
+matplotlib's Agg backend. The DataFrames the tasks need are handed to each
+worker once instead of being pickled with every task.
+
+Matplotlib and Seaborn take seconds to import, so they are only imported
+(and styled) by setup once something is plotted.
+"""
+
+import sys
+import multiprocessing
+from time import perf_counter
+from functools import partial
+from collections import namedtuple
+import pandas as pd
+import tracing
+
+# Stands in for a shared DataFrame/Series inside a task sent to a worker
+Dataset = namedtuple("Dataset", ["key"])
+_datasets = {}
+_styled = False
+
+
+def setup():
+    """Returns pyplot and seaborn ready to draw figures
+
+    Returns
+    -------
+    Tuple
+        Returns the matplotlib.pyplot and seaborn modules
+
+    Notes
+    -----
+    The first call imports them, switches to the Agg backend and applies
+        Seaborn's theme. Later calls only return them
+    """
+
+    global _styled
+    if not _styled:
+        import matplotlib
+        matplotlib.use("Agg")
+        import seaborn
+        seaborn.set()
+        _styled = True
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+
+def close_all():
+    """Closes every pyplot figure (if anything was plotted at all)"""
+
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close("all")
+
+
+def task_name(task):
+    """Returns a readable name for a task
+
+    Parameters
+    ----------
+    task : Tuple
+        A (function, args, kwargs) task
+
+    Returns
+    -------
+    String
+        Returns the module and function name with the simple (string and
+        number) arguments and the keyword arguments
+    """
+
+    func, args, kwargs = task
+    options = [repr(arg) for arg in args if isinstance(arg, (str, int, float))]
+    options += [f"{key}={value!r}" for key, value in kwargs.items()]
+    return f"{func.__module__}.{func.__name__}({', '.join(options)})"
+
+
+def _share(value, datasets):
+    """Replaces a DataFrame/Series with a Dataset marker and remembers it"""
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        datasets[id(value)] = value
+        return Dataset(id(value))
+    return value
+
+
+def _resolve(value):
+    """Replaces a Dataset marker with the DataFrame/Series it stands for"""
+
+    return _datasets[value.key] if isinstance(value, Dataset) else value
+
+
+def save_figure(fig, path, **kwargs):
+    """Saves a figure (traced as a "save" span, see tracing)
+
+    Parameters
+    ----------
+    fig : Figure
+        The figure to save
+    path : String
+        Where to save it
+    **kwargs
+        Passed on to savefig (ex: bbox_inches="tight")
+
+    Notes
+    -----
+    With the Agg backend the figure is drawn while saving, so this is where
+        most of the rendering time of a plot goes
+    """
+
+    with tracing.span("savefig", "save", path=path):
+        fig.savefig(path, **kwargs)
+
+
+def _init_worker(datasets, trace=None):
+    """Saves the shared DataFrames in a worker process
+
+    Parameters
+    ----------
+    datasets : Dictionary
+        The shared DataFrames by key, or None if they were inherited from the
+        parent process (fork)
+    trace : Dictionary
+        The parent's tracing settings, or None if it isn't tracing
+    """
+
+    tracing.init_worker(trace)
+    if datasets is not None:
+        _datasets.update(datasets)
+
+
+def _run_task(task):
+    """Runs one task and returns how long it took
+
+    Parameters
+    ----------
+    task : Tuple
+        A (function, args, kwargs) task whose DataFrames may be markers
+
+    Returns
+    -------
+    Tuple
+        Returns the task's name and the seconds it took
+    """
+
+    func, args, kwargs = task
+    start = perf_counter()
+    func(*[_resolve(arg) for arg in args],
+         **{key: _resolve(value) for key, value in kwargs.items()})
+    close_all()
+    return task_name(task), perf_counter() - start
+
+
+def run_tasks(tasks, workers=1):
+    """Runs figure/list tasks, in parallel if there is more than one worker
+
+    Parameters
+    ----------
+    tasks : List
+        List of (function, args, kwargs) tuples. The functions must be
+        module level functions that save their own output
+    workers : Integer
+        The amount of processes to render with. Runs in this process if 1
+
+    Returns
+    -------
+    List
+        Returns (task name, seconds) tuples in the order tasks finished
+
+    Notes
+    -----
+    Every task draws on its own figure with the Agg backend, so the images
+        are the same no matter how many workers there are
+    With the fork start method the workers inherit the DataFrames for free.
+        Otherwise they are pickled once per worker, never once per task
+    The spans traced in the workers are added to this process' trace
+    """
+
+    if workers <= 1:
+        return [_run_task(task) for task in tasks]
+
+    datasets = {}
+    shared = [(func, tuple(_share(arg, datasets) for arg in args),
+               {key: _share(value, datasets)
+                for key, value in kwargs.items()})
+              for func, args, kwargs in tasks]
+    context = multiprocessing.get_context()
+    if context.get_start_method() == "fork":
+        _datasets.update(datasets)
+        initargs = (None, tracing.settings())
+    else:
+        initargs = (datasets, tracing.settings())
+    try:
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=initargs) as pool:
+            return [tracing.merge(result) for result in pool.imap_unordered(
+                partial(tracing.call, _run_task), shared)]
+    finally:
+        _datasets.clear()
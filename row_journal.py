@@ -0,0 +1,67 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that keeps append only journals of JSON rows on disk for my Final
+Project (parsed anime of an interrupted retrieval, finished tuning cells,
+benchmark history), so long running work can pick up where it stopped.
+"""
+
+import os
+import json
+import threading
+
+
+class Journal:
+    """Append only file of parsed rows that survives crashes
+
+    Parameters
+    ----------
+    path : String
+        Path of the journal file (one JSON row per line)
+
+    Notes
+    -----
+    Every row is flushed to disk as soon as it is appended. A half written
+        last line (from a crash) is dropped when reading
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def read(self):
+        """Returns all the rows in the journal
+
+        Notes
+        -----
+        Cuts off a half written last line so new rows start on a fresh line
+        """
+
+        if not os.path.exists(self.path):
+            return []
+        with self.lock:
+            with open(self.path, "rb+") as file:
+                content = file.read()
+                complete = content.rfind(b"\n") + 1
+                if complete < len(content):
+                    file.truncate(complete)
+        return [json.loads(line)
+                for line in content[:complete].decode().splitlines()]
+
+    def append(self, row):
+        """Adds a row to the end of the journal"""
+
+        with self.lock:
+            with open(self.path, "a") as file:
+                file.write(json.dumps(row) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    def clear(self):
+        """Removes every row from the journal"""
+
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -5,24 +5,65 @@ Final Project
 
 A script that has multiple functions that manipulate/visualize data about
 My Anime List to answer my fourth research question for my final project.
+
+Scikit-learn is only imported by the functions that fit or score models, so
+the features can be built without waiting for it.
 """
 
 import os
-import graphviz
+import json
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.tree import DecisionTreeRegressor, export_graphviz
-from sklearn.metrics import mean_squared_error, mean_absolute_error
-sns.set()
-# The line below makes it so graphviz works. Please Redirect path if your
-# GraphViz files are elsewhere
-os.environ["PATH"] += os.pathsep + "D:/Program Files/Graphviz2.38/bin/"
+import artifact_cache
+import feature_encoding
+import plot_executor
+import scoring
+import tracing
+import tree_rendering
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+
+TARGETS = ["score", "favorites"]
+ENGINES = ["tree", "forest", "hgb"]
+# Engines that fit score and favorites as one multi-output model
+MULTI_OUTPUT = ["forest"]
+# The most feature columns gradient boosting is fit on (it needs them dense)
+HGB_COLUMNS = 256
+_sweep = {}
+
+
+@tracing.traced("compute")
+def get_encoder(data, feature_removed=None):
+    """Returns the feature encoder fit on the given dataset (cached, see
+    artifact_cache)
 
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains the training anime show data
+    feature_removed : String
+        A feature that will be left out of the encoding
 
-def get_features(data, feature_removed=None):
+    Returns
+    -------
+    FeatureEncoder
+        Returns an encoder that knows the type/source/genre/studio labels of
+        the data. Any other data encoded with it gets the same columns
+    """
+
+    features = [feature for feature in feature_encoding.FEATURES
+                if feature != feature_removed]
+    return artifact_cache.cached(
+        "rq4_encoder",
+        lambda: feature_encoding.FeatureEncoder(features).fit(data),
+        inputs=[data], params={"feature_removed": feature_removed})
+
+
+@tracing.traced("compute")
+def get_features(data, feature_removed=None, encoder=None):
     """Retrieves the features for a score/popularity machine learning model
-    of the given dataset
+    of the given dataset (cached, see artifact_cache)
 
     Parameters
     ----------
@@ -30,32 +71,33 @@ def get_features(data, feature_removed=None):
         Pandas DataFrame that contains anime show data
     feature_removed : String
         A feature that will be removed from the data
+    encoder : FeatureEncoder
+        The fitted encoder to use (ex: the training data's encoder when
+        scoring a new season). Defaults to one fit on data
 
     Returns
     -------
-    DataFrame
-        Returns a Pandas DataFrame that contains the features required for the
-        Machine learning model
-    """
+    csr_matrix
+        Returns a sparse matrix that contains the features required for the
+        Machine learning model (the column names are the encoder's
+        feature_names)
 
-    feature_names = \
-        ["type", "episodes", "duration_min", "source", "genre", "studio"]
-    if feature_removed:
-        feature_names.remove(feature_removed)
+    Notes
+    -----
+    The studio and genre columns are almost all zeros, so the features stay
+        sparse all the way into fitting and predicting
+    """
 
-    features = data[feature_names].copy()
-    if "studio" in feature_names:
-        features = features.loc[:, features.columns != "studio"] \
-            .join(features["studio"].str.get_dummies(", ")
-                  .add_prefix("studio_"))
-    if "genre" in feature_names:
-        features = features.loc[:, features.columns != "genre"] \
-            .join(features["genre"].str.get_dummies(", ").add_prefix("genre_"))
-    features = pd.get_dummies(features)
-    return features
+    encoder = encoder if encoder else get_encoder(data, feature_removed)
+    return artifact_cache.cached(
+        "rq4_features", lambda: encoder.transform(data),
+        inputs=[data], params={"features": encoder.features,
+                               "vocabularies": encoder.vocabularies})
 
 
-def train_model(data, max_depth=None, feature_removed=None):
+@tracing.traced("compute")
+def train_model(data, max_depth=None, feature_removed=None, engine="tree",
+                n_jobs=1):
     """Trains a machine learning model to predict popularity and score
 
     Parameters
@@ -66,79 +108,444 @@ def train_model(data, max_depth=None, feature_removed=None):
         The maximum Decision Tree Depth the model can go. (Hyperparemeter)
     feature_removed : String
         A feature that is removed from consideration for the model
+    engine : String
+        The kind of model (see make_estimator): "tree" (a Decision Tree),
+        "forest" (a Random Forest) or "hgb" (Histogram Gradient Boosting)
+    n_jobs : Integer
+        The amount of cores a Random Forest is fit on
 
     Returns
     -------
     DecisionTreeRegressor
         Returns a Decision Tree Regressor model for the score model and
-        favorites/popularity model
+        favorites/popularity model (or the engine's models, which all have
+        a predict method)
+
+    Notes
+    -----
+    Fitted models are cached (see artifact_cache), so they are only trained
+        again when the data, parameters or code change. n_jobs isn't part of
+        the key since a forest is the same on any amount of cores
     """
 
+    return artifact_cache.cached(
+        "rq4_models",
+        lambda: _fit_models(data, max_depth, feature_removed, engine, n_jobs),
+        inputs=[data], params={"max_depth": max_depth,
+                               "feature_removed": feature_removed,
+                               "engine": engine})
+
+
+def _fit_models(data, max_depth=None, feature_removed=None, engine="tree",
+                n_jobs=1):
+    """Fits the models returned by train_model (without caching)"""
+
     features = get_features(data, feature_removed)
+    if engine in MULTI_OUTPUT:
+        model = make_estimator(engine, max_depth, n_jobs, features.shape[1])
+        model.fit(features, data[TARGETS].to_numpy("float64"))
+        return tuple(TargetModel(model, column)
+                     for column in range(len(TARGETS)))
 
-    score_model = DecisionTreeRegressor(max_depth=max_depth)
+    score_model = make_estimator(engine, max_depth, n_jobs, features.shape[1])
     score_model.fit(features, data["score"])
 
-    favorites_model = DecisionTreeRegressor(max_depth=max_depth)
+    favorites_model = \
+        make_estimator(engine, max_depth, n_jobs, features.shape[1])
     favorites_model.fit(features, data["favorites"])
     return score_model, favorites_model
 
 
-def plot_optimal_depth(anime_data, anime_2019):
-    """Plots the varying score/favorite model errors of different tree depths
+def make_estimator(engine="tree", max_depth=None, n_jobs=1,
+                   n_features=HGB_COLUMNS):
+    """Returns an unfitted model of one of the ENGINES
+
+    Parameters
+    ----------
+    engine : String
+        "tree" is a single Decision Tree like the original model. "forest" is
+        a Random Forest fit on n_jobs cores, which predicts score and
+        favorites at once (both standardized so neither outweighs the
+        other). "hgb" is Histogram Gradient Boosting that stops adding trees
+        once a held out part of the training data stops improving
+    max_depth : Integer
+        The maximum depth of every tree
+    n_jobs : Integer
+        The amount of cores a Random Forest is fit on. Keep it at 1 when
+        other models are fit at the same time (ex: in plot_executor or
+        pipeline workers) so they don't fight over the cores
+    n_features : Integer
+        The amount of feature columns the model will be fit on
+
+    Returns
+    -------
+    Estimator
+        Returns a scikit-learn regressor that takes the sparse features
+
+    Notes
+    -----
+    Gradient boosting bins every column, which needs dense features. So it is
+        only fit on the HGB_COLUMNS columns with the most nonzero values (the
+        numeric columns and the most common labels), which keeps the dense
+        copy small no matter how many studios there are
+    """
+
+    from sklearn.compose import TransformedTargetRegressor
+    from sklearn.ensemble import RandomForestRegressor, \
+        HistGradientBoostingRegressor
+    from sklearn.feature_selection import SelectKBest
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import FunctionTransformer, StandardScaler
+    from sklearn.tree import DecisionTreeRegressor
+
+    if engine == "tree":
+        return DecisionTreeRegressor(max_depth=max_depth)
+    if engine == "forest":
+        return TransformedTargetRegressor(
+            RandomForestRegressor(n_estimators=100, max_depth=max_depth,
+                                  min_samples_leaf=3, max_features=0.3,
+                                  n_jobs=n_jobs, random_state=0),
+            transformer=StandardScaler())
+    if engine == "hgb":
+        return make_pipeline(
+            SelectKBest(_nonzero_counts, k=min(n_features, HGB_COLUMNS)),
+            FunctionTransformer(_to_dense),
+            HistGradientBoostingRegressor(max_depth=max_depth, max_iter=500,
+                                          early_stopping=True,
+                                          random_state=0))
+    raise ValueError(f"Unknown engine {engine} (expected one of {ENGINES})")
+
+
+def _nonzero_counts(features, target):
+    """Returns the amount of nonzero values in every feature column"""
+
+    return np.asarray((features != 0).sum(axis=0)).ravel()
+
+
+def _to_dense(features):
+    """Returns the (selected) features as a dense array"""
+
+    return features.toarray() if sparse.issparse(features) else features
+
+
+class TargetModel:
+    """One target of a model that predicts several targets at once
+
+    Parameters
+    ----------
+    model : Estimator
+        A fitted multi-output model
+    column : Integer
+        The output (in TARGETS order) this model predicts
+    """
+
+    def __init__(self, model, column):
+        self.model = model
+        self.column = column
+
+    def predict(self, features):
+        """Returns the predictions of this model's target"""
+
+        return self.model.predict(features)[:, self.column]
+
+
+@tracing.traced("compute")
+def compare_engines(anime_data, anime_2019, engines=ENGINES, max_depth=None,
+                    n_jobs=1):
+    """Trains every engine on the same features and compares them
 
     Parameters
     ----------
     anime_data : DataFrame
-        Pandas DataFrame that contains anime show data before 2019
+        Pandas DataFrame that contains anime show data before 2018
     anime_2019 : DataFrame
-        Pandas DataFrame that contains anime show data in 2019
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year), used as the holdout
+    engines : List
+        The engines to compare (see make_estimator)
+    max_depth : Integer
+        The maximum depth of every tree
+    n_jobs : Integer
+        The amount of cores a Random Forest is fit on
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per engine with its fit seconds, predicted rows per
+        second (of the training features) and the holdout mean absolute and
+        mean squared errors of score and favorites
 
     Notes
     -----
-    Visualization Type: Line Plot
-    File Path: plots/rq4_optimal_depth.png
+    Models are fit again every time (not cached) so the fit times are real
     """
 
-    features = get_features(anime_2019). \
-        reindex(columns=get_features(anime_data).columns, fill_value=0)
+    from sklearn.metrics import mean_squared_error, mean_absolute_error
+
+    encoder = get_encoder(anime_data)
+    features = get_features(anime_data)
+    test_features = get_features(anime_2019, encoder=encoder)
+    rows = []
+    for engine in engines:
+        start = perf_counter()
+        models = _fit_models(anime_data, max_depth, engine=engine,
+                             n_jobs=n_jobs)
+        row = {"engine": engine, "fit_s": perf_counter() - start}
+
+        start = perf_counter()
+        for model in models:
+            model.predict(features)
+        row["predict_rows_per_s"] = \
+            features.shape[0] / (perf_counter() - start)
+
+        for target, model in zip(TARGETS, models):
+            predictions = model.predict(test_features)
+            row[f"{target}_mae"] = mean_absolute_error(
+                anime_2019[target], predictions)
+            row[f"{target}_mse"] = mean_squared_error(
+                anime_2019[target], predictions)
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("engine")
+
+
+@tracing.traced("save")
+def save_engine_report(anime_data, anime_2019, n_jobs=1):
+    """Saves the engine comparison as a text table
 
-    score_info = {
-        "depth": [],
-        "error_type": [],
-        "error_value": []
-    }
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2018
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
+    n_jobs : Integer
+        The amount of cores a Random Forest is fit on
 
-    favorites_info = {
-        "depth": [],
-        "error_type": [],
-        "error_value": []
-    }
+    Notes
+    -----
+    File Path: lists/rq4_engines.txt
+    """
+
+    report = compare_engines(anime_data, anime_2019, n_jobs=n_jobs)
+    with open("lists/rq4_engines.txt", "w") as file:
+        file.write(report.round(4).to_string())
+
+
+@tracing.traced("compute")
+def depth_predictions(model, features, depths):
+    """Returns the predictions of a fitted decision tree cut off at each depth
+
+    Parameters
+    ----------
+    model : DecisionTreeRegressor
+        A fitted tree (usually grown without a max_depth)
+    features : csr_matrix
+        The features to predict (sparse or dense)
+    depths : List
+        The depth caps to predict with
+
+    Returns
+    -------
+    Dictionary
+        Returns depth to an array of predictions. A tree cut off at a depth is
+        the tree max_depth would have grown, since every split only depends
+        on the rows that reach its node
+
+    Notes
+    -----
+    Every row walks down the tree's node arrays one level at a time, so all
+        depths cost a single pass over the tree
+    """
+
+    tree = model.tree_
+    values = tree.value[:, 0, 0]
+    features = _as_float32(features)
+    rows = np.arange(features.shape[0])
+    nodes = np.zeros(features.shape[0], dtype="intp")
+    predictions = {}
+    for depth in range(max(depths) + 1):
+        if depth in depths:
+            predictions[depth] = values[nodes]
+        left = tree.children_left[nodes]
+        go_left = _lookup(features, rows, tree.feature[nodes]) <= \
+            tree.threshold[nodes]
+        nodes = np.where(left == -1, nodes,
+                         np.where(go_left, left, tree.children_right[nodes]))
+    return predictions
+
+
+def _as_float32(features):
+    """Returns the features as a float32 CSR matrix if sparse or a float32
+    array otherwise (what the trees compare thresholds against)
+    """
+
+    if sparse.issparse(features):
+        return sparse.csr_matrix(features, dtype="float32")
+    return np.asarray(features, dtype="float32")
+
+
+def _lookup(features, rows, columns):
+    """Returns features[rows[i], columns[i]] for every i of a sparse or dense
+    matrix
+    """
+
+    if sparse.issparse(features):
+        return np.asarray(features[rows, columns]).ravel()
+    return features[rows, columns]
+
+
+def _init_sweep(features, target, test_features):
+    """Saves the data of a depth sweep in a worker process"""
+
+    _sweep.update(features=features, target=target,
+                  test_features=test_features)
+
+
+def _fit_predict(estimator):
+    """Fits an estimator on the sweep data and predicts the test features"""
+
+    estimator.fit(_sweep["features"], _sweep["target"])
+    return estimator.predict(_sweep["test_features"])
+
+
+@tracing.traced("compute")
+def sweep_depths(features, target, test_features, depths, estimator=None,
+                 workers=1):
+    """Returns the predictions of a model at every max_depth
+
+    Parameters
+    ----------
+    features : csr_matrix
+        The features to train on (sparse or dense)
+    target : Series
+        The values to train on (ex: anime_data["score"])
+    test_features : csr_matrix
+        The features to predict (with the same columns as features)
+    depths : List
+        The max_depth values to sweep
+    estimator : Estimator
+        The model to sweep. Defaults to a DecisionTreeRegressor
+    workers : Integer
+        The amount of processes that refit estimators that can't be cut off
+
+    Returns
+    -------
+    Dictionary
+        Returns depth to an array of predictions
+
+    Notes
+    -----
+    A depth first decision tree is grown once and cut off at every depth
+        (see depth_predictions). Any other estimator with a max_depth (ex: a
+        forest) is refit for every depth
+    """
+
+    from sklearn.base import clone
+    from sklearn.tree import DecisionTreeRegressor
+
+    depths = list(depths)
+    estimator = DecisionTreeRegressor() if estimator is None else estimator
+    if type(estimator) is DecisionTreeRegressor and \
+            estimator.max_leaf_nodes is None:
+        model = clone(estimator).set_params(max_depth=None)
+        model.fit(features, target)
+        return depth_predictions(model, test_features, depths)
+
+    estimators = [clone(estimator).set_params(max_depth=depth)
+                  for depth in depths]
+    if workers <= 1:
+        _init_sweep(features, target, test_features)
+        try:
+            return dict(zip(depths, map(_fit_predict, estimators)))
+        finally:
+            _sweep.clear()
+    with ProcessPoolExecutor(workers, initializer=_init_sweep,
+                             initargs=(features, target, test_features)) \
+            as executor:
+        return dict(zip(depths, executor.map(_fit_predict, estimators)))
+
+
+@tracing.traced("compute")
+def depth_errors(anime_data, anime_2019, depths=range(1, 51, 2)):
+    """Retrieves the score/favorite model errors of different tree depths
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2019
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
+    depths : List
+        The max_depths of the trees
 
-    for max_depth in range(1, 51, 2):
-        score_model, favorites_model = \
-            train_model(anime_data, max_depth)
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with target, depth, error_type and
+        error_value columns. Score has the mean absolute and squared error
+        of every depth, favorites only the mean absolute error
 
-        score_predictions, favorite_predictions = \
-            score_model.predict(features), favorites_model.predict(features)
+    Notes
+    -----
+    File Path: data/cache/rq4_depth_errors-{key}.pkl (see artifact_cache)
+    The favorites predictions are compared with the 2019 scores
+    """
 
-        score_info["depth"].append(max_depth)
-        score_info["error_type"].append("Mean Absolute Error")
-        score_info["error_value"] \
-            .append(mean_absolute_error(anime_2019["score"],
-                                        score_predictions))
+    def build():
+        from sklearn.metrics import mean_squared_error, mean_absolute_error
+
+        train_features = get_features(anime_data)
+        features = get_features(anime_2019, encoder=get_encoder(anime_data))
+        score_sweep = sweep_depths(train_features, anime_data["score"],
+                                   features, depths)
+        favorites_sweep = sweep_depths(train_features,
+                                       anime_data["favorites"], features,
+                                       depths)
+        rows = []
+        for max_depth in depths:
+            score_predictions, favorite_predictions = \
+                score_sweep[max_depth], favorites_sweep[max_depth]
+            rows += [
+                ("score", max_depth, "Mean Absolute Error",
+                 mean_absolute_error(anime_2019["score"], score_predictions)),
+                ("favorites", max_depth, "Mean Absolute Error",
+                 mean_absolute_error(anime_2019["score"],
+                                     favorite_predictions)),
+                ("score", max_depth, "Mean Squared Error",
+                 mean_squared_error(anime_2019["score"], score_predictions))
+            ]
+        return pd.DataFrame(rows, columns=["target", "depth", "error_type",
+                                           "error_value"])
+
+    return artifact_cache.cached(
+        "rq4_depth_errors", build, inputs=[anime_data, anime_2019],
+        params={"depths": list(depths)})
+
+
+@tracing.traced("render")
+def plot_optimal_depth(anime_data, anime_2019):
+    """Plots the varying score/favorite model errors of different tree depths
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2019
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
 
-        favorites_info["depth"].append(max_depth)
-        favorites_info["error_type"].append("Mean Absolute Error")
-        favorites_info["error_value"] \
-            .append(mean_absolute_error(anime_2019["score"],
-                                        favorite_predictions))
+    Notes
+    -----
+    Visualization Type: Line Plot
+    File Path: plots/rq4_optimal_depth.png
+    """
 
-        score_info["depth"].append(max_depth)
-        score_info["error_type"].append("Mean Squared Error")
-        score_info["error_value"] \
-            .append(mean_squared_error(anime_2019["score"],
-                                       score_predictions))
+    plt, sns = plot_executor.setup()
+    errors = depth_errors(anime_data, anime_2019)
+    score_info = errors[errors["target"] == "score"]
+    favorites_info = errors[errors["target"] == "favorites"]
 
     fig, axs = plt.subplots(2)
     fig.set_size_inches(15, 20)
@@ -155,133 +562,411 @@ def plot_optimal_depth(anime_data, anime_2019):
     axs[1].set_xlabel("Tree Depth")
     axs[1].set_ylabel("Error Amount")
 
-    fig.savefig("plots/rq4_optimal_depth.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq4_optimal_depth.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
-def plot_optimal_features(anime_data, anime_2019):
-    """Plots change of score/favorite model errors of certain features removed
+def feature_groups(columns):
+    """Returns the columns that make up each original feature
+
+    Parameters
+    ----------
+    columns : List
+        The names of the feature columns (see FeatureEncoder.feature_names)
+
+    Returns
+    -------
+    Dictionary
+        Returns feature name (type, episodes, duration_min, source, genre,
+        studio) to the positions of its columns. The one-hot type/source and
+        multi-hot genre/studio columns are grouped under their feature
+    """
+
+    groups = {}
+    for position, column in enumerate(columns):
+        group = column if column in ("episodes", "duration_min") \
+            else column.split("_")[0]
+        groups.setdefault(group, []).append(position)
+    return groups
+
+
+def _shuffled_predictions(model, features, columns, permutations):
+    """Returns the predictions (permutations by rows) of a fitted model with
+    the given columns shuffled by every permutation
+    """
+
+    from sklearn.tree import DecisionTreeRegressor
+
+    if type(model) is DecisionTreeRegressor:
+        # Walks every shuffled copy down the tree at once. A row reads the
+        # shuffled columns from the row its permutation points to, so no copy
+        # of the features is ever made
+        tree = model.tree_
+        shuffled = np.zeros(features.shape[1], dtype=bool)
+        shuffled[columns] = True
+        rows = np.tile(np.arange(features.shape[0]), len(permutations))
+        sources = permutations.ravel()
+        nodes = np.zeros(len(rows), dtype="intp")
+        while True:
+            left = tree.children_left[nodes]
+            if (left == -1).all():
+                break
+            feature = tree.feature[nodes]
+            values = _lookup(features,
+                             np.where(shuffled[feature], sources, rows),
+                             feature)
+            nodes = np.where(left == -1, nodes,
+                             np.where(values <= tree.threshold[nodes], left,
+                                      tree.children_right[nodes]))
+        return tree.value[nodes, 0, 0].reshape(len(permutations), -1)
+
+    shuffled = np.zeros(features.shape[1], dtype="float32")
+    shuffled[columns] = 1
+    predictions = []
+    for permutation in permutations:
+        if sparse.issparse(features):
+            copy = features.multiply(1 - shuffled) + \
+                features[permutation].multiply(shuffled)
+            copy = sparse.csr_matrix(copy)
+        else:
+            copy = features.copy()
+            copy[:, columns] = features[permutation][:, columns]
+        predictions.append(model.predict(copy))
+    return np.array(predictions)
+
+
+@tracing.traced("compute")
+def permutation_importance(model, features, feature_names, target,
+                           repeats=30, seed=0,
+                           error_types=("Mean Absolute Error",
+                                        "Mean Squared Error")):
+    """Returns how much a model's errors grow when each feature is shuffled
+
+    Parameters
+    ----------
+    model : Estimator
+        A fitted model
+    features : csr_matrix
+        The features to predict (sparse or dense, with the columns the model
+        was fit on)
+    feature_names : List
+        The names of the feature columns
+    target : Series
+        The true values of the predictions
+    repeats : Integer
+        The amount of times every feature is shuffled
+    seed : Integer
+        Seed of the shuffles
+    error_types : List
+        "Mean Absolute Error" and/or "Mean Squared Error"
+
+    Returns
+    -------
+    DataFrame
+        Returns a long Pandas DataFrame with feature, repeat, error_type and
+        error_change (error with the feature shuffled minus the error of the
+        model) columns
+
+    Notes
+    -----
+    All columns of a feature (see feature_groups) are shuffled together so
+        a genre/studio row keeps its set of labels
+    The model is never refit. Shuffling a feature shows how much the model
+        relies on it, like removing it and retraining did
+    """
+
+    errors = {
+        "Mean Absolute Error":
+            lambda predictions: np.abs(predictions - target).mean(axis=-1),
+        "Mean Squared Error":
+            lambda predictions: ((predictions - target) ** 2).mean(axis=-1)
+    }
+    target = np.asarray(target, dtype="float64")
+    features = _as_float32(features)
+    baseline = model.predict(features)
+    random = np.random.default_rng(seed)
+
+    info = []
+    for feature, columns in feature_groups(feature_names).items():
+        permutations = np.array([random.permutation(features.shape[0])
+                                 for _ in range(repeats)])
+        predictions = _shuffled_predictions(model, features, columns,
+                                            permutations)
+        for error_type in error_types:
+            info.append(pd.DataFrame({
+                "feature": feature,
+                "repeat": np.arange(repeats),
+                "error_type": error_type,
+                "error_change": errors[error_type](predictions) -
+                errors[error_type](baseline)
+            }))
+    return pd.concat(info, ignore_index=True)
+
+
+@tracing.traced("compute")
+def summarize_importance(importance, confidence=0.95):
+    """Returns the average error change of every feature with its confidence
+    interval
+
+    Parameters
+    ----------
+    importance : DataFrame
+        The result of permutation_importance
+    confidence : Float
+        The confidence level of the intervals
+
+    Returns
+    -------
+    DataFrame
+        Returns mean, std, low and high columns for every feature and error
+        type (a Student's t interval of the mean over the repeats)
+    """
+
+    from scipy import stats
+
+    summary = importance.groupby(["feature", "error_type"])["error_change"] \
+        .agg(["mean", "std", "count"])
+    margin = stats.t.ppf((1 + confidence) / 2, summary["count"] - 1) * \
+        summary["std"] / np.sqrt(summary["count"])
+    return summary.assign(low=summary["mean"] - margin,
+                          high=summary["mean"] + margin) \
+        .drop(columns="count")
+
+
+@tracing.traced("compute")
+def feature_importance(anime_data, anime_2019, max_depth=7):
+    """Retrieves how much the score/favorite model errors grow when each
+    feature is shuffled
 
     Parameters
     ----------
     anime_data : DataFrame
         Pandas DataFrame that contains anime show data before 2019
     anime_2019 : DataFrame
-        Pandas DataFrame that contains anime show data in 2019
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
+    max_depth : Integer
+        The depth of the models
+
+    Returns
+    -------
+    DataFrame
+        Returns the permutation_importance of the score model (both error
+        types) and favorites model (mean absolute error) with a target column
 
     Notes
     -----
-    Visualization Type: Bar Plot
-    File Path: plots/rq4_optimal_features.png
+    File Path: data/cache/rq4_feature_importance-{key}.pkl (see
+        artifact_cache)
+    The favorites predictions are compared with the 2019 scores
     """
 
-    score_info = {
-        "feature_removed": [],
-        "error_type": [],
-        "error_value": []
-    }
+    def build():
+        score_model, favorites_model = train_model(anime_data, max_depth)
+        encoder = get_encoder(anime_data)
+        features = get_features(anime_2019, encoder=encoder)
+        score_info = permutation_importance(score_model, features,
+                                            encoder.feature_names,
+                                            anime_2019["score"])
+        favorites_info = permutation_importance(
+            favorites_model, features, encoder.feature_names,
+            anime_2019["score"], error_types=["Mean Absolute Error"])
+        return pd.concat([score_info.assign(target="score"),
+                          favorites_info.assign(target="favorites")],
+                         ignore_index=True)
+
+    return artifact_cache.cached(
+        "rq4_feature_importance", build, inputs=[anime_data, anime_2019],
+        params={"max_depth": max_depth})
+
+
+@tracing.traced("render")
+def plot_optimal_features(anime_data, anime_2019):
+    """Plots how much the score/favorite model errors grow when each feature
+    is shuffled
 
-    favorites_info = {
-        "feature_removed": [],
-        "error_type": [],
-        "error_value": []
-    }
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2019
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
 
-    for feature_removed in [None, "type", "episodes", "duration_min",
-                            "source", "genre", "studio"]:
-        score_model, favorites_model = \
-            train_model(anime_data, 7, feature_removed)
-
-        features = get_features(anime_2019). \
-            reindex(columns=get_features(anime_data, feature_removed).columns,
-                    fill_value=0)
-
-        score_predictions, favorite_predictions = \
-            score_model.predict(features), favorites_model.predict(features)
-
-        score_info["feature_removed"].append(str(feature_removed))
-        score_info["error_type"].append("Mean Absolute Error")
-        score_info["error_value"] \
-            .append(mean_absolute_error(anime_2019["score"],
-                                        score_predictions))
-
-        favorites_info["feature_removed"].append(str(feature_removed))
-        favorites_info["error_type"].append("Mean Absolute Error")
-        favorites_info["error_value"] \
-            .append(mean_absolute_error(anime_2019["score"],
-                                        favorite_predictions))
-
-        score_info["feature_removed"].append(str(feature_removed))
-        score_info["error_type"].append("Mean Squared Error")
-        score_info["error_value"] \
-            .append(mean_squared_error(anime_2019["score"],
-                                       score_predictions))
-
-    for col in score_info:
-        if col == "error_value":
-            og_error = score_info[col][0]
-            score_info[col] = [error - og_error for error in score_info[col]]
-        score_info[col] = score_info[col][2:]
-
-    for col in favorites_info:
-        if col == "error_value":
-            og_error = favorites_info[col][0]
-            favorites_info[col] = \
-                [error - og_error for error in favorites_info[col]]
-        favorites_info[col] = favorites_info[col][1:]
+    Notes
+    -----
+    Visualization Type: Bar Plot (with 95% confidence intervals)
+    File Path: plots/rq4_optimal_features.png
+    Uses the permutation importance of the depth 7 models instead of
+        retraining them without each feature
+    """
 
+    plt, sns = plot_executor.setup()
+    importance = feature_importance(anime_data, anime_2019)
+    score_info = importance[importance["target"] == "score"]
+    favorites_info = importance[importance["target"] == "favorites"]
+
+    order = ["type", "episodes", "duration_min", "source", "genre", "studio"]
     fig, axs = plt.subplots(2)
     fig.set_size_inches(15, 20)
 
-    axs[0].set_title("Change in Score Errors When Removing Features")
-    sns.barplot(x="feature_removed", y="error_value", hue="error_type",
-                data=score_info, ax=axs[0])
-    axs[0].set_xlabel("Feature Removed")
+    axs[0].set_title("Change in Score Errors When Shuffling Features")
+    sns.barplot(x="feature", y="error_change", hue="error_type",
+                data=score_info, order=order, ax=axs[0])
+    axs[0].set_xlabel("Feature Shuffled")
     axs[0].set_ylabel("Error Change")
-    axs[0].set_ylim(-.15, 0.15)
     axs[0].legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0)
 
     axs[1].set_title("Change in Favorite Mean Absolute Error " +
-                     "When Removing Features")
-    sns.barplot(x="feature_removed", y="error_value", palette=["Blue"],
-                data=favorites_info, ax=axs[1])
-    axs[1].set_xlabel("Feature Removed")
+                     "When Shuffling Features")
+    sns.barplot(x="feature", y="error_change", color="Blue",
+                data=favorites_info, order=order, ax=axs[1])
+    axs[1].set_xlabel("Feature Shuffled")
     axs[1].set_ylabel("Error Change")
 
-    fig.savefig("plots/rq4_optimal_features.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq4_optimal_features.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
-def plot_tree(model, features, labels):
+@tracing.traced("render")
+def plot_tree(model, feature_names, min_samples=0.01):
     """Plots the decision tree of a given machine learning model
 
     Parameters
     ----------
     model : SciKit Learn Decision Tree
         Machine Learning model that contains the tree schematic
-    features : DataFrame
-        The features for the learning model
-    labels : DataFrame
-        The label(s) for the learning model
+    feature_names : List
+        The names of the features of the learning model
+    min_samples : Integer or Float
+        Subtrees with less anime than this (a float is a fraction of all
+        anime) are drawn as one box (see tree_rendering)
+
+    Notes
+    -----
+    Visualization Type: Decision Tree Plot
+    File Path: plots/rq4_decision_tree.png, lists/rq4_decision_tree.txt
+    The text version has every node (nothing collapsed) so two trees can be
+        compared with a diff
+    """
+
+    # Styled like the other plots
+    plot_executor.setup()
+    tree_rendering.plot_tree(model, feature_names,
+                             "plots/rq4_decision_tree.png", min_samples,
+                             "Score Decision Tree (share of anime | score)")
+    with open("lists/rq4_decision_tree.txt", "w") as file:
+        file.write(tree_rendering.export_text(model, feature_names))
+
+
+@tracing.traced("render")
+def plot_model_tree(anime_data):
+    """Plots the decision tree of the depth 7 score model
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2019
 
     Notes
     -----
     Visualization Type: Decision Tree Plot
-    File Path: plots/rq4_decision_tree.png
+    File Path: plots/rq4_decision_tree.png, lists/rq4_decision_tree.txt
     """
 
-    test = export_graphviz(model, feature_names=features.columns,
-                           class_names=labels.unique(), leaves_parallel=True,
-                           impurity=False, proportion=True, rounded=True,
-                           filled=True, rotate=True,
-                           special_characters=True)
-    graph = graphviz.Source(test)
-    png_bytes = graph.pipe(format='png')
-    with open(f"plots/rq4_decision_tree.png", "wb") as f:
-        f.write(png_bytes)
+    plot_tree(train_model(anime_data, 7)[0],
+              get_encoder(anime_data).feature_names)
+
 
+@tracing.traced("save")
+def export_models(anime_data, directory=scoring.MODEL_DIR, max_depth=7):
+    """Saves the score and favorites trees for scoring new anime without
+    retraining (see scoring.py)
 
-def main(anime_data, anime_2019):
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2019
+    directory : String
+        The folder to save the models in
+    max_depth : Integer
+        The depth of the trees
+
+    Notes
+    -----
+    File Path: models/rq4/{target}_{array}.npy, encoder.json, manifest.json
+    Every tree is saved as flat NumPy arrays of its nodes (children,
+        features, thresholds, values). The manifest has the format version,
+        the feature names and where the models came from, and is written
+        last so a half finished export is never loaded
+    """
+
+    import sklearn
+
+    encoder = get_encoder(anime_data)
+    models = dict(zip(TARGETS, train_model(anime_data, max_depth)))
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    encoder.save(os.path.join(directory, "encoder.json"))
+    for target, model in models.items():
+        tree = model.tree_
+        arrays = {
+            "children_left": tree.children_left,
+            "children_right": tree.children_right,
+            "feature": tree.feature,
+            "threshold": tree.threshold,
+            "value": tree.value[:, 0, 0],
+            "missing_go_to_left": getattr(
+                tree, "missing_go_to_left",
+                np.zeros(tree.node_count, dtype="uint8"))
+        }
+        for name in scoring.TREE_ARRAYS:
+            np.save(os.path.join(directory, f"{target}_{name}.npy"),
+                    np.ascontiguousarray(arrays[name]))
+
+    with open(manifest_path, "w") as file:
+        json.dump({
+            "version": scoring.FORMAT_VERSION,
+            "targets": list(models),
+            "feature_names": encoder.feature_names,
+            "max_depth": max_depth,
+            "data": artifact_cache.frame_hash(anime_data),
+            "sklearn": sklearn.__version__
+        }, file, indent=4)
+
+
+def get_tasks(anime_data, anime_2019):
+    """Returns the figures for research question four as tasks
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2018
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
+
+    Returns
+    -------
+    List
+        Returns (function, args, kwargs) tuples that each save one figure
+        or list (see plot_executor)
+    """
+
+    return [
+        (plot_optimal_features, (anime_data, anime_2019), {}),
+        (plot_optimal_depth, (anime_data, anime_2019), {}),
+        (plot_model_tree, (anime_data,), {}),
+        (save_engine_report, (anime_data, anime_2019), {})
+    ]
+
+
+def main(anime_data, anime_2019, workers=1):
     """
     Runs all the data analysis and visualization for research question four
 
@@ -289,11 +974,11 @@ def main(anime_data, anime_2019):
     ----------
     anime_data : DataFrame
         Pandas DataFrame that contains anime show data before 2018
-    data_2019 : DataFrame
-        Pandas DataFrame that contains anime show data in 2019
+    anime_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or any other
+        retrieved year)
+    workers : Integer
+        The amount of processes that render the figures
     """
 
-    plot_optimal_features(anime_data, anime_2019)
-    plot_optimal_depth(anime_data, anime_2019)
-    plot_tree(train_model(anime_data, 7)[0],
-              get_features(anime_data), anime_data["score"])
+    plot_executor.run_tasks(get_tasks(anime_data, anime_2019), workers)
@@ -8,14 +8,19 @@ My Anime List to answer my first research question for my final project.
 """
 
 import json
-import pickle
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.lines as mlines
-sns.set()
+import label_index
+import data_loading
+import artifact_cache
+import plot_executor
+import tracing
+from multiprocessing import Pool
 
+_lookups = {}
 
+
+@tracing.traced("compute")
 def average_user(data):
     """Retrieves the averages of the given user data
 
@@ -30,10 +35,13 @@ def average_user(data):
         Returns the averages of the user data in a dictionary
     """
 
+    if pd.api.types.is_datetime64_any_dtype(data["birth_date"]):
+        birth_years = data["birth_date"].dt.year
+    else:
+        birth_years = pd.to_numeric(data["birth_date"]
+                                    .str.split("-", expand=True, n=1)[0])
     averages = {
-        "age":
-            2020 - pd.to_numeric(data["birth_date"]
-                                 .str.split("-", expand=True, n=1)[0]).mean(),
+        "age": 2020 - birth_years.mean(),
         "score": data["stats_mean_score"].mean(),
         "days_watched": data["user_days_spent_watching"].mean(),
         "episodes": data["stats_episodes"].mean(),
@@ -46,6 +54,7 @@ def average_user(data):
     return averages
 
 
+@tracing.traced("compute")
 def average_by_gender(data):
     """Retrieves the averages of a Male and Female MAL user
 
@@ -67,6 +76,7 @@ def average_by_gender(data):
     return averages
 
 
+@tracing.traced("render")
 def plot_averages(avg, g_avg, name="averages"):
     """Plots different gendered averages and overall average for the data
 
@@ -85,6 +95,7 @@ def plot_averages(avg, g_avg, name="averages"):
     File Path: plots/rq1_{name}.png
     """
 
+    plt, sns = plot_executor.setup()
     g_avg = pd.DataFrame.from_dict(g_avg).reset_index()
     g_avg = g_avg.rename(columns={"index": "category"})
     labels = [("Average Age", "Years"), ("Average Score", "Score Out of 10"),
@@ -105,12 +116,34 @@ def plot_averages(avg, g_avg, name="averages"):
         ax.set_title(labels[idx][0])
         ax.set_ylabel(labels[idx][1])
         ax.axhline(avg[row["category"]], color="g")
-        ax.legend(handles=[mlines.Line2D([], [], color="g",
+        ax.legend(handles=[plt.Line2D([], [], color="g",
                            label="Overall Average")])
-    fig.savefig(f"plots/rq1_{name}.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, f"plots/rq1_{name}.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def time_spent_by_age(data):
+    """Retrieves the age and days spent watching anime of every user
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime user data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with gender, age and
+        user_days_spent_watching columns of the Male and Female users
+    """
+
+    return data.loc[data["gender"].isin(["Female", "Male"]),
+                    ["gender", "age", "user_days_spent_watching"]]
+
+
+@tracing.traced("render")
 def plot_time_spent(data, name="time_spent"):
     """Plots the time spent watching anime
 
@@ -127,9 +160,12 @@ def plot_time_spent(data, name="time_spent"):
     File Path: plots/rq1_{name}.png
     """
 
+    plt, sns = plot_executor.setup()
+    data = time_spent_by_age(data)
     plot_info = {
         "genders": [["Female", "Male"], ["Female"], ["Male"]],
-        "colors": [["blue", "red"], ["red"], ["blue"]]
+        "colors": [{"Female": "red", "Male": "blue"}, {"Female": "red"},
+                   {"Male": "blue"}]
     }
 
     fig, axs = plt.subplots(3)
@@ -139,15 +175,18 @@ def plot_time_spent(data, name="time_spent"):
     for idx, ax in enumerate(axs):
         sns.scatterplot(x="age", y="user_days_spent_watching", alpha=0.3,
                         hue="gender", ax=ax,
+                        hue_order=plot_info["genders"][idx],
                         palette=plot_info["colors"][idx],
                         data=data[data["gender"]
                                   .isin(plot_info["genders"][idx])])
         ax.set_xlabel("Age")
         ax.set_ylabel("Days Spent Watching")
-    fig.savefig(f"plots/rq1_{name}.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, f"plots/rq1_{name}.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("save")
 def save_lists(info_list):
     """Saves information into a text file that can be read later
 
@@ -168,6 +207,176 @@ def save_lists(info_list):
             file.write(json.dumps(data, indent=4))
 
 
+def _set_lookups(lookups):
+    """Saves the anime/user lookups that _count_chunk needs (in this process)
+
+    Parameters
+    ----------
+    lookups : Dictionary
+        The lookups made by genre_gender_counts
+    """
+
+    _lookups.update(lookups)
+
+
+def _count_chunk(chunk):
+    """Counts the list entries in a chunk of user animelists by gender and
+    anime
+
+    Parameters
+    ----------
+    chunk : DataFrame
+        Pandas DataFrame with the username and anime_id of list entries
+
+    Returns
+    -------
+    Array
+        Returns the flattened (gender by anime) counts. Entries of unknown
+        users or anime aren't counted
+    """
+
+    anime_rows = _lookups["anime_index"].get_indexer(chunk["anime_id"])
+    usernames = chunk["username"]
+    if isinstance(usernames.dtype, pd.CategoricalDtype):
+        # Only the distinct usernames of the chunk need to be looked up
+        user_rows = _lookups["user_index"] \
+            .get_indexer(usernames.cat.categories)[usernames.cat.codes]
+        user_rows[usernames.cat.codes < 0] = -1
+    else:
+        user_rows = _lookups["user_index"].get_indexer(usernames)
+    genders = np.where(user_rows >= 0, _lookups["user_genders"][user_rows],
+                       -1)
+    found = (anime_rows >= 0) & (genders >= 0)
+    return np.bincount(genders[found] * _lookups["n_anime"] +
+                       anime_rows[found],
+                       minlength=_lookups["n_genders"] * _lookups["n_anime"])
+
+
+@tracing.traced("compute")
+def genre_gender_counts(anime_data, user_data, chunksize=1000000, workers=1):
+    """Counts how many user animelist entries of each gender have each genre
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime data
+    user_data : DataFrame
+        Pandas DataFrame that contains MAL user data
+    chunksize : Integer
+        The amount of user animelist entries that are counted at a time
+    workers : Integer
+        The amount of processes that count chunks
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with gender, genre and count columns
+
+    Notes
+    -----
+    The user animelists are streamed, so they are never fully in memory.
+        Every chunk is reduced to counts per (gender, anime) with bincount,
+        and the genres are only applied once at the end through the sparse
+        genre index
+    """
+
+    genres = label_index.get(anime_data, "genre")
+    gender_codes, gender_names = pd.factorize(user_data["gender"], sort=True)
+    lookups = {
+        "anime_index": pd.Index(anime_data["anime_id"]),
+        "user_index": pd.Index(user_data["username"]),
+        "user_genders": gender_codes,
+        "n_anime": len(anime_data),
+        "n_genders": len(gender_names)
+    }
+    chunks = data_loading.iter_chunks("user_animelists",
+                                      ["username", "anime_id"], chunksize)
+    per_anime = np.zeros(lookups["n_genders"] * lookups["n_anime"], "int64")
+    if workers > 1:
+        with Pool(workers, initializer=_set_lookups,
+                  initargs=(lookups,)) as pool:
+            for counts in pool.imap_unordered(_count_chunk, chunks):
+                per_anime += counts
+    else:
+        _set_lookups(lookups)
+        for chunk in chunks:
+            per_anime += _count_chunk(chunk)
+
+    counts = per_anime.reshape(lookups["n_genders"], lookups["n_anime"]) \
+        @ genres.matrix
+    genders, labels = np.nonzero(counts)
+    return pd.DataFrame({
+        "gender": np.asarray(gender_names)[genders],
+        "genre": genres.vocabulary[labels],
+        "count": counts[genders, labels].astype("int64")
+    })
+
+
+@tracing.traced("compute")
+def load_genre_gender(anime_data, user_data, **kwargs):
+    """Loads the genre by gender counts, rebuilding them if the cleaned data
+    or the code has changed
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime data
+    user_data : DataFrame
+        Pandas DataFrame that contains MAL user data
+    **kwargs
+        Options passed on to genre_gender_counts when rebuilding
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with gender, genre and count columns
+
+    Notes
+    -----
+    File Path: data/cache/genre_gender-{key}.pkl (see artifact_cache)
+    """
+
+    return artifact_cache.cached(
+        "genre_gender",
+        lambda: genre_gender_counts(anime_data, user_data, **kwargs),
+        inputs=[data_loading.source_path("user_animelists"),
+                anime_data[["anime_id", "genre"]],
+                user_data[["username", "gender"]]])
+
+
+@tracing.traced("compute")
+def genre_gender_ratios(anime_data, user_data):
+    """Retrieves the share of each gender's list entries that have each genre
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime data
+    user_data : DataFrame
+        Pandas DataFrame that contains MAL user data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre, gender and ratio columns from
+        the highest to the lowest ratio
+
+    Notes
+    -----
+    The ratio is the genre's count over the count of every genre of that
+        gender (see load_genre_gender)
+    """
+
+    data = load_genre_gender(anime_data, user_data)
+    ratios = data.assign(
+        ratio=data["count"] / data.groupby("gender")["count"]
+        .transform("sum"))
+    return ratios[["genre", "gender", "ratio"]] \
+        .sort_values("ratio", ascending=False, kind="stable") \
+        .reset_index(drop=True)
+
+
+@tracing.traced("render")
 def plot_gender_genres(anime_data, user_data):
     """Plots the how genres vary by genders
 
@@ -182,28 +391,14 @@ def plot_gender_genres(anime_data, user_data):
     -----
     Visualization Type: Bar Plots
     File Path: plots/rq1_gender_genres.png and plots/rq1_gender_genres2.png
+    The genre by gender counts are rebuilt automatically (see
+        load_genre_gender) when the cleaned data changes
     """
 
-    # Uncomment code below if the genre_by_gender.pkl doesn't exist
-    # user_lists = pd.read_csv("data/user_animelists_cleaned.csv")
-    # lists = user_lists[["anime_id", "username"]].copy()
-    # users = user_data[["username", "gender"]].copy()
-    # anime = anime_data[["anime_id", "genre", "studio"]].copy()
-    # data = pd.merge(lists, users)
-    # data = pd.merge(data, anime, how="left")
-    # data = data.dropna()
-    # data["genre"] = data["genre"].str.split(", ")
-    # data = data.explode("genre").groupby(["gender", "genre"]) \
-    #     .agg("count").reset_index()[["gender", "genre", "anime_id"]] \
-    #     .rename(columns={"anime_id": "count"})
-    # with open("data/genre_gender.pkl", "wb") as f:
-    #     pickle.dump(data, f)
-
-    # Uncomment code below if the genre_by_gender.pkl does exist
-    with open("data/genre_by_gender.pkl", "rb") as f:
-        data = pickle.load(f).sort_values("count", ascending=False)
-
-    # Keep This Code!
+    plt, sns = plot_executor.setup()
+    data = load_genre_gender(anime_data, user_data) \
+        .sort_values("count", ascending=False)
+
     fig, ax = plt.subplots()
     fig.set_size_inches(25, 10)
     sns.barplot(x="genre", y="count", hue="gender", palette=["Blue", "Red"],
@@ -212,31 +407,11 @@ def plot_gender_genres(anime_data, user_data):
     ax.set_xlabel("Genre")
     ax.set_ylabel("Users")
     plt.xticks(rotation=45, ha="right")
-    fig.savefig("plots/rq1_gender_genres.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq1_gender_genres.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
-    ratios = {
-        "genre": [],
-        "gender": [],
-        "ratio": []
-    }
-    total_female, total_male = data.groupby("gender").sum()["count"].values
-    for genre in data["genre"]:
-        male_ratio = data[((data["genre"] == genre) &
-                          (data["gender"] == "Male"))]["count"] \
-            .squeeze() / total_male
-        female_ratio = data[((data["genre"] == genre) &
-                            (data["gender"] == "Female"))]["count"] \
-            .squeeze() / total_female
-        ratios["genre"].append(genre)
-        ratios["gender"].append("Male")
-        ratios["ratio"].append(male_ratio)
-        ratios["genre"].append(genre)
-        ratios["gender"].append("Female")
-        ratios["ratio"].append(female_ratio)
-
-    ratios = pd.DataFrame.from_dict(ratios) \
-        .sort_values("ratio", ascending=False)
+    ratios = genre_gender_ratios(anime_data, user_data)
     fig, ax = plt.subplots()
     fig.set_size_inches(25, 10)
     sns.barplot(x="genre", y="ratio", hue="gender", palette=["Blue", "Red"],
@@ -245,23 +420,51 @@ def plot_gender_genres(anime_data, user_data):
     ax.set_xlabel("Genre")
     ax.set_ylabel("Ratio of Gender Who Watch")
     plt.xticks(rotation=45, ha="right")
-    fig.savefig("plots/rq1_gender_genres2.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq1_gender_genres2.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
-def main(anime_data, user_data):
-    """
-    Runs all the data analysis and visualization for research question one
+def get_tasks(anime_data, user_data):
+    """Returns the figures/lists for research question one as tasks
 
     Parameters
     ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime data
     user_data : DataFrame
         Pandas DataFrame that contains information about a MAL user
+
+    Returns
+    -------
+    List
+        Returns (function, args, kwargs) tuples that each save one figure or
+        set of lists (see plot_executor)
     """
 
     averages = average_user(user_data)
     gender_averages = average_by_gender(user_data)
-    plot_averages(averages, gender_averages)
-    plot_time_spent(user_data)
-    save_lists([("overall_avg", averages), ("gendered_avg", gender_averages)])
-    plot_gender_genres(anime_data, user_data)
+    return [
+        (plot_averages, (averages, gender_averages), {}),
+        (plot_time_spent, (user_data,), {}),
+        (save_lists, ([("overall_avg", averages),
+                       ("gendered_avg", gender_averages)],), {}),
+        (plot_gender_genres, (anime_data, user_data), {})
+    ]
+
+
+def main(anime_data, user_data, workers=1):
+    """
+    Runs all the data analysis and visualization for research question one
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime data
+    user_data : DataFrame
+        Pandas DataFrame that contains information about a MAL user
+    workers : Integer
+        The amount of processes that render the figures
+    """
+
+    plot_executor.run_tasks(get_tasks(anime_data, user_data), workers)
@@ -8,9 +8,9 @@ My Anime List to answer my third research question for my final project.
 """
 
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-sns.set()
+import anime_cube
+import plot_executor
+import tracing
 
 distinct_colors = \
     ['#e6194b', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#911eb4',
@@ -19,6 +19,38 @@ distinct_colors = \
      '#000075', '#808080', '#ffffff']
 
 
+@tracing.traced("compute")
+def studio_scores_yearly(data, top_n=20):
+    """Retrieves the average score per year of the top_n studios
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n: Integer
+        The amount of top studios to average
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with studio, aired_from_year and score
+        columns from the highest to the lowest score
+
+    Notes
+    -----
+    Top_n is determined by the average of the yearly scores of the studio
+    """
+
+    info = anime_cube.get(data).means(["studio", "aired_from_year"]) \
+        .reset_index().sort_values("score", ascending=False) \
+        .reset_index(drop=True)
+    top_studios = info.groupby("studio").mean() \
+        .sort_values("score", ascending=False).iloc[:top_n]["score"]
+    return info[info["studio"].isin(top_studios.index)] \
+        .reset_index(drop=True)
+
+
+@tracing.traced("render")
 def plot_yearly_studio_score(data, top_n=20):
     """Plots the average score per year for the top_n studios
 
@@ -38,14 +70,8 @@ def plot_yearly_studio_score(data, top_n=20):
     Top_n is determined by the average scores of anime made with the studio
     """
 
-    info = data[["studio", "score", "aired_from_year"]].copy()
-    info["studio"] = info["studio"].str.split(", ")
-    info = info.explode("studio").groupby(["studio", "aired_from_year"]) \
-        .mean().sort_values("score", ascending=False).reset_index()
-    top_studios = info.groupby("studio").mean() \
-        .sort_values("score", ascending=False).iloc[:top_n]["score"]
-    info = info[info["studio"].isin(top_studios.index)]
-
+    plt, sns = plot_executor.setup()
+    info = studio_scores_yearly(data, top_n)
     palette = distinct_colors[:top_n] if top_n < len(distinct_colors) else None
 
     fig, ax = plt.subplots()
@@ -57,11 +83,32 @@ def plot_yearly_studio_score(data, top_n=20):
     ax.set_ylabel("Score out of Ten")
     ax.set_ylim(0, 10)
     ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0)
-    fig.savefig(f"plots/rq3_{top_n}studios_yearly_score.png",
-                bbox_inches="tight")
+    plot_executor.save_figure(
+        fig, f"plots/rq3_{top_n}studios_yearly_score.png", bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def studio_averages(data):
+    """Retrieves the average score of every anime studio
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with studio and score columns from the
+        highest to the lowest average score
+    """
+
+    return anime_cube.get(data).means("studio").to_frame("score") \
+        .sort_values("score", ascending=False).reset_index()
+
+
+@tracing.traced("render")
 def plot_studio_averages(data):
     """Plots the average score for anime studios
 
@@ -76,10 +123,8 @@ def plot_studio_averages(data):
     File Path: plots/rq3_{top_n}studios_yearly_score.png
     """
 
-    info = data[["studio", "score"]].copy()
-    info["studio"] = info["studio"].str.split(", ")
-    info = info.explode("studio").groupby("studio").mean() \
-        .sort_values("score", ascending=False).reset_index()
+    plt, sns = plot_executor.setup()
+    info = studio_averages(data)
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 10)
@@ -90,7 +135,8 @@ def plot_studio_averages(data):
     ax.set_ylabel("Score out of Ten")
     ax.set_ylim(6, 9)
     plt.xticks(rotation=45, ha="right")
-    fig.savefig("plots/rq3_best_studio_scores.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq3_best_studio_scores.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
     fig, ax = plt.subplots()
@@ -102,10 +148,71 @@ def plot_studio_averages(data):
     ax.set_ylabel("Score out of Ten")
     ax.set_ylim(2, 6)
     plt.xticks(rotation=45, ha="right")
-    fig.savefig("plots/rq3_worst_studio_scores.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq3_worst_studio_scores.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def top_genres(data, top_n=5):
+    """Returns the top_n genres with the highest average scores
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n: Integer
+        The amount of genres to return. Returns every genre if None
+
+    Returns
+    -------
+    Index
+        Returns the genres from highest to lowest average score
+
+    Notes
+    -----
+    Every genre and studio pairing of an anime counts once, so anime made by
+        more studios weigh more in the genre averages
+    """
+
+    genres = anime_cube.get(data).means("genre", expand=["studio"]) \
+        .to_frame("score").sort_values("score", ascending=False)
+    return genres.iloc[:(top_n if top_n else len(genres))].index
+
+
+@tracing.traced("compute")
+def genre_studio_scores(data, top_n=5, genres=None):
+    """Retrieves the average score of every studio in the top_n genres
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n: Integer
+        The amount of top genres (see top_genres)
+    genres: List
+        List of genres that can override top_n
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre, studio and score columns. The
+        genres are in the given (or top_genres) order and the studios of
+        every genre go from the highest to the lowest score
+    """
+
+    genres = genres if genres else top_genres(data, top_n)
+    scores = anime_cube.get(data).means(["genre", "studio"],
+                                        where={"genre": genres})
+    info = [scores.loc[[genre]].reset_index()
+            .sort_values("score", ascending=False)
+            for genre in genres if genre in scores.index]
+    if not info:
+        return pd.DataFrame(columns=["genre", "studio", "score"])
+    return pd.concat(info, ignore_index=True)
+
+
+@tracing.traced("render")
 def plot_genre_average(data, top_n=5, genres=None):
     """Plots the top and bottom 25 studio scores for the top_n genres
 
@@ -127,25 +234,12 @@ def plot_genre_average(data, top_n=5, genres=None):
     Top_n is determined by the average scores of genre
     """
 
-    info = data[["genre", "studio", "score"]].copy()
-    info["studio"] = info["studio"].str.split(", ")
-    info = info.explode("studio")
-    info["genre"] = info["genre"].str.split(", ")
-    info = info.explode("genre")
-    if genres:
-        top_genres = genres
-    else:
-        top_genres = \
-            info.groupby("genre").mean() \
-            .sort_values("score", ascending=False)
-        top_genres = \
-            top_genres.iloc[:(top_n if top_n else len(top_genres))].index
-
-    for genre in top_genres:
-        genre_info = info[info["genre"] == genre]
-        genre_info = genre_info.groupby("studio").mean()
-        genre_info = genre_info.sort_values("score", ascending=False) \
-            .reset_index()
+    plt, sns = plot_executor.setup()
+    genres = genres if genres else top_genres(data, top_n)
+    info = genre_studio_scores(data, genres=genres)
+
+    for genre in genres:
+        genre_info = info[info["genre"] == genre].reset_index(drop=True)
         fig, axs = plt.subplots(2)
         fig.set_size_inches(16, 20)
 
@@ -166,14 +260,36 @@ def plot_genre_average(data, top_n=5, genres=None):
         plt.tight_layout()
 
         if top_n:
-            fig.savefig(f"plots/rq3_genre_{genre.lower()}_scores.png",
-                        bbox_inches="tight")
+            path = f"plots/rq3_genre_{genre.lower()}_scores.png"
         else:
-            fig.savefig(f"plots/rq3_genres/rq3_{genre.lower()}_scores.png",
-                        bbox_inches="tight")
+            path = f"plots/rq3_genres/rq3_{genre.lower()}_scores.png"
+        plot_executor.save_figure(fig, path, bbox_inches="tight")
         plt.close(fig)
 
 
+@tracing.traced("compute")
+def studio_counts(data, top_n=50):
+    """Retrieves the amount of anime made by the top_n studios
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n : Integer
+        The amount of studios to count
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with studio and count columns from the
+        most to the least anime
+    """
+
+    return anime_cube.get(data).counts("studio") \
+        .sort_values(ascending=False).iloc[:top_n].reset_index(name="count")
+
+
+@tracing.traced("render")
 def plot_studio_amounts(data, name="studio_amounts"):
     """Plots the amount of anime made by each studio
 
@@ -190,21 +306,62 @@ def plot_studio_amounts(data, name="studio_amounts"):
     File Path: plots/rq3_{name}.png
     """
 
-    studios = data["studio"].str.split(", ", expand=True).stack() \
-        .str.get_dummies().sum().sort_values(ascending=False).iloc[0:50]
+    plt, sns = plot_executor.setup()
+    studios = studio_counts(data)
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 10)
     fig.suptitle("Amount of Animes made by Studios")
 
-    sns.barplot(x=studios.index, y=studios.values, ax=ax)
+    sns.barplot(x="studio", y="count", data=studios, ax=ax)
     ax.set_xlabel("Studios")
     ax.set_ylabel("Amount of Anime")
     plt.xticks(rotation=45, ha="right")
-    fig.savefig(f"plots/rq3_{name}.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, f"plots/rq3_{name}.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def studio_counts_yearly(data, top_n=10):
+    """Retrieves the yearly count of the top_n studios
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n : Integer
+        Determines how many studios are counted
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with aired_from_year, studio and count
+        columns (a row per year and studio)
+
+    Notes
+    -----
+    Top_n is determined by the overall amount of anime made with the studio
+    Anime from 2018 on are left out since the data was scraped during 2018
+    """
+
+    cube = anime_cube.get(data)
+    # The filter below prevents 2018 b/c the data was scraped during that
+    # year, therefore incomplete
+    yearly = cube.counts(["aired_from_year", "studio"], where={
+        "aired_from_year": lambda years: years < 2018
+    }).unstack(fill_value=0).reset_index()
+
+    top_studios = cube.counts("studio").sort_values(ascending=False) \
+        .iloc[:top_n]
+    yearly = \
+        yearly.loc[:, yearly.columns.isin(list(top_studios.index)
+                                          + ["aired_from_year"])]
+    return pd.melt(yearly, ["aired_from_year"], var_name="studio",
+                   value_name="count")
+
+
+@tracing.traced("render")
 def plot_studio_count_yearly(data, top_n=10):
     """Plots the yearly count of the top_n studios
 
@@ -224,40 +381,59 @@ def plot_studio_count_yearly(data, top_n=10):
     Top_n is determined by the overall amount of anime made with the studio
     """
 
-    yearly = data[["studio", "aired_from_year"]]
-    # The line below prevents 2018 b/c the data was scraped during that year,
-    # therefore incomplete
-    yearly = data[data["aired_from_year"] < 2018]
-    yearly = pd.concat([yearly["aired_from_year"],
-                        pd.get_dummies(yearly["studio"]
-                        .str.split(", ", expand=True),
-                        prefix="", prefix_sep="")], axis=1)
-    yearly = yearly.groupby("aired_from_year").sum() \
-        .groupby(level=0, axis=1).sum().reset_index()
-
-    top_studios = data["studio"].str.split(", ", expand=True).stack() \
-        .str.get_dummies().sum().sort_values(ascending=False) \
-        .iloc[:top_n]
-    yearly = \
-        yearly.loc[:, yearly.columns.isin(list(top_studios.index)
-                                          + ["aired_from_year"])]
-
+    plt, sns = plot_executor.setup()
+    yearly = studio_counts_yearly(data, top_n)
     palette = distinct_colors[:top_n] if top_n < len(distinct_colors) else None
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 8)
-    sns.lineplot(x="aired_from_year", y="value", hue="Studio",
-                 data=pd.melt(yearly, ["aired_from_year"])
-                 .rename(columns={"variable": "Studio"}),
+    sns.lineplot(x="aired_from_year", y="count", hue="Studio",
+                 data=yearly.rename(columns={"studio": "Studio"}),
                  palette=palette, ax=ax)
     fig.suptitle(f"Top {top_n} Studios by Year (Anime Counts)")
     ax.set_xlabel("Year")
     ax.set_ylabel("Amount of Anime")
     ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0)
-    fig.savefig("plots/rq3_studios_yearly.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq3_studios_yearly.png",
+                              bbox_inches="tight")
+
+
+def get_tasks(anime_data):
+    """Returns the figures for research question three as tasks
 
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2018
+
+    Returns
+    -------
+    List
+        Returns (function, args, kwargs) tuples that each save one figure
+        (see plot_executor)
+
+    Notes
+    -----
+    Every genre of plot_genre_average is its own task since each is a
+        separate figure
+    """
 
-def main(anime_data):
+    genres = list(dict.fromkeys(list(top_genres(anime_data, 5)) +
+                                ["Comedy", "Romance", "Action"]))
+    return [
+        (plot_yearly_studio_score, (anime_data,), {}),
+        (plot_yearly_studio_score, (anime_data, 50), {}),
+        (plot_studio_averages, (anime_data,), {})
+    ] + [
+        (plot_genre_average, (anime_data,), {"genres": [genre]})
+        for genre in genres
+    ] + [
+        (plot_studio_amounts, (anime_data,), {}),
+        (plot_studio_count_yearly, (anime_data,), {})
+    ]
+
+
+def main(anime_data, workers=1):
     """
     Runs all the data analysis and visualization for research question three
 
@@ -265,12 +441,8 @@ def main(anime_data):
     ----------
     anime_data : DataFrame
         Pandas DataFrame that contains anime show data before 2018
+    workers : Integer
+        The amount of processes that render the figures
     """
 
-    plot_yearly_studio_score(anime_data)
-    plot_yearly_studio_score(anime_data, 50)
-    plot_studio_averages(anime_data)
-    plot_genre_average(anime_data)
-    plot_genre_average(anime_data, genres=["Comedy", "Romance", "Action"])
-    plot_studio_amounts(anime_data)
-    plot_studio_count_yearly(anime_data)
+    plot_executor.run_tasks(get_tasks(anime_data), workers)
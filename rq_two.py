@@ -8,9 +8,9 @@ My Anime List to answer my second research question for my final project.
 """
 
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-sns.set()
+import anime_cube
+import plot_executor
+import tracing
 
 distinct_colors = \
     ['#e6194b', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#911eb4',
@@ -19,6 +19,46 @@ distinct_colors = \
      '#000075', '#808080', '#ffffff']
 
 
+@tracing.traced("compute")
+def genre_counts_yearly(data, top_n=15):
+    """Retrieves the yearly count of the top_n genres
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n : Integer
+        Determines how many genres are counted
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with aired_from_year, genre and count
+        columns (a row per year and genre)
+
+    Notes
+    -----
+    Top_n is determined by the overall amount of anime made with the genre
+    Anime from 2018 on are left out since the data was scraped during 2018
+    """
+
+    cube = anime_cube.get(data)
+    # The filter below prevents 2018 b/c the data was scraped during that
+    # year, therefore incomplete
+    yearly = cube.counts(["aired_from_year", "genre"], where={
+        "aired_from_year": lambda years: years < 2018
+    }).unstack(fill_value=0).reset_index()
+
+    top_genres = cube.counts("genre").sort_values(ascending=False) \
+        .iloc[:top_n]
+    yearly = \
+        yearly.loc[:, yearly.columns.isin(list(top_genres.index)
+                                          + ["aired_from_year"])]
+    return pd.melt(yearly, ["aired_from_year"], var_name="genre",
+                   value_name="count")
+
+
+@tracing.traced("render")
 def plot_genre_count_yearly(data, top_n=15):
     """Plots the yearly count of the top_n genres
 
@@ -38,39 +78,55 @@ def plot_genre_count_yearly(data, top_n=15):
     Top_n is determined by the overall amount of anime made with the genre
     """
 
-    yearly = data[["genre", "aired_from_year"]]
-    # The line below prevents 2018 b/c the data was scraped during that year,
-    # therefore incomplete
-    yearly = data[data["aired_from_year"] < 2018]
-    yearly = pd.concat([yearly["aired_from_year"],
-                        pd.get_dummies(yearly["genre"]
-                        .str.split(", ", expand=True),
-                        prefix="", prefix_sep="")], axis=1)
-    yearly = yearly.groupby("aired_from_year").sum() \
-        .groupby(level=0, axis=1).sum().reset_index()
-
-    top_genres = data["genre"].str.split(", ", expand=True).stack() \
-        .str.get_dummies().sum().sort_values(ascending=False) \
-        .iloc[:top_n]
-    yearly = \
-        yearly.loc[:, yearly.columns.isin(list(top_genres.index)
-                                          + ["aired_from_year"])]
-
+    plt, sns = plot_executor.setup()
+    yearly = genre_counts_yearly(data, top_n)
     palette = distinct_colors[:top_n] if top_n < len(distinct_colors) else None
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 8)
-    sns.lineplot(x="aired_from_year", y="value", hue="Genre",
-                 data=pd.melt(yearly, ["aired_from_year"])
-                 .rename(columns={"variable": "Genre"}),
+    sns.lineplot(x="aired_from_year", y="count", hue="Genre",
+                 data=yearly.rename(columns={"genre": "Genre"}),
                  palette=palette, ax=ax)
     fig.suptitle(f"Top {top_n} Genres by Year")
     ax.set_xlabel("Year")
     ax.set_ylabel("Amount of Anime")
     ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0)
-    fig.savefig("plots/rq2_genres_yearly.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq2_genres_yearly.png",
+                              bbox_inches="tight")
+
+
+@tracing.traced("compute")
+def genre_scores_yearly(data, top_n=10):
+    """Retrieves the yearly score average of the top_n genres
 
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    top_n : Integer
+        Determines how many genres are averaged
 
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre, aired_from_year and score
+        columns (a row per genre and year it has anime in)
+
+    Notes
+    -----
+    Top_n is determined by the average scores of anime made with the genre
+    """
+
+    cube = anime_cube.get(data)
+    yearly = cube.means(["genre", "aired_from_year"]).reset_index()
+
+    top_genres = cube.means("genre").to_frame("score") \
+        .sort_values("score", ascending=False).reset_index().iloc[:top_n]
+    return yearly[yearly["genre"].isin(top_genres["genre"])] \
+        .reset_index(drop=True)
+
+
+@tracing.traced("render")
 def plot_genre_score_yearly(data, top_n=10):
     """Plots the yearly score average of the top_n genres
 
@@ -90,32 +146,44 @@ def plot_genre_score_yearly(data, top_n=10):
     Top_n is determined by the average scores of anime made with the genre
     """
 
-    yearly = data[["genre", "aired_from_year", "score"]].copy()
-    yearly["genre"] = yearly["genre"].str.split(", ")
-    yearly = yearly.explode("genre").groupby(["genre", "aired_from_year"]) \
-        .mean().reset_index()
-
-    top_genres = data[["genre", "score"]].copy()
-    top_genres["genre"] = top_genres["genre"].str.split(", ")
-    top_genres = top_genres.explode("genre").groupby("genre") \
-        .mean().sort_values("score", ascending=False) \
-        .reset_index().iloc[:top_n]
-
+    plt, sns = plot_executor.setup()
+    yearly = genre_scores_yearly(data, top_n)
     palette = distinct_colors[:top_n] if top_n < len(distinct_colors) else None
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 8)
-    sns.lineplot(x="aired_from_year", y="score", hue="genre",
-                 data=yearly[yearly["genre"].isin(top_genres["genre"])],
+    sns.lineplot(x="aired_from_year", y="score", hue="genre", data=yearly,
                  palette=palette, ax=ax)
     fig.suptitle(f"Top {top_n} Highly Rated Genre's Average Score by Year")
     ax.set_xlabel("Year")
     ax.set_ylabel("Score out of Ten")
     ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0)
-    fig.savefig("plots/rq2_genre_score_yearly.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq2_genre_score_yearly.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def genre_counts(data):
+    """Retrieves the amount of anime tagged with each genre
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre and count columns from the most
+        to the least anime (every genre of an anime counts)
+    """
+
+    return anime_cube.get(data).counts("genre") \
+        .sort_values(ascending=False).reset_index(name="count")
+
+
+@tracing.traced("render")
 def plot_genres_multi(data, name="multi_genre", add="before 2019"):
     """Plots the amount of each genre taking into account all tags
 
@@ -134,22 +202,44 @@ def plot_genres_multi(data, name="multi_genre", add="before 2019"):
     File Path: plots/rq2_{name}.png
     """
 
-    genres = data["genre"].str.split(", ", expand=True).stack() \
-        .str.get_dummies().sum().sort_values(ascending=False)
+    plt, sns = plot_executor.setup()
+    genres = genre_counts(data)
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 10)
     fig.suptitle("Amount of Animes tagged with a Genre "
                  f"{add} (Includes Multi-Labels)")
 
-    sns.barplot(x=genres.index, y=genres.values, ax=ax)
+    sns.barplot(x="genre", y="count", data=genres, ax=ax)
     ax.set_xlabel("Genres")
     ax.set_ylabel("Amount of Anime")
     plt.xticks(rotation=45, ha="right")
-    fig.savefig(f"plots/rq2_{name}.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, f"plots/rq2_{name}.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def main_genre_counts(data):
+    """Retrieves the amount of anime whose first (main) genre is each genre
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre and count columns from the most
+        to the least anime
+    """
+
+    return data["genre"].str.split(", ", expand=True, n=1)[0] \
+        .value_counts().rename_axis("genre").reset_index(name="count")
+
+
+@tracing.traced("render")
 def plot_genres_first(data, name="main_genre", add="before 2019"):
     """Plots the amount of each genre taking into account primary tags
 
@@ -168,20 +258,42 @@ def plot_genres_first(data, name="main_genre", add="before 2019"):
     File Path: plots/rq2_{name}.png
     """
 
-    genres = \
-        data["genre"].str.split(", ", expand=True, n=1)[0].value_counts()
+    plt, sns = plot_executor.setup()
+    genres = main_genre_counts(data)
 
     fig, ax = plt.subplots()
     fig.set_size_inches(15, 10)
-    sns.barplot(x=genres.index, y=genres.values, ax=ax)
+    sns.barplot(x="genre", y="count", data=genres, ax=ax)
     fig.suptitle(f"Amount of Animes with Main Genre {add} (First Tag)")
     ax.set_xlabel("Genres")
     ax.set_ylabel("Amount of Anime")
     plt.xticks(rotation=45, ha="right")
-    fig.savefig(f"plots/rq2_{name}.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, f"plots/rq2_{name}.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
+@tracing.traced("compute")
+def average_genre_scores(data):
+    """Retrieves the score average of every genre
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with genre and score columns from the
+        highest to the lowest average score
+    """
+
+    return anime_cube.get(data).means("genre").reset_index(name="score") \
+        .sort_values("score", ascending=False, ignore_index=True)
+
+
+@tracing.traced("render")
 def plot_average_scores(data):
     """Plots the score average of the anime genres
 
@@ -198,10 +310,8 @@ def plot_average_scores(data):
     File Path: plots/rq2_average_genre_score.png
     """
 
-    info = data[["genre", "score"]].copy()
-    info["genre"] = info["genre"].str.split(", ")
-    info = info.explode("genre").groupby("genre") \
-        .mean().reset_index().sort_values("score", ascending=False)
+    plt, sns = plot_executor.setup()
+    info = average_genre_scores(data)
 
     fig, ax = plt.subplots()
     fig.set_size_inches(16, 8)
@@ -212,11 +322,45 @@ def plot_average_scores(data):
     ax.set_ylabel("Score out of Ten")
     ax.set_ylim(6, 8)
     plt.xticks(rotation=45, ha="right")
-    fig.savefig("plots/rq2_average_genre_score.png", bbox_inches="tight")
+    plot_executor.save_figure(fig, "plots/rq2_average_genre_score.png",
+                              bbox_inches="tight")
     plt.close(fig)
 
 
-def main(anime_data, data_2019):
+def get_tasks(anime_data, data_2019, year=2019):
+    """Returns the figures for research question two as tasks
+
+    Parameters
+    ----------
+    anime_data : DataFrame
+        Pandas DataFrame that contains anime show data before 2018
+    data_2019 : DataFrame
+        Pandas DataFrame that contains anime show data in 2019 (or the year
+        given)
+    year : Integer
+        The year that data_2019 is from
+
+    Returns
+    -------
+    List
+        Returns (function, args, kwargs) tuples that each save one figure
+        (see plot_executor)
+    """
+
+    return [
+        (plot_genres_multi, (anime_data,), {}),
+        (plot_genres_first, (anime_data,), {}),
+        (plot_genres_multi, (data_2019, f"multi_genre{year}", f"in {year}"),
+         {}),
+        (plot_genres_first, (data_2019, f"main_genre{year}", f"in {year}"),
+         {}),
+        (plot_genre_count_yearly, (anime_data,), {}),
+        (plot_genre_score_yearly, (anime_data,), {}),
+        (plot_average_scores, (anime_data,), {})
+    ]
+
+
+def main(anime_data, data_2019, year=2019, workers=1):
     """
     Runs all the data analysis and visualization for research question two
 
@@ -225,13 +369,12 @@ def main(anime_data, data_2019):
     anime_data : DataFrame
         Pandas DataFrame that contains anime show data before 2018
     data_2019 : DataFrame
-        Pandas DataFrame that contains anime show data in 2019
+        Pandas DataFrame that contains anime show data in 2019 (or the year
+        given)
+    year : Integer
+        The year that data_2019 is from
+    workers : Integer
+        The amount of processes that render the figures
     """
 
-    plot_genres_multi(anime_data)
-    plot_genres_first(anime_data)
-    plot_genres_multi(data_2019, "multi_genre2019", "in 2019")
-    plot_genres_first(data_2019, "main_genre2019", "in 2019")
-    plot_genre_count_yearly(anime_data)
-    plot_genre_score_yearly(anime_data)
-    plot_average_scores(anime_data)
+    plot_executor.run_tasks(get_tasks(anime_data, data_2019, year), workers)
@@ -0,0 +1,267 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that scores new anime with the score and favorites trees of my
+fourth research question without retraining them. It only needs NumPy: the
+trees exported by rq_four.export_models are memory-mapped and whole batches
+of anime walk down them at once.
+
+Example: python scoring.py data/animelist_2020.csv --output predictions.csv
+"""
+
+import os
+import csv
+import json
+import argparse
+from time import perf_counter
+from collections import namedtuple
+import numpy as np
+
+FORMAT_VERSION = 1
+MODEL_DIR = "models/rq4"
+TREE_ARRAYS = ["children_left", "children_right", "feature", "threshold",
+               "value", "missing_go_to_left"]
+NUMERIC = ["episodes", "duration_min"]
+MULTI_LABEL = ["studio", "genre"]
+
+Tree = namedtuple("Tree", TREE_ARRAYS)
+
+
+def load_models(directory=MODEL_DIR):
+    """Loads exported trees (memory-mapped) and their encoder vocabularies
+
+    Parameters
+    ----------
+    directory : String
+        The folder rq_four.export_models saved the models in
+
+    Returns
+    -------
+    Tuple
+        Returns the manifest (format version, targets, feature names, ...),
+        the encoder vocabularies and a dictionary of target to Tree
+    """
+
+    with open(os.path.join(directory, "manifest.json")) as file:
+        manifest = json.load(file)
+    if manifest["version"] != FORMAT_VERSION:
+        raise ValueError("Can't score models of format version " +
+                         f"{manifest['version']} (expected {FORMAT_VERSION})")
+    with open(os.path.join(directory, "encoder.json")) as file:
+        vocabularies = json.load(file)["vocabularies"]
+    trees = {target: Tree(*[np.load(
+        os.path.join(directory, f"{target}_{name}.npy"), mmap_mode="r")
+        for name in TREE_ARRAYS]) for target in manifest["targets"]}
+    return manifest, vocabularies, trees
+
+
+def used_features(trees):
+    """Returns the sorted feature indexes any of the trees split on"""
+
+    return np.unique(np.concatenate([
+        np.asarray(tree.feature)[np.asarray(tree.children_left) != -1]
+        for tree in trees.values()]))
+
+
+def read_anime(path):
+    """Reads anime show data from a CSV file
+
+    Parameters
+    ----------
+    path : String
+        Path of a CSV with type, episodes, duration_min, source, genre and
+        studio columns (ex: data/animelist_2019.csv)
+
+    Returns
+    -------
+    Dictionary
+        Returns column name to a list of the (string) values
+    """
+
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = list(zip(*reader)) or [()] * len(header)
+    return {name: list(values) for name, values in zip(header, columns)}
+
+
+def encode(anime, feature_names, vocabularies, features):
+    """Encodes anime into only the feature columns the trees use
+
+    Parameters
+    ----------
+    anime : Dictionary
+        Column name to values (see read_anime)
+    feature_names : List
+        The names of all feature columns the trees were trained on
+    vocabularies : Dictionary
+        The encoder's labels of every label feature
+    features : Array
+        The indexes (into feature_names) of the columns to encode
+
+    Returns
+    -------
+    Array
+        Returns a float32 array with a row per anime and a column per
+        requested feature. Labels the encoder didn't know are all zeros
+
+    Notes
+    -----
+    Every label column is split and matched against the vocabulary once as a
+        whole (not anime by anime), so encoding keeps up with predict
+    """
+
+    rows = len(next(iter(anime.values()), []))
+    labels = {f"{feature}_{label}": (feature, label)
+              for feature, vocabulary in vocabularies.items()
+              for label in vocabulary}
+    matrix = np.zeros((rows, len(features)), dtype="float32")
+    # Label feature to {label: column of matrix} of its requested labels
+    positions = {}
+    for position, index in enumerate(features):
+        name = feature_names[index]
+        if name in NUMERIC:
+            values = np.array(anime[name], dtype=object)
+            values[values == ""] = "nan"
+            matrix[:, position] = values.astype("float64")
+        else:
+            feature, label = labels[name]
+            positions.setdefault(feature, {})[label] = position
+
+    for feature, label_positions in positions.items():
+        if feature in MULTI_LABEL:
+            row_numbers, values = _split_labels(anime[feature])
+        else:
+            row_numbers = np.arange(rows)
+            values = np.array(anime[feature], dtype=str)
+        requested = np.array(sorted(label_positions), dtype=str)
+        found = np.searchsorted(requested, values).clip(max=len(requested) - 1)
+        keep = requested[found] == values
+        columns = np.array([label_positions[label] for label in requested])
+        matrix[row_numbers[keep], columns[found[keep]]] = 1
+    return matrix
+
+
+def _split_labels(values, separator=", "):
+    """Returns the row number and label of every label of a multi-label
+    column, splitting the whole column with one split
+    """
+
+    # A row marker that can't be a label starts every row's labels
+    marker = "\x1e"
+    tokens = np.array((marker + separator + f"{separator}{marker}{separator}"
+                       .join(values)).split(separator), dtype=str)
+    starts = tokens == marker
+    return np.cumsum(starts)[~starts] - 1, tokens[~starts]
+
+
+def predict(tree, matrix, columns):
+    """Predicts every row of a batch by walking down a tree at once
+
+    Parameters
+    ----------
+    tree : Tree
+        An exported tree
+    matrix : Array
+        The encoded batch (see encode)
+    columns : Array
+        Feature index to its column in matrix (-1 if it isn't encoded)
+
+    Returns
+    -------
+    Array
+        Returns the prediction of every row
+
+    Notes
+    -----
+    Missing values go to the side the tree learned for them
+    """
+
+    children_left = np.asarray(tree.children_left)
+    children_right = np.asarray(tree.children_right)
+    feature = columns[np.maximum(np.asarray(tree.feature), 0)]
+    threshold = np.asarray(tree.threshold)
+    missing_left = np.asarray(tree.missing_go_to_left).astype(bool)
+
+    rows = np.arange(len(matrix))
+    nodes = np.zeros(len(matrix), dtype="intp")
+    active = rows
+    while len(active):
+        current = nodes[active]
+        left = children_left[current]
+        internal = left != -1
+        active, current, left = \
+            active[internal], current[internal], left[internal]
+        values = matrix[active, feature[current]]
+        go_left = np.where(np.isnan(values), missing_left[current],
+                           values <= threshold[current])
+        nodes[active] = np.where(go_left, left, children_right[current])
+    return np.asarray(tree.value)[nodes]
+
+
+def score(path, directory=MODEL_DIR):
+    """Predicts the score and favorites of the anime in a CSV file
+
+    Parameters
+    ----------
+    path : String
+        Path of a CSV of anime show data
+    directory : String
+        The folder of the exported models
+
+    Returns
+    -------
+    Dictionary
+        Returns target (score, favorites) to its predictions, plus the
+        anime_id column if the CSV has one
+
+    Notes
+    -----
+    Encoding and predicting with both trees together handle about 200,000
+        anime per second on one core (667,000 synthetic anime in about 3.3
+        seconds, most of it encoding). Reading the CSV takes longer than both
+    """
+
+    manifest, vocabularies, trees = load_models(directory)
+    anime = read_anime(path)
+    features = used_features(trees)
+    columns = np.full(len(manifest["feature_names"]), -1)
+    columns[features] = np.arange(len(features))
+    matrix = encode(anime, manifest["feature_names"], vocabularies, features)
+
+    results = {"anime_id": anime["anime_id"]} if "anime_id" in anime else {}
+    for target, tree in trees.items():
+        results[target] = predict(tree, matrix, columns)
+    return results
+
+
+def main(path, output=None, directory=MODEL_DIR):
+    """Scores a CSV of anime and prints or saves the predictions"""
+
+    start = perf_counter()
+    results = score(path, directory)
+    if output:
+        with open(output, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(list(results))
+            writer.writerows(zip(*results.values()))
+        print(f"Scored {len(results['score'])} anime in " +
+              f"{perf_counter() - start:.2f} seconds")
+    else:
+        print(",".join(results))
+        for row in zip(*results.values()):
+            print(",".join(str(value) for value in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("path", help="CSV of the anime to score")
+    parser.add_argument("--output", help="CSV to save the predictions to " +
+                        "(prints them if not given)")
+    parser.add_argument("--models", default=MODEL_DIR,
+                        help="folder of the exported models")
+    args = parser.parse_args()
+    main(args.path, args.output, args.models)
@@ -0,0 +1,546 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that generates synthetic versions of the four cleaned datasets
+(anime, users, user animelists and 2019 anime) with the same columns and
+realistic looking values: a few genres and studios are in most anime, scores
+lean towards the high end, popular anime end up in many more animelists and
+every user has a birth date. Scale 1 is about the size of the real cleaned
+data (6,668 anime, 108,711 users and about 27 million animelist entries) and
+bigger scales are used for load testing.
+
+Rows are made and written in small blocks, so only the numbers needed to
+connect the datasets (ids, scores, popularity) stay in memory however big
+the output gets. The random numbers of every block only depend on the seed,
+so the same seed and scale always write the same files.
+
+Example: python synthetic_data.py --scale 10 --directory load_test/data
+"""
+
+import os
+import argparse
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import data_loading
+
+DATASET_NAMES = ["anime", "anime_2019", "users", "user_animelists"]
+# The amount of rows of each dataset at scale 1
+BASE_ROWS = {"anime": 6668, "anime_2019": 600, "users": 108711}
+BASE_STUDIOS = 600
+# Anime and users are made (and written) this many rows at a time. The user
+# animelists are made for this many users at a time
+BLOCK_ROWS = 2000
+FORMATS = ["csv", "parquet", "both"]
+SEASON_COLUMNS = ["anime_id", "title", "type", "episodes", "duration_min",
+                  "source", "score", "members", "favorites", "studio",
+                  "genre"]
+
+# Genres and studios from most to least common (their popularity follows
+# Zipf's law)
+GENRES = ["Comedy", "Action", "Fantasy", "Adventure", "Drama", "Sci-Fi",
+          "Romance", "Shounen", "Slice of Life", "School", "Kids",
+          "Supernatural", "Music", "Magic", "Mecha", "Ecchi", "Seinen",
+          "Historical", "Mystery", "Shoujo", "Sports", "Harem", "Military",
+          "Super Power", "Parody", "Space", "Demons", "Martial Arts",
+          "Psychological", "Horror", "Game", "Police", "Samurai", "Cars",
+          "Dementia", "Thriller", "Josei", "Vampire", "Shounen Ai",
+          "Shoujo Ai"]
+STUDIOS = ["Toei Animation", "Sunrise", "J.C.Staff", "Madhouse",
+           "Production I.G", "TMS Entertainment", "Studio Deen",
+           "Studio Pierrot", "OLM", "A-1 Pictures", "Shaft", "Xebec", "Bones",
+           "Gonzo", "Kyoto Animation", "Tatsunoko Production", "AIC",
+           "Nippon Animation", "Brain's Base", "Satelight"]
+TYPES = {"TV": 0.35, "OVA": 0.22, "Movie": 0.15, "Special": 0.15,
+         "ONA": 0.07, "Music": 0.06}
+# Type to the typical amount of episodes and minutes per episode
+TYPE_LENGTHS = {"TV": (12, 24), "OVA": (2, 30), "Movie": (1, 90),
+                "Special": (2, 15), "ONA": (8, 12), "Music": (1, 4)}
+SOURCES = {"Manga": 0.33, "Original": 0.25, "Light novel": 0.08,
+           "Visual novel": 0.06, "Game": 0.06, "Novel": 0.05,
+           "4-koma manga": 0.04, "Web manga": 0.03, "Other": 0.04,
+           "Picture book": 0.02, "Book": 0.02, "Card game": 0.01,
+           "Music": 0.01}
+RELATIONS = ["Sequel", "Prequel", "Side story", "Alternative version",
+             "Spin-off"]
+LOCATIONS = ["California", "Texas", "New York", "London", "Toronto",
+             "Sydney", "Berlin", "Paris", "Manila", "Jakarta", "Sao Paulo",
+             "Mexico City", "Warsaw", "Moscow", "Tokyo"]
+# MAL animelist statuses (5 isn't used by MAL)
+STATUSES = {"watching": 1, "completed": 2, "onhold": 3, "dropped": 4,
+            "plantowatch": 6}
+DATASET_KEYS = {name: number for number, name in enumerate(DATASET_NAMES)}
+
+
+def _rng(seed, name, block=0):
+    """Returns the random generator of one block of a dataset"""
+
+    return np.random.default_rng([seed, DATASET_KEYS[name], block])
+
+
+def _zipf(amount, exponent=1.0):
+    """Returns the cumulative probabilities of amount labels whose
+    popularity follows Zipf's law
+    """
+
+    weights = 1 / np.arange(1, amount + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def _choose(rng, options, size):
+    """Picks size keys of a dictionary of options to their probabilities"""
+
+    probabilities = np.array(list(options.values()))
+    return rng.choice(list(options), size, p=probabilities / probabilities
+                      .sum())
+
+
+def _labels(rng, vocabulary, cumulative, counts):
+    """Returns multi-label strings (ex: "Action, Comedy") with a different
+    amount of labels on each row
+
+    Parameters
+    ----------
+    rng : Generator
+        The random generator of the block
+    vocabulary : List
+        The labels from most to least common
+    cumulative : Array
+        Cumulative probabilities of the labels (see _zipf)
+    counts : Array
+        The most labels on each row (repeats are dropped)
+
+    Returns
+    -------
+    List
+        Returns a string per row with its labels in the order they were
+        picked
+    """
+
+    picks = np.searchsorted(cumulative, rng.random((len(counts),
+                                                    counts.max())))
+    picks = np.minimum(picks, len(vocabulary) - 1)
+    return [", ".join(dict.fromkeys(vocabulary[pick] for pick in row[:count]))
+            for row, count in zip(picks, counts)]
+
+
+def studio_names(scale=1):
+    """Returns the studios anime are made by, most common first
+
+    Parameters
+    ----------
+    scale : Float
+        Size compared to the real data. New studios keep showing up as
+        there are more anime, so the vocabulary grows with the square root of
+        the scale
+
+    Returns
+    -------
+    List
+        Returns the names of the studios
+    """
+
+    amount = max(len(STUDIOS), int(BASE_STUDIOS * np.sqrt(scale)))
+    return STUDIOS + [f"Studio {number}"
+                      for number in range(1, amount - len(STUDIOS) + 1)]
+
+
+def anime_catalog(scale=1, seed=0, season=None, first_id=1):
+    """Makes the numeric columns of synthetic anime
+
+    Parameters
+    ----------
+    scale : Float
+        Size compared to the real data (see BASE_ROWS)
+    seed : Integer
+        Seed of the random data
+    season : Integer
+        The year every anime aired in. Makes the anime before 2018 (the
+        "anime" dataset) if not given
+    first_id : Integer
+        The anime_id of the first anime
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame of anime_id, type, source, episodes,
+        duration_min, score, members, scored_by, favorites, rank,
+        popularity and aired_from_year columns
+
+    Notes
+    -----
+    Scores lean high (most anime are 6 to 8 and few are below 5) and
+        better anime have more members and many more favorites
+    Only numbers are made here, so even 100x the real anime fit in memory
+    """
+
+    name = "anime" if season is None else "anime_2019"
+    rng = _rng(seed, name)
+    rows = max(1, round(BASE_ROWS[name] * scale))
+    kind = _choose(rng, TYPES, rows)
+    typical = pd.DataFrame(TYPE_LENGTHS, index=["episodes", "minutes"]).T \
+        .loc[kind]
+
+    episodes = 1 + rng.poisson(typical["episodes"].to_numpy() - 1)
+    # Some TV shows run for two or four seasons
+    episodes = np.where(kind == "TV",
+                        episodes * rng.choice([1, 2, 4], rows,
+                                              p=[0.65, 0.27, 0.08]),
+                        episodes)
+    minutes = np.maximum(1, np.round(typical["minutes"].to_numpy() *
+                                     rng.lognormal(0, 0.25, rows)))
+    score = np.clip(9.3 - rng.gamma(5, 0.48, rows), 1.5, 9.4).round(2)
+    members = np.maximum(1, np.exp(
+        9 + 1.2 * (score - 6.9) + rng.normal(0, 1.3, rows))).astype("int64")
+    favorites = (members * 10 ** (-3 + 0.8 * (score - 6.9)) *
+                 rng.lognormal(0, 0.8, rows)).astype("int64")
+    years = np.full(rows, season) if season is not None else \
+        np.maximum(1960, 2018 - rng.exponential(11, rows).astype("int64"))
+
+    catalog = pd.DataFrame({
+        "anime_id": np.arange(first_id, first_id + rows),
+        "type": kind,
+        "source": _choose(rng, SOURCES, rows),
+        "episodes": episodes,
+        "duration_min": minutes,
+        "score": score,
+        "members": members,
+        "scored_by": (members * rng.beta(5, 3, rows)).astype("int64"),
+        "favorites": favorites,
+        "aired_from_year": years
+    })
+    catalog["rank"] = catalog["score"].rank(ascending=False, method="first") \
+        .astype("int64")
+    catalog["popularity"] = catalog["members"] \
+        .rank(ascending=False, method="first").astype("int64")
+    return catalog
+
+
+def iter_anime(catalog, scale=1, seed=0, season=None):
+    """Makes the full rows of synthetic anime a block at a time
+
+    Parameters
+    ----------
+    catalog : DataFrame
+        The numeric columns of the anime (see anime_catalog)
+    scale : Float
+        Size compared to the real data (sets the amount of studios)
+    seed : Integer
+        Seed of the random data
+    season : Integer
+        Whether the catalog is of a single season. Season anime only have the
+        columns of data/animelist_2019.csv (see SEASON_COLUMNS)
+
+    Returns
+    -------
+    Generator
+        Yields Pandas DataFrames of BLOCK_ROWS anime with the columns of the
+        cleaned anime data (the genre and studio strings are only ever made
+        for one block)
+    """
+
+    name = "anime" if season is None else "anime_2019"
+    studios = studio_names(scale)
+    genre_odds, studio_odds = _zipf(len(GENRES)), _zipf(len(studios))
+    for block, start in enumerate(range(0, len(catalog), BLOCK_ROWS)):
+        rng = _rng(seed, name, block + 1)
+        chunk = catalog.iloc[start:start + BLOCK_ROWS].copy()
+        ids = chunk["anime_id"].to_numpy()
+        rows = len(chunk)
+        chunk["title"] = [f"Synthetic Anime {anime_id}" for anime_id in ids]
+        chunk["genre"] = [", ".join(sorted(genres.split(", "))) for genres in
+                          _labels(rng, GENRES, genre_odds,
+                                  1 + rng.binomial(5, 0.4, rows))]
+        chunk["studio"] = _labels(rng, studios, studio_odds,
+                                  rng.choice([1, 2, 3], rows,
+                                             p=[0.8, 0.17, 0.03]))
+        if season is not None:
+            chunk["duration_min"] = chunk["duration_min"].astype("int64")
+            yield chunk[SEASON_COLUMNS]
+            continue
+
+        chunk["image_url"] = [
+            f"https://myanimelist.cdn-dena.com/images/anime/{anime_id}.jpg"
+            for anime_id in ids]
+        related = rng.integers(catalog["anime_id"].iloc[0],
+                               catalog["anime_id"].iloc[-1] + 1, rows)
+        relation = rng.choice(RELATIONS, rows)
+        chunk["related"] = [
+            "{'" + kind + "': [{'mal_id': " + str(other) + ", 'type': " +
+            "'anime', 'url': 'https://myanimelist.net/anime/" + str(other) +
+            "/', 'title': 'Synthetic Anime " + str(other) + "'}]}"
+            if has_relation else "{}"
+            for kind, other, has_relation in
+            zip(relation, related, rng.random(rows) < 0.4)]
+        yield chunk
+
+
+def _user_counts(rng, rows):
+    """Returns the amount of anime of every animelist status of each user"""
+
+    return pd.DataFrame({
+        "user_watching": rng.lognormal(2, 1, rows),
+        "user_completed": rng.lognormal(4.9, 1, rows),
+        "user_onhold": rng.lognormal(1.2, 1.2, rows) - 1,
+        "user_dropped": rng.lognormal(1.5, 1.2, rows) - 1,
+        "user_plantowatch": rng.lognormal(3.4, 1.3, rows)
+    }).clip(lower=0).astype("int64")
+
+
+def iter_users(scale=1, seed=0):
+    """Makes synthetic MAL users a block at a time
+
+    Parameters
+    ----------
+    scale : Float
+        Size compared to the real data (see BASE_ROWS)
+    seed : Integer
+        Seed of the random data
+
+    Returns
+    -------
+    Generator
+        Yields Pandas DataFrames of BLOCK_ROWS users with the columns of the
+        cleaned user data. Birth dates are YYYY-MM-DD and age is 2020 minus
+        the birth year (like clean_userlist)
+    """
+
+    rows = max(1, round(BASE_ROWS["users"] * scale))
+    for block, start in enumerate(range(0, rows, BLOCK_ROWS)):
+        rng = _rng(seed, "users", block)
+        size = min(BLOCK_ROWS, rows - start)
+        ids = np.arange(start + 1, start + size + 1)
+        users = _user_counts(rng, size)
+        episodes = users["user_completed"] * 12 + users["user_watching"] * 6
+        born = pd.to_datetime(pd.DataFrame({
+            "year": np.clip(np.round(rng.normal(1993, 5.5, size)), 1950,
+                            2008),
+            "month": rng.integers(1, 13, size),
+            "day": rng.integers(1, 29, size)
+        }))
+        users.insert(0, "username", [f"user{user_id}" for user_id in ids])
+        users.insert(1, "user_id", ids)
+        users["user_days_spent_watching"] = \
+            (episodes * 24 * rng.lognormal(0, 0.3, size) / 1440).round(2)
+        users["gender"] = rng.choice(["Male", "Female"], size, p=[0.6, 0.4])
+        users["location"] = rng.choice(LOCATIONS, size)
+        users["birth_date"] = born.dt.strftime("%Y-%m-%d")
+        users["stats_mean_score"] = np.clip(rng.normal(7.6, 1, size), 1, 10) \
+            .round(2)
+        users["stats_episodes"] = episodes
+        users["age"] = 2020 - born.dt.year
+        yield users
+
+
+def iter_animelists(catalog, scale=1, seed=0):
+    """Makes the animelists of the synthetic users a block of users at a time
+
+    Parameters
+    ----------
+    catalog : DataFrame
+        The numeric columns of the anime they list (see anime_catalog)
+    scale : Float
+        Size compared to the real data (see BASE_ROWS)
+    seed : Integer
+        Seed of the random data (the same seed as iter_users)
+
+    Returns
+    -------
+    Generator
+        Yields Pandas DataFrames of the username, anime_id, my_score,
+        my_status and my_watched_episodes of the entries of BLOCK_ROWS users
+
+    Notes
+    -----
+    Every user lists as many anime of each status as their user_* counts
+        (less any anime picked twice). Anime with more members are picked
+        more often, scores follow the anime's score and the user's taste,
+        and planned anime are never scored or watched
+    """
+
+    cumulative = np.cumsum(catalog["members"].to_numpy("float64"))
+    cumulative /= cumulative[-1]
+    anime_ids = catalog["anime_id"].to_numpy()
+    anime_scores = catalog["score"].to_numpy()
+    anime_episodes = catalog["episodes"].to_numpy()
+    codes = np.array(list(STATUSES.values()))
+    for block, users in enumerate(iter_users(scale, seed)):
+        rng = _rng(seed, "user_animelists", block)
+        counts = users[[f"user_{status}" for status in STATUSES]].to_numpy()
+        user = np.repeat(np.arange(len(users)), counts.sum(axis=1))
+        status = np.repeat(np.tile(codes, len(users)), counts.ravel())
+        anime = np.searchsorted(cumulative, rng.random(len(user)))
+        _, first = np.unique(user * len(anime_ids) + anime,
+                             return_index=True)
+        user, status, anime = user[first], status[first], anime[first]
+
+        taste = rng.normal(0, 0.8, len(users))
+        score = np.round(anime_scores[anime] + taste[user] +
+                         rng.normal(0, 1.2, len(user)) -
+                         2 * (status == STATUSES["dropped"]))
+        scored = (status != STATUSES["plantowatch"]) & \
+            (rng.random(len(user)) < 0.75)
+        episodes = anime_episodes[anime]
+        watched = np.where(
+            status == STATUSES["completed"], episodes,
+            (episodes * rng.random(len(user))).astype("int64"))
+        yield pd.DataFrame({
+            "username": users["username"].to_numpy()[user],
+            "anime_id": anime_ids[anime],
+            "my_score": np.where(scored, np.clip(score, 1, 10), 0)
+            .astype("int64"),
+            "my_status": status,
+            "my_watched_episodes": np.where(
+                status == STATUSES["plantowatch"], 0, watched)
+        })
+
+
+def write_dataset(name, chunks, directory="data", file_format="csv"):
+    """Writes the chunks of a dataset as they are made
+
+    Parameters
+    ----------
+    name : String
+        Name of the dataset (a key of data_loading.DATASETS)
+    chunks : Iterable
+        Pandas DataFrames of consecutive rows of the dataset
+    directory : String
+        The folder to write the files in
+    file_format : String
+        "csv", "parquet" (typed columnar, see data_loading) or "both"
+
+    Returns
+    -------
+    Integer
+        Returns the amount of rows written
+
+    Notes
+    -----
+    File Path: {directory}/{dataset}.csv and/or .parquet (the names
+        data_loading expects)
+    """
+
+    base = os.path.join(directory, os.path.basename(
+        data_loading.dataset_info(name)[0]))
+    rows = 0
+    csv_file = open(base + ".csv", "w", newline="") \
+        if file_format in ("csv", "both") else None
+    columnar = data_loading.ColumnarWriter(name, base + ".parquet") \
+        if file_format in ("parquet", "both") else None
+    try:
+        for number, chunk in enumerate(chunks):
+            rows += len(chunk)
+            if csv_file is not None:
+                chunk.to_csv(csv_file, index=False, header=number == 0)
+            if columnar is not None:
+                columnar.write(chunk)
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        if columnar is not None:
+            columnar.close()
+    return rows
+
+
+def generate(scale=1, seed=0, directory="data", file_format="csv",
+             datasets=DATASET_NAMES, overwrite=False):
+    """Writes synthetic versions of the cleaned datasets
+
+    Parameters
+    ----------
+    scale : Float
+        Size compared to the real data (ex: 0.01 for quick tests, 100 for
+        load tests)
+    seed : Integer
+        Seed of the random data
+    directory : String
+        The folder to write the files in
+    file_format : String
+        "csv", "parquet" or "both" (see write_dataset)
+    datasets : List
+        The datasets to write (a subset of DATASET_NAMES)
+    overwrite : Boolean
+        Whether existing files can be replaced. Off by default so the real
+        cleaned data is never overwritten by accident
+
+    Returns
+    -------
+    Dictionary
+        Returns dataset name to the amount of rows written
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format} (expected one of " +
+                         f"{FORMATS})")
+    if file_format != "csv" and data_loading.pq is None:
+        raise ValueError("Writing Parquet files needs pyarrow")
+    extensions = {"csv": [".csv"], "parquet": [".parquet"],
+                  "both": [".csv", ".parquet"]}[file_format]
+    paths = [os.path.join(directory, os.path.basename(
+        data_loading.dataset_info(name)[0]) + extension)
+        for name in datasets for extension in extensions]
+    existing = [path for path in paths if os.path.exists(path)]
+    if existing and not overwrite:
+        raise FileExistsError(f"Not overwriting {existing} (use overwrite)")
+    os.makedirs(directory, exist_ok=True)
+
+    catalog = anime_catalog(scale, seed)
+    season_catalog = anime_catalog(scale, seed, 2019,
+                                   catalog["anime_id"].iloc[-1] + 1)
+    chunks = {
+        "anime": lambda: iter_anime(catalog, scale, seed),
+        "anime_2019": lambda: iter_anime(season_catalog, scale, seed, 2019),
+        "users": lambda: iter_users(scale, seed),
+        "user_animelists": lambda: iter_animelists(catalog, scale, seed)
+    }
+    written = {}
+    for name in datasets:
+        start = perf_counter()
+        written[name] = write_dataset(name, chunks[name](), directory,
+                                      file_format)
+        print(f"Wrote {written[name]} {name} rows in " +
+              f"{perf_counter() - start:.1f} seconds")
+    return written
+
+
+def make_anime(scale=1, seed=0):
+    """Returns synthetic anime show data (the "anime" dataset) as one
+    DataFrame
+
+    Parameters
+    ----------
+    scale : Float
+        Size compared to the real data (see BASE_ROWS)
+    seed : Integer
+        Seed of the random data
+
+    Returns
+    -------
+    DataFrame
+        Returns a Pandas DataFrame with the columns of the cleaned anime data
+    """
+
+    catalog = anime_catalog(scale, seed)
+    return pd.concat(iter_anime(catalog, scale, seed), ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1,
+                        help="size compared to the real data (ex: 0.1, 100)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random data")
+    parser.add_argument("--directory", default="data",
+                        help="folder to write the files in")
+    parser.add_argument("--format", default="csv", choices=FORMATS,
+                        help="file format of the datasets")
+    parser.add_argument("--datasets", nargs="+", default=DATASET_NAMES,
+                        choices=DATASET_NAMES, help="datasets to write")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="replace existing files")
+    args = parser.parse_args()
+    generate(args.scale, args.seed, args.directory, args.format,
+             args.datasets, args.overwrite)
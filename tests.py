@@ -6,8 +6,31 @@ Final Project
 A script that does basic tests my data analysis for my final project
 """
 
+import os
+import sys
+import json
+import tempfile
+import threading
+import numpy as np
 import pandas as pd
 import rq_one as rq1
+import rq_two as rq2
+import rq_four as rq4
+import analysis
+import anime_cube
+import artifact_cache
+import data_loading
+import data_retrieve_cleaning
+import feature_encoding
+import jikan_caching
+import jikan_fetching
+import label_index
+import row_journal
+import scoring
+import synthetic_data
+import tracing
+import tree_rendering
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 
 def test_cleaned_data(anime, users, lists, anime_2019):
@@ -50,6 +73,47 @@ def test_cleaned_data(anime, users, lists, anime_2019):
     print("All Cleaned Sets Have The Proper Columns")
 
 
+def test_clean_user_animelists():
+    """Tests that the streamed user animelist cleaning writes the same CSV
+    as cleaning the whole file at once
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "data", "original_data"))
+        path = os.path.join(directory, "data", "original_data",
+                            "users_animelists_azathoth.csv")
+        with open(path, "w") as file:
+            file.write("username,anime_id,my_watched_episodes,my_start_date,"
+                       "my_score,my_status\n"
+                       "karthiga,21,586,2012-01-01,9,1\n"
+                       "karthiga,59,26,,,2\n"
+                       "RedvelvetDaisuki,74,,2015-03-05,7,6\n"
+                       "RedvelvetDaisuki,120,26,,8,2\n"
+                       "Damonashu,178,1,2016-07-10,0,6\n")
+        whole_file = pd.read_csv(path, usecols=[
+            "username", "anime_id", "my_score", "my_status",
+            "my_watched_episodes"]).dropna().to_csv(index=False)
+        os.chdir(directory)
+        try:
+            data_retrieve_cleaning.clean_user_animelists(chunksize=2)
+            with open("data/user_animelists_cleaned.csv") as file:
+                cleaned = file.read()
+        finally:
+            os.chdir(original_dir)
+
+    assert cleaned == whole_file
+    # Only the columns with missing values are written as floats
+    assert cleaned.splitlines()[1] == "karthiga,21,586.0,9.0,1"
+
+    print("User Animelist Cleaning is generally valid")
+
+
 def test_genre_calculations(anime, anime_2019):
     """Tests if common genre info maniplation techniques that I used are valid
 
@@ -156,6 +220,182 @@ def test_studio_calculations(anime):
     print("Studio Information Manipulation is generally valid")
 
 
+def test_label_index(anime):
+    """Tests if the sparse genre/studio index matches the pandas techniques
+
+    Parameters
+    ----------
+    anime : DataFrame
+        Pandas DataFrame that contains anime show data
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    for column in ["genre", "studio"]:
+        index = label_index.LabelIndex(anime[column])
+        assert index.counts().to_dict() == \
+            anime[column].str.get_dummies(", ").sum().to_dict()
+        assert (index.dummies().values ==
+                anime[column].str.get_dummies(", ").values).all()
+
+        exploded = anime[[column, "score", "aired_from_year"]].copy()
+        exploded[column] = exploded[column].str.split(", ")
+        exploded = exploded.explode(column)
+        means = exploded.groupby(column)["score"].mean()
+        assert (abs(index.means(anime["score"]) - means) < 1e-9).all()
+        yearly = exploded.groupby([column, "aired_from_year"])["score"] \
+            .mean().reset_index()
+        index_yearly = index.group_means(anime["aired_from_year"],
+                                         anime["score"])
+        assert (index_yearly["label"].values == yearly[column].values).all()
+        assert (abs(index_yearly["mean"].values -
+                    yearly["score"].values) < 1e-9).all()
+
+    print("Label Index Calculations are generally valid")
+
+
+def test_missing_labels():
+    """Tests that anime without genres or studios are tagged with no labels
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    # Retrieved anime without studios are read back from the CSV as NaN
+    anime = pd.DataFrame({"studio": ["Bones, Madhouse", np.nan, "", "Bones"],
+                          "score": [8.0, 6.0, 5.0, 7.0]})
+    index = label_index.LabelIndex(anime["studio"])
+    assert list(index.vocabulary) == ["Bones", "Madhouse"]
+    assert index.matrix.toarray().tolist() == [[1, 1], [0, 0], [0, 0],
+                                               [1, 0]]
+    assert index.counts().to_dict() == \
+        anime["studio"].str.split(", ").explode().replace("", np.nan) \
+        .value_counts().to_dict()
+    assert index.means(anime["score"]).to_dict() == \
+        {"Bones": 7.5, "Madhouse": 8.0}
+
+    print("Missing Labels are generally valid")
+
+
+def test_anime_cube():
+    """Tests that the cube's roll-ups match grouping the exploded anime data
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    anime = synthetic_data.make_anime(0.05, 2)
+    cube = anime_cube.AnimeCube(anime)
+    exploded = anime.assign(genre=anime["genre"].str.split(", "),
+                            studio=anime["studio"].str.split(", ")) \
+        .explode("genre").explode("studio")
+    genres = anime.assign(genre=anime["genre"].str.split(", ")) \
+        .explode("genre")
+
+    pairs = exploded.groupby(["genre", "studio"])["score"] \
+        .agg(["size", "mean", "var"])
+    rolled = cube.rollup(["genre", "studio"])
+    assert rolled["count"].equals(pairs["size"].rename("count"))
+    assert (abs(cube.means(["genre", "studio"]) - pairs["mean"]) <
+            1e-9).all()
+    sizes = pairs["size"].to_numpy()
+    assert (abs(cube.variances(["genre", "studio"]).to_numpy()[sizes > 1] -
+                (pairs["var"] * (sizes - 1) / sizes)[sizes > 1]) <
+            1e-9).all()
+
+    # Rolling up a label counts every anime once, not once per label
+    assert cube.counts().iloc[0] == len(anime)
+    assert cube.counts("type").to_dict() == \
+        anime["type"].value_counts().to_dict()
+    assert cube.counts("genre").to_dict() == \
+        genres["genre"].value_counts().to_dict()
+    studios = exploded.drop_duplicates(["anime_id", "studio"])
+    assert cube.rollup("studio")["favorites"].to_dict() == \
+        studios.groupby("studio")["favorites"].sum().astype(float).to_dict()
+    before = genres[genres["aired_from_year"] < 2000]
+    assert cube.counts(["aired_from_year", "genre"], where={
+        "aired_from_year": lambda years: years < 2000
+    }).to_dict() == before.groupby(["aired_from_year", "genre"]).size() \
+        .to_dict()
+    action = exploded[exploded["genre"] == "Action"]
+    assert cube.counts("studio", where={"genre": ["Action"]}).to_dict() == \
+        action.groupby("studio").size().to_dict()
+    weighted = exploded.groupby("genre")["score"].mean()
+    assert (abs(cube.means("genre", expand=["studio"]) - weighted) <
+            1e-9).all()
+
+    # A retrieved season doesn't have an aired year
+    season = anime_cube.AnimeCube(anime.drop(columns="aired_from_year"))
+    assert "aired_from_year" not in season.dimensions
+    assert season.counts("genre").equals(cube.counts("genre"))
+    try:
+        season.rollup("aired_from_year")
+        assert False
+    except ValueError:
+        pass
+
+    print("Anime Cube is generally valid")
+
+
+def test_cube_updates():
+    """Tests that appending and retracting batches of anime keeps the cube
+    the same as building it again
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    anime = synthetic_data.make_anime(0.05, 3)
+    history, batch = anime.iloc[:-40], anime.iloc[-40:]
+    cube = anime_cube.AnimeCube(history)
+    # Kept roll-ups have to be updated too
+    genres = cube.counts("genre").sum()
+    cube.means(["studio", "aired_from_year"])
+    cube.append(batch.iloc[:25])
+    cube.append(batch.iloc[25:])
+    assert anime_cube.differences(cube, anime).empty
+    assert cube.counts().iloc[0] == len(anime)
+    assert cube.counts("genre").sum() > genres
+
+    season = synthetic_data.make_anime(0.01, 4) \
+        .assign(aired_from_year=2019)
+    season["studio"] = season["studio"] + ", Aaa Studio"
+    cube.append(season)
+    everything = pd.concat([anime, season], ignore_index=True)
+    assert anime_cube.differences(cube, everything).empty
+    studios = cube.counts("studio")
+    assert studios.index.is_monotonic_increasing
+    assert studios["Aaa Studio"] == len(season)
+    assert cube.counts("aired_from_year").loc[2019] == len(season)
+
+    corrected = season.assign(score=season["score"] - 1)
+    cube.retract(season)
+    cube.append(corrected)
+    assert anime_cube.differences(
+        cube, pd.concat([anime, corrected], ignore_index=True)).empty
+    assert not anime_cube.differences(cube, everything).empty
+    cube.retract(corrected)
+    assert "Aaa Studio" not in cube.counts("studio").index
+    assert anime_cube.differences(cube, anime).empty
+
+    try:
+        cube.append(season.drop(columns="aired_from_year"))
+        assert False
+    except ValueError:
+        pass
+
+    print("Cube Updates are generally valid")
+
+
 def test_user_calculations(users):
     """Tests if common user info maniplation techniques that I used are valid
 
@@ -190,6 +430,932 @@ def test_user_calculations(users):
     print("User Information Manipulation is generally valid")
 
 
+class StubJikanHandler(BaseHTTPRequestHandler):
+    """Local stand in for JikanAPI that returns canned anime details
+
+    Notes
+    -----
+    /anime/1 always works, /anime/2 is rate limited (429) on its first
+        request, and /anime/3 always errors (500)
+    """
+
+    requests = {}
+
+    def do_GET(self):
+        anime_id = int(self.path.rstrip("/").split("/")[-1])
+        seen = StubJikanHandler.requests.get(anime_id, 0)
+        StubJikanHandler.requests[anime_id] = seen + 1
+        if anime_id == 3 or (anime_id == 2 and seen == 0):
+            status = 500 if anime_id == 3 else 429
+            body = {"status": status, "message": "Stub error"}
+        else:
+            status = 200
+            body = {"mal_id": anime_id, "favorites": anime_id * 10,
+                    "duration": "1 hr 5 min",
+                    "studios": [{"name": "Bones"}]}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_jikan_fetching():
+    """Tests the rate limited JikanAPI fetcher against a local stub server
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    from jikanpy import Jikan
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubJikanHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        jikan = Jikan(selected_base=f"http://127.0.0.1:{server.server_port}")
+        details, dead_letters = \
+            jikan_fetching.fetch_all([1, 2, 3, 1], jikan.anime, rate=50,
+                                     workers=3, max_attempts=3,
+                                     base_delay=0.01)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert sorted(details) == [1, 2]
+    assert details[2]["favorites"] == 20
+    assert dead_letters == [3]
+    assert StubJikanHandler.requests == {1: 1, 2: 2, 3: 3}
+
+    print("JikanAPI Fetching is generally valid")
+
+
+class StubJikan:
+    """A JikanAPI client that answers from made up season listings and
+    counts the requests for anime details
+
+    Parameters
+    ----------
+    favorites : Integer
+        The favorites of every anime
+    """
+
+    def __init__(self, favorites=10):
+        self.favorites = favorites
+        self.requests = 0
+
+    def season(self, year, season):
+        anime_ids = {(2019, "winter"): [4, 1], (2019, "fall"): [2],
+                     (2020, "winter"): [2, 3]}.get((year, season), [])
+        return {"anime": [{"mal_id": anime_id, "title": f"Anime {anime_id}",
+                           "type": "TV", "episodes": 12, "source": "Manga",
+                           "genres": [{"name": "Action"}], "score": 7.5,
+                           "members": 1000} for anime_id in anime_ids]}
+
+    def anime(self, anime_id):
+        self.requests += 1
+        started = {1: {"premiered": "Winter 2019"},
+                   2: {"premiered": "Fall 2019"},
+                   3: {"premiered": None,
+                       "aired": {"from": "2020-01-10T00:00:00+00:00"}},
+                   4: {"premiered": "Fall 2018"}}
+        return {"duration": "24 min per ep", "favorites": self.favorites,
+                "studios": [{"name": "Bones"}], **started[anime_id]}
+
+
+def test_columnar_writer():
+    """Tests that chunks with more categories than the first one can be
+    written to the same Parquet file
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    Does nothing if pyarrow isn't installed
+    """
+
+    if data_loading.pq is None:
+        return
+    chunks = [pd.DataFrame({"username": [f"user{index}" for index in
+                                         range(users)],
+                            "anime_id": 1, "my_score": 8, "my_status": 2,
+                            "my_watched_episodes": 12})
+              for users in [50, 200, 300, 40000]]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lists.parquet")
+        with data_loading.ColumnarWriter("user_animelists", path) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        loaded = pd.read_parquet(path)
+
+    assert len(loaded) == sum(len(chunk) for chunk in chunks)
+    assert list(loaded["username"].astype(str)) == \
+        [name for chunk in chunks for name in chunk["username"]]
+    assert loaded["my_score"].dtype == "int8"
+
+    print("Columnar Writer is generally valid")
+
+
+def test_season_data():
+    """Tests that retrieved anime are written to the year they started
+    airing (or were first listed in) and that the journal of parsed anime
+    doesn't outlive a finished run
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            os.makedirs("data")
+            jikan = StubJikan()
+            assert data_retrieve_cleaning.get_season_data(
+                [2019], rate=100, jikan=jikan) == []
+            assert jikan.requests == 3
+            assert not os.path.exists("data/animelist_seasons.journal.jsonl")
+            first = pd.read_csv("data/animelist_2019.csv")
+
+            # Cached responses are reused until they are older than ttl
+            data_retrieve_cleaning.get_season_data([2019], rate=100,
+                                                   jikan=StubJikan(20))
+            assert pd.read_csv("data/animelist_2019.csv").equals(first)
+            data_retrieve_cleaning.get_season_data([2019], rate=100, ttl=-1,
+                                                   jikan=StubJikan(20))
+            assert (pd.read_csv("data/animelist_2019.csv")["favorites"]
+                    == 20).all()
+
+            # A show airing in 2019 and 2020 is in 2019 if 2019 is retrieved
+            data_retrieve_cleaning.get_season_data([2020], rate=100,
+                                                   jikan=jikan)
+            only_2020 = pd.read_csv("data/animelist_2020.csv")
+            data_retrieve_cleaning.get_season_data([2019, 2020], rate=100,
+                                                   jikan=jikan)
+            both = {year: pd.read_csv(f"data/animelist_{year}.csv")
+                    for year in [2019, 2020]}
+        finally:
+            os.chdir(original_dir)
+
+    # A show that started in 2018 stays in the first year it is listed in
+    assert list(first["anime_id"]) == [4, 1, 2]
+    assert (first["duration_min"] == 24).all()
+    assert "aired_from_year" not in first
+    assert list(only_2020["anime_id"]) == [2, 3]
+    assert list(both[2020]["anime_id"]) == [3]
+    assert list(both[2019]["anime_id"]) == [4, 1, 2]
+
+    print("Season Retrieval is generally valid")
+
+
+def test_jikan_caching():
+    """Tests the JikanAPI response cache and the crash safe row journal
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = jikan_caching.ResponseCache(directory, ttl=60)
+        assert cache.get([2019, "spring"]) is None
+        cache.put([2019, "spring"], {"anime": [1, 2]})
+        assert cache.get([2019, "spring"]) == {"anime": [1, 2]}
+        assert jikan_caching.ResponseCache(directory, ttl=-1) \
+            .get([2019, "spring"]) is None
+
+        journal = row_journal.Journal(os.path.join(directory, "rows.jsonl"))
+        journal.append({"anime_id": 1})
+        journal.append({"anime_id": 2})
+        # Simulates a crash in the middle of writing a row
+        with open(journal.path, "a") as file:
+            file.write('{"anime_')
+        assert journal.read() == [{"anime_id": 1}, {"anime_id": 2}]
+        journal.append({"anime_id": 3})
+        assert journal.read() == \
+            [{"anime_id": 1}, {"anime_id": 2}, {"anime_id": 3}]
+
+    print("JikanAPI Caching is generally valid")
+
+
+def test_artifact_cache():
+    """Tests that cached results are reused until their inputs change
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    builds = []
+
+    def build():
+        builds.append(1)
+        return len(builds)
+
+    original_dir = artifact_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        artifact_cache.CACHE_DIR = directory
+        try:
+            data = pd.DataFrame({"score": [7.5, 8.0]})
+            assert artifact_cache.cached("test", build, [data]) == 1
+            assert artifact_cache.cached("test", build, [data.copy()]) == 1
+            assert artifact_cache.cached("test", build, [data],
+                                         {"depth": 7}) == 2
+            data.loc[0, "score"] = 9.0
+            assert artifact_cache.cached("test", build, [data]) == 3
+            artifact_cache.evict(0)
+            assert artifact_cache.cached("test", build, [data]) == 4
+        finally:
+            artifact_cache.CACHE_DIR = original_dir
+
+        # Editing a module that the building module imports is a new version
+        for name, source in [("cached_build", "import cached_helper\n"
+                              "def build():\n    return 1\n"),
+                             ("cached_helper", "import os\n")]:
+            with open(os.path.join(directory, f"{name}.py"), "w") as file:
+                file.write(source)
+        sys.path.insert(0, directory)
+        try:
+            import cached_build
+            version = artifact_cache.code_version(cached_build.build)
+            with open(os.path.join(directory, "cached_helper.py"),
+                      "a") as file:
+                file.write("SCALE = 2\n")
+            assert artifact_cache.code_version(cached_build.build) != version
+        finally:
+            sys.path.remove(directory)
+            sys.modules.pop("cached_build", None)
+            sys.modules.pop("cached_helper", None)
+
+    print("Artifact Caching is generally valid")
+
+
+def test_pipeline():
+    """Tests the stage dependencies and staleness checks of the pipeline
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    import pipeline
+
+    stages = pipeline.get_stages()
+    dependencies = pipeline.get_dependencies(stages)
+    assert dependencies["rq4_optimal_depth"] == {"data_anime", "data_2019"}
+    assert dependencies["data_anime"] == set()
+    selected = pipeline.select(stages, ["rq4"])
+    assert selected == {"rq4_optimal_features", "rq4_optimal_depth",
+                        "rq4_decision_tree", "rq4_export_models",
+                        "rq4_engines",
+                        "data_anime", "data_2019"}
+
+    original_dir = artifact_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        artifact_cache.CACHE_DIR = directory
+        try:
+            source = os.path.join(directory, "source.csv")
+            output = os.path.join(directory, "output.png")
+            for path in (source, output):
+                with open(path, "w") as file:
+                    file.write("a")
+            current = pipeline.stage("test", print, (), [source], [output])
+            assert pipeline.is_stale(current, {})
+            state = {"test": pipeline.fingerprint(current)}
+            assert not pipeline.is_stale(current, state)
+            os.utime(source, ns=(0, 0))
+            assert not pipeline.is_stale(current, state)
+            with open(source, "w") as file:
+                file.write("b")
+            assert pipeline.is_stale(current, state)
+            state = {"test": pipeline.fingerprint(current)}
+            os.remove(output)
+            assert pipeline.is_stale(current, state)
+
+            # Editing a module the stage's code imports makes it stale too
+            with open(output, "w") as file:
+                file.write("a")
+            for name, code in [("stage_code", "import stage_helper\n"
+                                "def build():\n    pass\n"),
+                               ("stage_helper", "import os\n")]:
+                with open(os.path.join(directory, f"{name}.py"),
+                          "w") as file:
+                    file.write(code)
+            sys.path.insert(0, directory)
+            try:
+                import stage_code
+                imported = pipeline.stage("test", stage_code.build, (),
+                                          [source], [output])
+                wrapper = pipeline.stage(
+                    "wrapper", pipeline.runs("stage_helper")(lambda: None),
+                    (), [source], [output])
+                assert wrapper.code == ("stage_helper",)
+                state = {current.name: pipeline.fingerprint(current)
+                         for current in [imported, wrapper]}
+                with open(os.path.join(directory, "stage_helper.py"),
+                          "a") as file:
+                    file.write("SCALE = 2\n")
+                assert pipeline.is_stale(imported, state)
+                assert pipeline.is_stale(wrapper, state)
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop("stage_code", None)
+                sys.modules.pop("stage_helper", None)
+        finally:
+            artifact_cache.CACHE_DIR = original_dir
+
+    by_name = {current.name: current for current in stages}
+    assert by_name["rq3_genre_scores"].code == ("rq_three",)
+    assert "anime_cube.py" in {os.path.basename(path) for path in
+                               artifact_cache.code_dependencies(
+                                   pipeline.rq_three.__file__)}
+    forced = pipeline.forced_stages(stages, [])
+    assert "rq3_genre_scores" in forced and "data_2019" not in forced
+    assert pipeline.forced_stages(stages, ["data"]) == \
+        {"data_user_animelists", "data_anime", "data_users", "data_2019"}
+
+    print("Pipeline is generally valid")
+
+
+def test_depth_sweep():
+    """Tests that cutting off one full tree matches fitting every max_depth
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    Uses shallow trees of random continuous features, where no two splits
+        are equally good (sklearn breaks those ties randomly)
+    """
+
+    from sklearn.tree import DecisionTreeRegressor
+
+    random = np.random.default_rng(0)
+    features = pd.DataFrame(random.random((2000, 4)))
+    target = features[0] * 3 + np.sin(features[1] * 5) + \
+        random.normal(0, 0.1, 2000)
+    test_features = pd.DataFrame(random.random((300, 4)))
+
+    predictions = rq4.sweep_depths(features, target, test_features,
+                                   range(1, 5))
+    for depth in range(1, 5):
+        model = DecisionTreeRegressor(max_depth=depth)
+        model.fit(features, target)
+        assert np.allclose(predictions[depth], model.predict(test_features))
+
+    print("Depth Sweep is generally valid")
+
+
+def test_tree_rendering():
+    """Tests the layout, collapsing and exports of a drawn tree
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    from sklearn.tree import DecisionTreeRegressor
+
+    random = np.random.default_rng(0)
+    features = random.random((500, 3))
+    target = features[:, 0] * 3 + random.normal(0, 0.1, 500)
+    model = DecisionTreeRegressor(max_depth=4).fit(features, target)
+    names = ["a", "b", "c"]
+    tree = model.tree_
+
+    nodes = tree_rendering.layout(model)
+    assert len(nodes) == tree.node_count
+    assert nodes["leaves"].iloc[0] == tree.n_leaves
+    drawn_leaves = nodes[nodes["feature"] == -1]
+    assert list(drawn_leaves["position"]) == list(range(len(drawn_leaves)))
+    splits = nodes[nodes["feature"] != -1]
+    assert ((splits["position"] > 0) &
+            (splits["position"] < len(drawn_leaves) - 1)).all()
+
+    # Collapsed subtrees still stand for every leaf and sample
+    collapsed = tree_rendering.layout(model, 0.2)
+    assert len(collapsed) < len(nodes)
+    terminals = collapsed[collapsed["feature"] == -1]
+    assert terminals["leaves"].sum() == tree.n_leaves
+    assert terminals["samples"].sum() == 500
+    assert (terminals[terminals["leaves"] > 1]["samples"] < 100).all()
+
+    root = json.loads(tree_rendering.export_json(model, names))
+    assert root["samples"] == 500
+    assert root["feature"] == "a"
+    assert root["left"]["samples"] + root["right"]["samples"] == 500
+    text = tree_rendering.export_text(model, names, 0.2)
+    assert len(text.splitlines()) == len(collapsed)
+    assert text.startswith("|--- root: samples=500")
+    assert "leaves collapsed" in text
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tree.png")
+        tree_rendering.plot_tree(model, names, path)
+        assert os.path.getsize(path) > 0
+
+    print("Tree Rendering is generally valid")
+
+
+def test_synthetic_data():
+    """Tests that the synthetic datasets have the cleaned columns, fit
+    together and only depend on the seed
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        written = synthetic_data.generate(0.02, 3, directory)
+        files = {name: os.path.join(directory, os.path.basename(
+            data_loading.csv_path(name))) for name in written}
+        data = {name: pd.read_csv(path) for name, path in files.items()}
+        with open(files["anime"]) as file:
+            first_anime = file.read()
+        synthetic_data.generate(0.02, 3, directory, datasets=["anime"],
+                                overwrite=True)
+        with open(files["anime"]) as file:
+            assert file.read() == first_anime
+        try:
+            synthetic_data.generate(0.02, 3, directory, datasets=["anime"])
+            assert False
+        except FileExistsError:
+            pass
+
+    test_cleaned_data(data["anime"], data["users"], data["user_animelists"],
+                      data["anime_2019"])
+    assert {name: len(rows) for name, rows in data.items()} == written
+    anime, lists = data["anime"], data["user_animelists"]
+    assert lists["anime_id"].isin(anime["anime_id"]).all()
+    assert lists["username"].isin(data["users"]["username"]).all()
+    assert not lists.duplicated(["username", "anime_id"]).any()
+    assert not data["anime_2019"]["anime_id"].isin(anime["anime_id"]).any()
+    assert (data["users"]["age"] == 2020 - pd.to_datetime(
+        data["users"]["birth_date"]).dt.year).all()
+    assert lists[lists["my_status"] == 6]["my_score"].eq(0).all()
+    # Genres are multi-label and a few of them are in most anime
+    genres = anime["genre"].str.split(", ").explode().value_counts()
+    assert genres.index[0] == synthetic_data.GENRES[0]
+    assert genres.iloc[0] > 2 * genres.iloc[len(genres) // 2]
+    assert anime["score"].skew() < 0
+
+    for users in synthetic_data.iter_users(0.05):
+        assert len(users) <= synthetic_data.BLOCK_ROWS
+
+    print("Synthetic Data is generally valid")
+
+
+def test_benchmarks():
+    """Tests the selection, measurement and regression checks of the
+    benchmark suite
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    import benchmarks
+
+    cases = benchmarks.get_cases()
+    names = [current.name for current in cases]
+    assert len(names) == len(set(names))
+    assert {current.kind for current in cases} == \
+        {"import", "compute", "figure"}
+    assert "rq4_decision_tree" in names and "data_anime" not in names
+    selected = benchmarks.select(cases, ["rq1", "rq4_train_model"])
+    assert all(current.name.startswith("rq1_") or
+               current.name == "rq4_train_model" for current in selected)
+    assert {current.kind for current in benchmarks.select(
+        cases, ["compute"])} == {"compute"}
+    try:
+        benchmarks.select(cases, ["rq9"])
+        assert False
+    except ValueError:
+        pass
+
+    result = benchmarks.measure(sorted, (list(range(100000, 0, -1)),),
+                                repeats=2)
+    assert 0 < result["wall_s"] and 0 < result["cpu_s"]
+    assert result["peak_mb"] > 0.5
+
+    def row(commit, wall_s, peak_mb, machine="box", scale=1):
+        return {"commit": commit, "machine": machine, "case": "rq1_averages",
+                "scale": scale, "wall_s": wall_s, "cpu_s": wall_s,
+                "peak_mb": peak_mb}
+
+    history = [row("old", 1, 100), row("new", 2, 100), row("other", 9, 900,
+                                                           machine="laptop")]
+    results = [row("new", 1.2, 100), row("new", 1.2, 100, scale=10)]
+    comparison = benchmarks.compare(results, history, "new", "box")
+    assert comparison["baseline"].iloc[0] == "old"
+    assert comparison["baseline"].isna().iloc[1]
+    assert abs(comparison["wall_change"].iloc[0] - 0.2) < 1e-9
+    assert not comparison["regressed"].any()
+    assert benchmarks.compare(results, history, "new", "box",
+                              threshold=0.1)["regressed"].tolist() == \
+        [True, False]
+    # Tiny slowdowns are noise and growing memory is a regression too
+    assert not benchmarks.compare([row("new", 0.02, 100)], [row("old", 0.01,
+                                  100)], "new", "box")["regressed"].any()
+    assert benchmarks.compare([row("new", 1, 200)], history, "new", "box",
+                              baseline="old")["regressed"].all()
+
+    print("Benchmarks are generally valid")
+
+
+def test_tracing():
+    """Tests that traced spans nest, measure and save correctly, and that
+    nothing is recorded while tracing is off
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    data = pd.DataFrame({"value": range(1000)})
+    traced_sum = tracing.traced("compute", "sum")(
+        lambda frame: frame["value"].sum())
+    assert not tracing.enabled()
+    assert traced_sum(data) == 499500
+    assert tracing.collect() == []
+
+    tracing.enable()
+    try:
+        with tracing.span("outer", "render") as outer:
+            assert traced_sum(data) == 499500
+            with tracing.span("inner", "load"):
+                tracing.count(10)
+                tracing.count(5)
+                memory = [0] * 500000
+            outer.rows = len(memory)
+        events = tracing.collect()
+        assert tracing.collect() == []
+    finally:
+        tracing.disable()
+    assert not tracing.enabled()
+    assert traced_sum(data) == 499500
+
+    by_name = {event["name"]: event for event in events}
+    assert [event["name"] for event in events] == ["sum", "inner", "outer"]
+    assert by_name["sum"]["cat"] == "compute"
+    assert by_name["sum"]["args"]["rows"] == 1000
+    assert by_name["inner"]["args"]["rows"] == 15
+    assert by_name["outer"]["args"]["rows"] == 500000
+    # The list is about 4 MB and the outer span has to see its peak too
+    assert by_name["inner"]["args"]["peak_mb"] > 3
+    assert by_name["outer"]["args"]["peak_mb"] >= \
+        by_name["inner"]["args"]["peak_mb"]
+    outer = by_name["outer"]
+    assert outer["ts"] <= by_name["sum"]["ts"] and \
+        by_name["inner"]["ts"] + by_name["inner"]["dur"] <= \
+        outer["ts"] + outer["dur"]
+    assert abs(outer["args"]["self_s"] - (outer["dur"] - by_name["sum"]["dur"]
+               - by_name["inner"]["dur"]) / 1e6) < 1e-3
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        summary = tracing.save(path, events)
+        with open(path) as file:
+            assert json.load(file)["traceEvents"] == events
+        with open(os.path.join(directory, "trace.txt")) as file:
+            assert file.read() == summary
+    by_category, by_name = tracing.summarize(events)
+    assert set(by_category.index) == {"compute", "load", "render"}
+    assert by_name["calls"].sum() == 3
+
+    print("Tracing is generally valid")
+
+
+def test_lazy_imports():
+    """Tests that the analysis modules (and these tests) can be imported
+    without importing the plotting and learning libraries
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    import benchmarks
+
+    for module in ["rq_one", "rq_two", "rq_three", "rq_four", "pipeline",
+                   "analysis", "tests"]:
+        imported = benchmarks.import_module(module)["module"]
+        assert module in set(imported)
+        assert not imported.str.match(
+            r"(matplotlib|seaborn|sklearn|jikanpy)(\.|$)").any()
+
+    print("Lazy Imports are generally valid")
+
+
+def test_analysis():
+    """Tests that the compute functions give tidy results that can be saved
+    as JSON and match what is plotted
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    analyses = analysis.get_analyses(2020)
+    names = [current.name for current in analyses]
+    assert len(names) == len(set(names))
+    assert {name.split("_")[0] for name in names} == \
+        {"rq1", "rq2", "rq3", "rq4"}
+    assert "rq2_genre_counts2020" in names
+    try:
+        analysis.run("rq9_nothing")
+        assert False
+    except ValueError:
+        pass
+
+    anime = synthetic_data.make_anime(0.02, 1)
+    for current in analyses:
+        if current.datasets == ("anime",):
+            records = analysis.run(current.name, {"anime": anime})
+            assert json.loads(json.dumps(records)) == records
+            assert "index" not in records[0]
+
+    genres = anime["genre"].str.split(", ").explode()
+    counts = analysis.run("rq2_genre_counts", {"anime": anime})
+    assert {row["genre"]: row["count"] for row in counts} == \
+        genres.value_counts().to_dict()
+    assert [row["count"] for row in counts] == \
+        sorted((row["count"] for row in counts), reverse=True)
+    yearly = rq2.genre_counts_yearly(anime)
+    assert yearly["genre"].nunique() == 15
+    top = genres.value_counts().index[:15]
+    # Anime from 2018 on are left out of the yearly counts
+    before = genres[(anime["aired_from_year"] < 2018).reindex(genres.index)]
+    assert yearly.groupby("genre")["count"].sum().to_dict() == \
+        before[before.isin(top)].value_counts().to_dict()
+
+    assert analysis.to_records(pd.Series([1, 2], index=pd.Index(
+        ["a", "b"], name="genre"), name="count")) == \
+        [{"genre": "a", "count": 1}, {"genre": "b", "count": 2}]
+    assert analysis.to_records({"male": {"age": np.float32(20.5)},
+                                "top": pd.Index(["a"])}) == \
+        {"male": {"age": 20.5}, "top": ["a"]}
+
+    print("Analysis is generally valid")
+
+
+def test_rolling_folds():
+    """Tests that every rolling origin fold trains only on earlier years
+    (never testing on 2018) and that saved cells of other feature encoding
+    code are not reused
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    import tree_tuning
+    from sklearn.tree import DecisionTreeRegressor
+
+    data = pd.DataFrame({"aired_from_year": [2000, 2001, 2001, 2002, 2003,
+                                             2003, 2004]})
+    folds = tree_tuning.rolling_folds(data, n_folds=2, min_train_years=1)
+    assert [year for year, _, _ in folds] == [2003, 2004]
+    year, train, test = folds[0]
+    assert list(train) == [0, 1, 2, 3] and list(test) == [4, 5]
+    folds = tree_tuning.rolling_folds(data, n_folds=10, min_train_years=3)
+    assert [year for year, _, _ in folds] == [2003, 2004]
+
+    # 2018 was scraped partway through, so it is never a test year
+    data = pd.DataFrame({"aired_from_year": range(2000, 2019)})
+    folds = tree_tuning.rolling_folds(data, n_folds=3)
+    assert [year for year, _, _ in folds] == [2015, 2016, 2017]
+    assert 18 not in folds[-1][1]
+
+    anime = synthetic_data.make_anime(0.02, 1)
+    grid = {"max_depth": [3]}
+    original_dir = tree_tuning.TUNING_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        tree_tuning.TUNING_DIR = directory
+        try:
+            # Cells of other feature encoding code are never reused
+            params = json.dumps(DecisionTreeRegressor(max_depth=3)
+                                .get_params(), sort_keys=True)
+            stale = row_journal.Journal(os.path.join(directory,
+                                                     "results.jsonl"))
+            for year, _, _ in tree_tuning.rolling_folds(anime, 2):
+                stale.append({"data": artifact_cache.frame_hash(anime),
+                              "code": "old", "target": "score",
+                              "params": params, "year": year, "mae": -1.0,
+                              "mse": -1.0})
+            report = tree_tuning.cross_validate(anime, grid, n_folds=2)
+            folds = os.listdir(os.path.join(directory, "folds"))
+        finally:
+            tree_tuning.TUNING_DIR = original_dir
+    assert report["mae_mean"].iloc[0] > 0
+    assert all(tree_tuning.encoding_version()[:16] in name for name in folds)
+
+    print("Rolling Folds are generally valid")
+
+
+def test_permutation_importance():
+    """Tests that features are shuffled as whole groups and that a model
+    only loses accuracy when a feature it uses is shuffled
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    from sklearn.tree import DecisionTreeRegressor
+
+    columns = ["episodes", "duration_min", "type_TV", "type_Movie",
+               "genre_Action", "genre_Slice of Life", "studio_Madhouse"]
+    groups = rq4.feature_groups(pd.Index(columns))
+    assert groups == {"episodes": [0], "duration_min": [1], "type": [2, 3],
+                      "genre": [4, 5], "studio": [6]}
+
+    random = np.random.default_rng(0)
+    features = random.integers(0, 2, (500, len(columns)))
+    target = features[:, 0] * 5.0
+    model = DecisionTreeRegressor(max_depth=3).fit(features, target)
+    importance = rq4.permutation_importance(model, features, columns,
+                                            target, repeats=10)
+    summary = rq4.summarize_importance(importance)
+    mae = summary.xs("Mean Absolute Error", level="error_type")
+    assert mae.loc["episodes", "low"] > 1
+    assert (mae.drop(index="episodes")["mean"] == 0).all()
+    assert len(importance) == 10 * 2 * len(groups)
+
+    print("Permutation Importance is generally valid")
+
+
+def test_feature_encoder():
+    """Tests that the fitted encoder gives new anime the training columns
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    train = pd.DataFrame({
+        "type": ["TV", "Movie"], "episodes": [12, 1],
+        "duration_min": [24.0, 90.0], "source": ["Manga", "Original"],
+        "genre": ["Action, Comedy", "Drama"], "studio": ["Bones", "Madhouse"]
+    })
+    new = pd.DataFrame({
+        "type": ["Web"], "episodes": [6], "duration_min": [5.0],
+        "source": ["Manga"], "genre": ["Comedy, Horror"], "studio": ["Bones"]
+    })
+    encoder = feature_encoding.FeatureEncoder().fit(train)
+    assert encoder.feature_names == [
+        "episodes", "duration_min", "studio_Bones", "studio_Madhouse",
+        "genre_Action", "genre_Comedy", "genre_Drama", "type_Movie",
+        "type_TV", "source_Manga", "source_Original"]
+    assert list(encoder.transform_frame(train).columns) == \
+        list(train.drop(columns=["genre", "studio"])
+             .join(train["studio"].str.get_dummies(", ").add_prefix("studio_"))
+             .join(train["genre"].str.get_dummies(", ").add_prefix("genre_"))
+             .pipe(pd.get_dummies).columns)
+
+    features = encoder.transform(new)
+    assert features.shape == (1, 11)
+    assert features.toarray().tolist() == \
+        [[6, 5, 1, 0, 0, 1, 0, 0, 0, 1, 0]]
+    assert encoder.unseen_labels == {"genre": ["Horror"], "type": ["Web"]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "encoder.json")
+        encoder.save(path)
+        loaded = feature_encoding.FeatureEncoder.load(path)
+        assert (loaded.transform(new) != features).nnz == 0
+
+    strict = feature_encoding.FeatureEncoder(unseen="error").fit(train)
+    try:
+        strict.transform(new)
+        assert False, "Unseen labels should raise an error"
+    except ValueError:
+        pass
+
+    print("Feature Encoder is generally valid")
+
+
+def test_scoring():
+    """Tests that exported trees score anime like the trained models
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    random = np.random.default_rng(0)
+    anime = pd.DataFrame({
+        "type": random.choice(["TV", "Movie", "OVA"], 300),
+        "episodes": random.integers(1, 50, 300),
+        "duration_min": random.integers(1, 120, 300).astype("float64"),
+        "source": random.choice(["Manga", "Original"], 300),
+        "genre": random.choice(["Action", "Action, Comedy", "Drama"], 300),
+        "studio": random.choice(["Bones", "Madhouse, Bones", "Sunrise"], 300),
+        "score": random.uniform(1, 10, 300),
+        "favorites": random.integers(0, 1000, 300)
+    })
+    new = anime.head(50).assign(studio="Unknown Studio, Bones")
+
+    original_dir = artifact_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        artifact_cache.CACHE_DIR = directory
+        try:
+            rq4.export_models(anime, directory, max_depth=5)
+            path = os.path.join(directory, "new.csv")
+            new.to_csv(path, index=False)
+            predictions = scoring.score(path, directory)
+            features = rq4.get_features(new, encoder=rq4.get_encoder(anime))
+            score_model, favorites_model = rq4.train_model(anime, 5)
+        finally:
+            artifact_cache.CACHE_DIR = original_dir
+    assert (predictions["score"] == score_model.predict(features)).all()
+    assert (predictions["favorites"] ==
+            favorites_model.predict(features)).all()
+
+    print("Scoring is generally valid")
+
+
+def test_engines():
+    """Tests that every engine trains a score and a favorites model
+
+    Notes
+    -----
+    Throws an Assertion Error if any of the testing fails
+    Prints a success message if the tests pass
+    """
+
+    random = np.random.default_rng(0)
+    anime = pd.DataFrame({
+        "type": random.choice(["TV", "Movie", "OVA"], 300),
+        "episodes": random.integers(1, 50, 300),
+        "duration_min": random.integers(1, 120, 300).astype("float64"),
+        "source": random.choice(["Manga", "Original"], 300),
+        "genre": random.choice(["Action", "Action, Comedy", "Drama"], 300),
+        "studio": random.choice(["Bones", "Madhouse, Bones", "Sunrise"], 300),
+        "score": random.uniform(1, 10, 300),
+        "favorites": random.integers(0, 1000, 300)
+    })
+    anime["favorites"] += (anime["type"] == "TV") * 5000
+
+    original_dir = artifact_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        artifact_cache.CACHE_DIR = directory
+        try:
+            features = rq4.get_features(anime)
+            for engine in rq4.ENGINES:
+                models = rq4.train_model(anime, 5, engine=engine)
+                assert len(models) == 2
+                for model in models:
+                    assert model.predict(features).shape == (300,)
+                # Favorites aren't shrunk down to the scale of scores
+                favorites = models[1].predict(features)
+                assert favorites[anime["type"] == "TV"].mean() > 4000
+            report = rq4.compare_engines(anime.iloc[:250], anime.iloc[250:],
+                                         max_depth=3, n_jobs=2)
+            # Gradient boosting only densifies its most common columns
+            model = rq4.make_estimator("hgb", 3, n_features=features.shape[1])
+            model.set_params(selectkbest__k=4)
+            model.fit(features, anime["score"])
+            assert model[:-1].transform(features).shape == (300, 4)
+            assert list(model[0].get_support(indices=True)[:2]) == [0, 1]
+        finally:
+            artifact_cache.CACHE_DIR = original_dir
+    forest = rq4.make_estimator("forest", n_jobs=3).regressor
+    assert forest.n_jobs == 3
+    assert rq4.make_estimator("forest").regressor.n_jobs == 1
+    assert list(report.index) == rq4.ENGINES
+    assert (report["fit_s"] > 0).all()
+    assert report.notna().all().all()
+    try:
+        rq4.make_estimator("boosted forest")
+        assert False
+    except ValueError:
+        pass
+
+    print("Engines are generally valid")
+
+
 def main():
     """Runs all tests
 
@@ -197,10 +1363,33 @@ def main():
     -----
     Throws an error if any tests are failed
     """
-    anime = pd.read_csv("data/animelist_cleaned.csv")
-    anime_2019 = pd.read_csv("data/animelist_2019.csv")
-    users = pd.read_csv("data/userlist_cleaned.csv")
-    lists = pd.read_csv("data/user_animelists_cleaned.csv")
+    test_clean_user_animelists()
+    test_columnar_writer()
+    test_jikan_fetching()
+    test_jikan_caching()
+    test_season_data()
+    test_artifact_cache()
+    test_pipeline()
+    test_feature_encoder()
+    test_depth_sweep()
+    test_permutation_importance()
+    test_scoring()
+    test_engines()
+    test_tree_rendering()
+    test_synthetic_data()
+    test_benchmarks()
+    test_tracing()
+    test_lazy_imports()
+    test_analysis()
+    test_missing_labels()
+    test_anime_cube()
+    test_cube_updates()
+    test_rolling_folds()
+
+    anime = data_loading.load("anime")
+    anime_2019 = data_loading.load("anime_2019")
+    users = data_loading.load("users")
+    lists = data_loading.load("user_animelists")
 
     test_cleaned_data(anime, users, lists, anime_2019)
 
@@ -210,6 +1399,7 @@ def main():
 
     test_genre_calculations(anime_small, anime_2019_small)
     test_studio_calculations(anime_small)
+    test_label_index(anime_small)
     test_user_calculations(users_small)
 
 
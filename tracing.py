@@ -0,0 +1,331 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that traces where the time of a run of my Final Project goes. Once
+tracing is enabled, every decorated function (and every span) records its
+wall time, CPU time, peak traced memory and the rows it worked on, so a long
+run can be broken down into loading, computing, rendering and saving. The
+trace is saved as Chrome trace JSON (open it in https://ui.perfetto.dev or
+chrome://tracing) with a plain text summary next to it.
+
+Tracing is off unless enable is called (ex: data_analyzing.py --trace), and
+then decorated functions only cost one extra check per call.
+"""
+
+import os
+import json
+import threading
+import functools
+import tracemalloc
+from time import perf_counter, process_time
+import pandas as pd
+
+CATEGORIES = ["stage", "load", "clean", "compute", "render", "save"]
+
+# The recorded events of this process, or None while tracing is off
+_events = None
+_settings = {}
+_stack = []
+
+
+class Span:
+    """A traced piece of work that is still running
+
+    Parameters
+    ----------
+    name : String
+        What the work is (ex: "rq_one.average_by_gender")
+    category : String
+        The kind of work (ex: "compute", see CATEGORIES)
+    rows : Integer
+        The rows the work is on (can be set or counted while it runs)
+    **args
+        Extra details saved with the event (ex: a file path)
+    """
+
+    def __init__(self, name, category, rows=None, **args):
+        self.name = name
+        self.category = category
+        self.rows = rows
+        self.args = args
+
+    def __enter__(self):
+        if _events is None:
+            return self
+        if _settings["memory"]:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for this span, so the parent keeps its own
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        self.children = 0
+        _stack.append(self)
+        self.start = perf_counter()
+        self.cpu = process_time()
+        return self
+
+    def __exit__(self, *exception):
+        if _events is None or not _stack or _stack[-1] is not self:
+            return
+        wall = perf_counter() - self.start
+        cpu = process_time() - self.cpu
+        _stack.pop()
+        args = dict(self.args, cpu_s=round(cpu, 6),
+                    self_s=round(wall - self.children, 6))
+        if _settings["memory"]:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            args["peak_mb"] = round((self.peak - self.base) / 1024 ** 2, 3)
+        if self.rows is not None:
+            args["rows"] = int(self.rows)
+        if _stack:
+            _stack[-1].children += wall
+            if _settings["memory"]:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        _events.append({"name": self.name, "cat": self.category, "ph": "X",
+                        "ts": round(self.start * 1e6, 3),
+                        "dur": round(wall * 1e6, 3), "pid": os.getpid(),
+                        "tid": threading.get_native_id(), "args": args})
+
+
+def enable(memory=True):
+    """Starts recording spans (and forgets earlier ones)
+
+    Parameters
+    ----------
+    memory : Boolean
+        Whether to trace memory. Gives every span its peak memory, but makes
+        the traced code run noticeably slower
+    """
+
+    global _events
+    _events = []
+    _stack.clear()
+    _settings["memory"] = memory
+    _settings["owns_tracemalloc"] = memory and not tracemalloc.is_tracing()
+    if _settings["owns_tracemalloc"]:
+        tracemalloc.start()
+
+
+def disable():
+    """Stops recording spans"""
+
+    global _events
+    if _events is not None and _settings["owns_tracemalloc"]:
+        tracemalloc.stop()
+    _events = None
+    _stack.clear()
+
+
+def enabled():
+    """Returns whether spans are being recorded"""
+
+    return _events is not None
+
+
+def span(name, category="compute", rows=None, **args):
+    """Returns a context manager that traces the code inside of it
+
+    Parameters
+    ----------
+    name : String
+        What the work is
+    category : String
+        The kind of work (see CATEGORIES)
+    rows : Integer
+        The rows the work is on (or set it on the span while it runs)
+    **args
+        Extra details saved with the event
+
+    Returns
+    -------
+    Span
+        Returns the span. It does nothing if tracing is off
+
+    Example: with tracing.span("read_csv", "load") as current: ...
+    """
+
+    return Span(name, category, rows, **args)
+
+
+def count(rows):
+    """Adds rows to the innermost running span (for streamed work)"""
+
+    if _stack:
+        _stack[-1].rows = (_stack[-1].rows or 0) + rows
+
+
+def _rows(values):
+    """Returns the most rows of the tables (DataFrames, arrays, ...) given"""
+
+    rows = [value.shape[0] for value in values
+            if isinstance(getattr(value, "shape", None), tuple) and
+            value.shape]
+    return max(rows) if rows else None
+
+
+def traced(category="compute", name=None):
+    """Returns a decorator that traces every call of a function
+
+    Parameters
+    ----------
+    category : String
+        The kind of work the function does (see CATEGORIES)
+    name : String
+        The name of its spans. Defaults to "module.function"
+
+    Returns
+    -------
+    Function
+        Returns the decorator
+
+    Notes
+    -----
+    A span's rows are the most rows of the function's table arguments, or
+        of what it returns if it has no table arguments
+    """
+
+    def decorate(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return func(*args, **kwargs)
+            with Span(label, category,
+                      _rows([*args, *kwargs.values()])) as current:
+                result = func(*args, **kwargs)
+                if current.rows is None:
+                    current.rows = _rows([result])
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def settings():
+    """Returns what worker processes need to trace like this one (None if
+    tracing is off)
+    """
+
+    return {"memory": _settings["memory"]} if _events is not None else None
+
+
+def init_worker(worker_settings):
+    """Starts tracing in a worker process if its parent is tracing
+
+    Parameters
+    ----------
+    worker_settings : Dictionary
+        The parent's settings (see settings), or None
+    """
+
+    if worker_settings is not None:
+        enable(**worker_settings)
+    elif _events is not None:
+        # A forked worker of a parent that stopped tracing
+        disable()
+
+
+def collect():
+    """Returns the events recorded in this process and forgets them"""
+
+    if _events is None:
+        return []
+    events = list(_events)
+    _events.clear()
+    return events
+
+
+def call(func, *args, **kwargs):
+    """Runs a function in a worker process and returns its result together
+    with the events it recorded (see merge)
+    """
+
+    return func(*args, **kwargs), collect()
+
+
+def merge(result):
+    """Adds the events of a worker's call to this process' and returns the
+    call's result
+    """
+
+    value, events = result
+    if _events is not None:
+        _events.extend(events)
+    return value
+
+
+def summarize(events):
+    """Sums up traced events
+
+    Parameters
+    ----------
+    events : List
+        Chrome trace events (see Span)
+
+    Returns
+    -------
+    Tuple
+        Returns a DataFrame per category and a DataFrame per span name with
+        the amount of calls, total wall, self (not in a child span) and CPU
+        seconds, the largest peak memory and the total rows. Both are sorted
+        by self time
+    """
+
+    columns = ["name", "category", "calls", "wall_s", "self_s", "cpu_s",
+               "peak_mb", "rows"]
+    spans = pd.DataFrame([{
+        "name": event["name"], "category": event["cat"], "calls": 1,
+        "wall_s": event["dur"] / 1e6, "self_s": event["args"]["self_s"],
+        "cpu_s": event["args"]["cpu_s"],
+        "peak_mb": event["args"].get("peak_mb"),
+        "rows": event["args"].get("rows")
+    } for event in events], columns=columns)
+    aggregations = {"calls": "sum", "wall_s": "sum", "self_s": "sum",
+                    "cpu_s": "sum", "peak_mb": "max", "rows": "sum"}
+    spans["rows"] = spans["rows"].astype("Int64")
+    by_name = spans.groupby(["name", "category"]).agg(aggregations)
+    by_category = spans.groupby("category").agg(aggregations)
+    return (by_category.sort_values("self_s", ascending=False),
+            by_name.sort_values("self_s", ascending=False).reset_index())
+
+
+def save(path="trace.json", events=None):
+    """Saves the trace and its plain text summary
+
+    Parameters
+    ----------
+    path : String
+        Where to save the Chrome trace JSON. The summary is saved next to it
+        with a .txt extension
+    events : List
+        The events to save. Defaults to the ones recorded in this process
+
+    Returns
+    -------
+    String
+        Returns the summary
+
+    Notes
+    -----
+    File Path: {path} and {path without extension}.txt
+    """
+
+    events = collect() if events is None else events
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    by_category, by_name = summarize(events)
+    processes = len({event["pid"] for event in events})
+    summary = f"{len(events)} spans in {processes} processes\n\n" + \
+        "By category (self time is time not spent in a child span)\n" + \
+        by_category.to_string(float_format="{:.3f}".format) + \
+        "\n\nBy span\n" + \
+        by_name.to_string(index=False, float_format="{:.3f}".format) + "\n"
+    with open(os.path.splitext(path)[0] + ".txt", "w") as file:
+        file.write(summary)
+    return summary
@@ -0,0 +1,257 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that draws and exports fitted decision trees without Graphviz. The
+tree is laid out in Python (leaves top to bottom, every split halfway between
+its children, depth left to right) and drawn with Matplotlib. Subtrees with
+too few anime are collapsed into one box, and trees can be exported as JSON
+or indented text to compare two trees with a diff.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import tracing
+
+
+def layout(tree, min_samples=0):
+    """Lays out the nodes of a fitted tree that are drawn
+
+    Parameters
+    ----------
+    tree : Tree
+        A fitted scikit-learn tree (the tree_ of a DecisionTreeRegressor) or
+        a model that has one
+    min_samples : Integer or Float
+        Subtrees whose root has fewer training samples than this are
+        collapsed into one node. A float is a fraction of all samples (like
+        scikit-learn's min_samples_split)
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per drawn node in depth first order (left child
+        first) with the node id, its parent (-1 for the root), depth,
+        position (leaves are 0, 1, 2, ... top to bottom), samples, value,
+        feature index (-1 for drawn leaves), threshold and the amount of
+        leaves it stands for (more than 1 if it is collapsed)
+    """
+
+    tree = getattr(tree, "tree_", tree)
+    children_left = tree.children_left
+    children_right = tree.children_right
+    samples = tree.n_node_samples
+    if isinstance(min_samples, float):
+        min_samples = min_samples * samples[0]
+
+    # Children always have larger ids than their parent
+    leaves = (children_left == -1).astype("int64")
+    for node in range(tree.node_count - 1, -1, -1):
+        if children_left[node] != -1:
+            leaves[node] = leaves[children_left[node]] + \
+                leaves[children_right[node]]
+
+    rows = []
+    stack = [(0, -1, 0)]
+    while stack:
+        node, parent, depth = stack.pop()
+        split = children_left[node] != -1 and \
+            (node == 0 or samples[node] >= min_samples)
+        rows.append((node, parent, depth, split))
+        if split:
+            stack.append((children_right[node], node, depth + 1))
+            stack.append((children_left[node], node, depth + 1))
+
+    nodes = pd.DataFrame(rows, columns=["node", "parent", "depth", "split"])
+    ids = nodes["node"].to_numpy()
+    split = nodes["split"].to_numpy()
+    nodes["samples"] = samples[ids]
+    nodes["value"] = tree.value[ids, 0, 0]
+    nodes["feature"] = np.where(split, tree.feature[ids], -1)
+    nodes["threshold"] = np.where(split, tree.threshold[ids], np.nan)
+    nodes["leaves"] = leaves[ids]
+
+    # Drawn leaves are numbered in order, splits sit between their children
+    position = np.zeros(len(nodes))
+    position[~split] = np.arange((~split).sum())
+    row_of = dict(zip(ids, range(len(ids))))
+    for row in range(len(nodes) - 1, -1, -1):
+        if split[row]:
+            position[row] = (
+                position[row_of[children_left[ids[row]]]] +
+                position[row_of[children_right[ids[row]]]]) / 2
+    nodes["position"] = position
+    return nodes.drop(columns="split")
+
+
+def _label(row, feature_names, total):
+    """Returns the text in the box of a drawn node"""
+
+    summary = f"{row.samples / total:.1%} | {row.value:.2f}"
+    if row.feature >= 0:
+        return f"{feature_names[row.feature]} <= {row.threshold:.2f}\n" + \
+            summary
+    if row.leaves > 1:
+        return f"{row.leaves} leaves\n{summary}"
+    return summary
+
+
+def plot_tree(tree, feature_names, path, min_samples=0.01, title=None):
+    """Draws a fitted tree and saves it as an image
+
+    Parameters
+    ----------
+    tree : Tree
+        A fitted scikit-learn tree or a model that has one
+    feature_names : List
+        The names of the features the tree was fit on
+    path : String
+        Where to save the image
+    min_samples : Integer or Float
+        Subtrees smaller than this are drawn as one box (see layout)
+    title : String
+        The title of the plot
+
+    Notes
+    -----
+    Visualization Type: Decision Tree Plot
+    Splits are read left to right: the upper branch of a split is where its
+        condition is true. Every box shows its share of the samples and its
+        predicted value, and is shaded by that value
+    """
+
+    # Only drawing needs Matplotlib, exporting doesn't
+    from matplotlib import colormaps, rc_context
+    from matplotlib.figure import Figure
+    from matplotlib.collections import LineCollection
+
+    nodes = layout(tree, min_samples)
+    total = nodes["samples"].iloc[0]
+    terminals = int(nodes["position"].max()) + 1
+    depth = int(nodes["depth"].max())
+
+    # A plain Figure skips pyplot's figure manager (and closing it)
+    fig = Figure(figsize=(2 * (depth + 1), max(3, 0.3 * (terminals + 1))))
+    ax = fig.add_axes([0, 0, 1, 1])
+    x = nodes["depth"].to_numpy() * 1.0
+    y = nodes["position"].to_numpy()
+    row_of = dict(zip(nodes["node"], range(len(nodes))))
+    parents = np.array([row_of.get(parent, 0) for parent in nodes["parent"]])
+    has_parent = nodes["parent"].to_numpy() != -1
+    elbow_x = x[parents] + 0.5
+    segments = np.stack([
+        np.column_stack([x[parents], y[parents]]),
+        np.column_stack([elbow_x, y[parents]]),
+        np.column_stack([elbow_x, y]),
+        np.column_stack([x, y])
+    ], axis=1)[has_parent]
+    ax.add_collection(LineCollection(segments, colors="0.5", linewidths=0.8))
+
+    values = nodes["value"]
+    span = values.max() - values.min()
+    shades = (values - values.min()) / span if span else values * 0
+    colors = colormaps["Oranges"](0.1 + 0.6 * shades.to_numpy())
+    for row, color in zip(nodes.itertuples(), colors):
+        ax.text(row.depth, row.position,
+                _label(row, feature_names, total), ha="center", va="center",
+                fontsize=7, bbox={"boxstyle": "round", "facecolor": color,
+                                  "edgecolor": "0.3"})
+
+    # The title gets a row of its own above the top leaf
+    top = -0.5
+    if title:
+        top = -1.5
+        ax.text(depth / 2, -1, title, ha="center", va="center", fontsize=12)
+    ax.set_xlim(-0.5, depth + 0.5)
+    ax.set_ylim(terminals - 0.5, top)
+    ax.axis("off")
+    # The limits already fit the boxes, so a "tight" bbox (a second draw)
+    # isn't needed. Drawing the glyphs without hinting and barely compressing
+    # the (mostly blank) image make big trees render much faster
+    with rc_context({"text.hinting": "no_hinting"}), \
+            tracing.span("savefig", "save", path=path):
+        fig.savefig(path, pil_kwargs={"compress_level": 1})
+
+
+def to_dict(tree, feature_names, min_samples=0):
+    """Returns a fitted tree as nested dictionaries
+
+    Parameters
+    ----------
+    tree : Tree
+        A fitted scikit-learn tree or a model that has one
+    feature_names : List
+        The names of the features the tree was fit on
+    min_samples : Integer or Float
+        Subtrees smaller than this are collapsed (see layout)
+
+    Returns
+    -------
+    Dictionary
+        Returns the root node. Every node has its samples and value, splits
+        have their feature, threshold and left (condition true) and right
+        children, and collapsed subtrees have their amount of leaves
+    """
+
+    nodes = layout(tree, min_samples)
+    converted = {}
+    for row in reversed(list(nodes.itertuples())):
+        node = {"samples": int(row.samples), "value": round(row.value, 6)}
+        if row.feature >= 0:
+            node["feature"] = feature_names[row.feature]
+            node["threshold"] = round(row.threshold, 6)
+        elif row.leaves > 1:
+            node["leaves"] = int(row.leaves)
+        converted[row.node] = node
+    # Children come after their parent, so they are all converted already
+    for row in nodes.itertuples():
+        if row.parent != -1:
+            parent = converted[row.parent]
+            parent["right" if "left" in parent else "left"] = \
+                converted[row.node]
+    return converted[nodes["node"].iloc[0]]
+
+
+def export_json(tree, feature_names, min_samples=0):
+    """Returns a fitted tree as indented JSON (see to_dict)"""
+
+    return json.dumps(to_dict(tree, feature_names, min_samples), indent=2)
+
+
+def export_text(tree, feature_names, min_samples=0):
+    """Returns a fitted tree as indented text
+
+    Parameters
+    ----------
+    tree : Tree
+        A fitted scikit-learn tree or a model that has one
+    feature_names : List
+        The names of the features the tree was fit on
+    min_samples : Integer or Float
+        Subtrees smaller than this are collapsed (see layout)
+
+    Returns
+    -------
+    String
+        Returns a line per node with the condition that leads to it, its
+        samples and value (ex: "|   |--- episodes > 12.50: samples=120
+        value=6.830")
+    """
+
+    lines = []
+
+    def write(node, depth, condition):
+        line = f"{'|   ' * depth}|--- {condition}: " + \
+            f"samples={node['samples']} value={node['value']:.3f}"
+        if "leaves" in node:
+            line += f" ({node['leaves']} leaves collapsed)"
+        lines.append(line)
+        if "feature" in node:
+            split = f"{node['feature']} <= {node['threshold']:.2f}"
+            write(node["left"], depth + 1, split)
+            write(node["right"], depth + 1, split.replace("<=", ">"))
+
+    write(to_dict(tree, feature_names, min_samples), 0, "root")
+    return "\n".join(lines) + "\n"
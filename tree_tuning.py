@@ -0,0 +1,286 @@
+"""
+KV Le
+CSE 163 AG
+Final Project
+
+A script that cross validates the decision tree settings of my fourth
+research question over time. Anime are split into rolling origin folds by the
+year they aired (train on every year before, test on the next), and every
+setting of a grid is scored on every fold on a pool of processes. Finished
+cells are saved as they come in, so a grid can be resumed or extended later.
+
+Example: python tree_tuning.py --workers 4
+"""
+
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.metrics import mean_squared_error, mean_absolute_error
+import artifact_cache
+import data_loading
+import row_journal
+import rq_four
+
+TUNING_DIR = "data/tuning"
+GRID = {
+    "max_depth": [3, 5, 7, 9, 11, 15, 20, None],
+    "min_samples_leaf": [1, 5, 20]
+}
+SPARSE_ARRAYS = ["data", "indices", "indptr", "shape"]
+_folds = {}
+
+
+def rolling_folds(data, n_folds=5, min_train_years=10, last_year=2017):
+    """Splits anime into rolling origin folds by the year they aired
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    n_folds : Integer
+        The amount of folds. The last n_folds years up to last_year are the
+        test years
+    min_train_years : Integer
+        The least amount of years any fold trains on
+    last_year : Integer
+        The last year that can be tested on. Defaults to 2017 since the data
+        was scraped during 2018, so 2018 is incomplete (like in rq_two and
+        rq_three)
+
+    Returns
+    -------
+    List
+        Returns (test year, train index, test index) tuples. Every fold
+        trains on all anime that aired before its test year
+    """
+
+    years = np.sort(data["aired_from_year"].dropna().unique())
+    years = years[years <= last_year]
+    test_years = years[max(min_train_years, len(years) - n_folds):]
+    return [(int(year), data.index[data["aired_from_year"] < year],
+             data.index[data["aired_from_year"] == year])
+            for year in test_years]
+
+
+def encoding_version():
+    """Returns a hash of the code that encodes the features of the folds
+
+    Returns
+    -------
+    String
+        Returns the hex digest of rq_four and every module it imports (ex:
+        feature_encoding and label_index, see artifact_cache.code_version)
+    """
+
+    return artifact_cache.code_version(rq_four.get_features)
+
+
+def save_folds(data, target="score", n_folds=5):
+    """Builds the features of every fold once and saves them as NumPy files
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    target : String
+        The column the models predict
+    n_folds : Integer
+        The amount of folds (see rolling_folds)
+
+    Returns
+    -------
+    Dictionary
+        Returns test year to a dictionary of the file paths of the train/test
+        feature arrays and targets
+
+    Notes
+    -----
+    File Path: data/tuning/folds/{data hash}_{code hash}_{year}_{part}.npy
+        (see encoding_version), so changing the data or how the features are
+        encoded never reuses old folds
+    The features are saved as the data/indices/indptr/shape arrays of their
+        sparse matrices
+    The feature encoder is only fit on the training years (like a model
+        trained before its test year would see)
+    Existing files are reused
+    """
+
+    key = f"{artifact_cache.frame_hash(data)[:16]}_{encoding_version()[:16]}"
+    directory = os.path.join(TUNING_DIR, "folds")
+    os.makedirs(directory, exist_ok=True)
+    folds = {}
+    for year, train, test in rolling_folds(data, n_folds):
+        names = {f"{split}_x_{array}": f"{split}_x_{array}"
+                 for split in ("train", "test") for array in SPARSE_ARRAYS}
+        names.update(train_y=f"train_{target}", test_y=f"test_{target}")
+        paths = {part: os.path.join(directory, f"{key}_{year}_{name}.npy")
+                 for part, name in names.items()}
+        if not all(os.path.exists(path) for path in paths.values()):
+            encoder = rq_four.get_encoder(data.loc[train])
+            arrays = {
+                "train_y": data.loc[train, target].to_numpy("float64"),
+                "test_y": data.loc[test, target].to_numpy("float64")
+            }
+            for split, rows in (("train", train), ("test", test)):
+                features = encoder.transform(data.loc[rows])
+                arrays.update({
+                    f"{split}_x_data": features.data,
+                    f"{split}_x_indices": features.indices,
+                    f"{split}_x_indptr": features.indptr,
+                    f"{split}_x_shape": np.array(features.shape)
+                })
+            for part, array in arrays.items():
+                temp_path = f"{paths[part]}.{os.getpid()}.tmp.npy"
+                np.save(temp_path, array)
+                os.replace(temp_path, paths[part])
+        folds[year] = paths
+    return folds
+
+
+def _open_fold(paths):
+    """Returns the memory-mapped arrays of a fold, opening them once per
+    process
+    """
+
+    key = paths["train_y"]
+    if key not in _folds:
+        arrays = {part: np.load(path, mmap_mode="r")
+                  for part, path in paths.items()}
+        _folds[key] = {part: arrays[part] for part in ("train_y", "test_y")}
+        for split in ("train", "test"):
+            _folds[key][f"{split}_x"] = sparse.csr_matrix(
+                (arrays[f"{split}_x_data"], arrays[f"{split}_x_indices"],
+                 arrays[f"{split}_x_indptr"]),
+                shape=tuple(arrays[f"{split}_x_shape"]), copy=False)
+    return _folds[key]
+
+
+def score_cell(setting, paths):
+    """Fits one setting on one fold and scores it on the fold's test year
+
+    Parameters
+    ----------
+    setting : Dictionary
+        The DecisionTreeRegressor parameters
+    paths : Dictionary
+        The fold's file paths (see save_folds)
+
+    Returns
+    -------
+    Dictionary
+        Returns the mean absolute and mean squared error
+    """
+
+    fold = _open_fold(paths)
+    model = DecisionTreeRegressor(**setting)
+    model.fit(fold["train_x"], fold["train_y"])
+    predictions = model.predict(fold["test_x"])
+    return {"mae": mean_absolute_error(fold["test_y"], predictions),
+            "mse": mean_squared_error(fold["test_y"], predictions)}
+
+
+def cross_validate(data, grid=None, target="score", n_folds=5, workers=1):
+    """Scores every setting of a grid on every rolling origin fold
+
+    Parameters
+    ----------
+    data : DataFrame
+        Pandas DataFrame that contains anime show data
+    grid : Dictionary
+        DecisionTreeRegressor parameter to the values to try. Defaults to
+        GRID
+    target : String
+        The column the models predict
+    n_folds : Integer
+        The amount of folds (see rolling_folds)
+    workers : Integer
+        The amount of processes that fit models
+
+    Returns
+    -------
+    DataFrame
+        Returns a row per setting with the mean and variance of the mean
+        absolute and mean squared errors over the folds, best MAE first
+
+    Notes
+    -----
+    File Path: data/tuning/results.jsonl
+    Every finished cell (setting and fold) is saved right away with a hash
+        of the data and of the feature encoding code (see encoding_version),
+        so rerunning, resuming or growing a grid only fits the cells that are
+        missing
+    """
+
+    grid = GRID if grid is None else grid
+    folds = save_folds(data, target, n_folds)
+    data_key = artifact_cache.frame_hash(data)
+    code_key = encoding_version()
+    journal = row_journal.Journal(os.path.join(TUNING_DIR, "results.jsonl"))
+    finished = {(row["data"], row["target"], row["params"], row["year"]): row
+                for row in journal.read() if row.get("code") == code_key}
+
+    # Cells are saved under every parameter of the tree, so a setting that
+    # only spells out a default matches the cells already finished
+    settings = [dict(zip(grid, values))
+                for values in itertools.product(*grid.values())]
+    cells = [(json.dumps(setting), json.dumps(
+        DecisionTreeRegressor(**setting).get_params(), sort_keys=True),
+        setting, year) for setting in settings for year in folds]
+    missing = {(params, year): setting
+               for _, params, setting, year in cells
+               if (data_key, target, params, year) not in finished}
+
+    def save(params, year, errors):
+        row = {"data": data_key, "code": code_key, "target": target,
+               "params": params, "year": year, **errors}
+        journal.append(row)
+        finished[(data_key, target, params, year)] = row
+
+    if workers <= 1:
+        for (params, year), setting in missing.items():
+            save(params, year, score_cell(setting, folds[year]))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(score_cell, setting, folds[year]):
+                       (params, year)
+                       for (params, year), setting in missing.items()}
+            for future in as_completed(futures):
+                save(*futures[future], future.result())
+
+    results = pd.DataFrame([
+        {**finished[(data_key, target, params, year)], "setting": name}
+        for name, params, _, year in cells])
+    report = results.groupby("setting", sort=False)[["mae", "mse"]] \
+        .agg(["mean", "var"])
+    report.columns = [f"{error}_{stat}" for error, stat in report.columns]
+    return report.sort_values("mae_mean")
+
+
+def main(target="score", n_folds=5, workers=1):
+    """Cross validates the default grid on the anime from before 2018 and
+    prints the best settings
+    """
+
+    anime_data = data_loading.load("anime")
+    report = cross_validate(anime_data, target=target, n_folds=n_folds,
+                            workers=workers)
+    print(report.head(10).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--target", default="score",
+                        help="column to predict (score or favorites)")
+    parser.add_argument("--folds", type=int, default=5,
+                        help="amount of rolling origin folds (test years)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes that fit models")
+    args = parser.parse_args()
+    main(args.target, args.folds, args.workers)